@@ -3,6 +3,7 @@ import threading
 import asyncio
 import signal
 import re
+from concurrent.futures import ThreadPoolExecutor
 try:
 
     import colorama
@@ -10,9 +11,16 @@ try:
 except Exception:
     colorama_available = False
 
+try:
+    from hypercorn.asyncio import serve as hypercorn_serve
+    from hypercorn.config import Config as HypercornConfig
+except Exception:
+    hypercorn_serve = None
+
 from shop_bot.webhook_server.app import create_webhook_app
 from shop_bot.data_manager.scheduler import periodic_subscription_check
 from shop_bot.data_manager import remnawave_repository as rw_repo
+from shop_bot.modules import remnawave_api
 from shop_bot.bot_controller import BotController
 
 def main():
@@ -106,9 +114,15 @@ def main():
 
     bot_controller = BotController()
     flask_app = create_webhook_app(bot_controller)
+    web_stop: asyncio.Event | None = None
+    web_loop: asyncio.AbstractEventLoop | None = None
+    web_thread: threading.Thread | None = None
     
     async def shutdown(sig: signal.Signals, loop: asyncio.AbstractEventLoop):
         logger.info(f"Получен сигнал: {sig.name}. Запускаю завершение работы...")
+        if web_loop is not None and web_stop is not None:
+            web_loop.call_soon_threadsafe(web_stop.set)
+            await asyncio.to_thread(web_thread.join, 10)
         if bot_controller.get_status()["is_running"]:
             bot_controller.stop()
             await asyncio.sleep(2)
@@ -116,23 +130,59 @@ def main():
         if tasks:
             [task.cancel() for task in tasks]
             await asyncio.gather(*tasks, return_exceptions=True)
+        try:
+            await remnawave_api.close_http_client()
+        except Exception:
+            pass
         loop.stop()
 
     async def start_services():
+        nonlocal web_stop, web_loop, web_thread
         loop = asyncio.get_running_loop()
+        # Пул потоков цикла бота: SQLite и SSH планировщика, замеры скорости.
+        # Стандартный размер (CPU + 4) на однопроцессорных VPS слишком мал.
+        loop.set_default_executor(ThreadPoolExecutor(max_workers=32, thread_name_prefix="shopbot"))
         bot_controller.set_loop(loop)
         flask_app.config['EVENT_LOOP'] = loop
+        await remnawave_api.init_http_client()
         
         for sig in (signal.SIGINT, signal.SIGTERM):
             loop.add_signal_handler(sig, lambda sig=sig: asyncio.create_task(shutdown(sig, loop)))
         
-        flask_thread = threading.Thread(
-            target=lambda: flask_app.run(host='0.0.0.0', port=1488, use_reloader=False, debug=False),
-            daemon=True
-        )
-        flask_thread.start()
-        
-        logger.info("Flask-сервер запущен: http://0.0.0.0:1488")
+        if hypercorn_serve is not None:
+            # Hypercorn работает в отдельном потоке со своим циклом событий и пулом:
+            # WSGI-запросы панели ждут работу цикла бота (_run_on_bot_loop), поэтому
+            # общий пул потоков мог бы целиком уйти под ожидающие запросы.
+            config = HypercornConfig()
+            config.bind = ["0.0.0.0:1488"]
+            config.wsgi_max_body_size = 512 * 1024 * 1024
+            web_loop = asyncio.new_event_loop()
+            web_loop.set_default_executor(ThreadPoolExecutor(max_workers=32, thread_name_prefix="panel"))
+            web_stop = asyncio.Event()
+
+            def _serve_panel():
+                asyncio.set_event_loop(web_loop)
+                try:
+                    web_loop.run_until_complete(
+                        hypercorn_serve(flask_app, config, mode="wsgi", shutdown_trigger=web_stop.wait)
+                    )
+                    web_loop.run_until_complete(web_loop.shutdown_default_executor())
+                except Exception as e:
+                    logger.error(f"Веб-панель остановилась с ошибкой: {e}", exc_info=True)
+                finally:
+                    web_loop.close()
+
+            web_thread = threading.Thread(target=_serve_panel, name="web-panel", daemon=True)
+            web_thread.start()
+            logger.info("Веб-панель запущена (Hypercorn): http://0.0.0.0:1488")
+        else:
+            flask_thread = threading.Thread(
+                target=lambda: flask_app.run(host='0.0.0.0', port=1488, use_reloader=False, debug=False),
+                daemon=True
+            )
+            flask_thread.start()
+
+            logger.info("Flask-сервер запущен: http://0.0.0.0:1488")
             
         logger.info("Приложение запущено. Бота можно стартовать из веб-панели.")
         
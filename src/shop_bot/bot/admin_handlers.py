@@ -1,11 +1,9 @@
 import logging
 import asyncio
-import time
 import uuid
 import re
 import html as html_escape
 import hashlib
-import json
 from datetime import datetime, timedelta
 
 from aiogram import Bot, Router, F, types
@@ -2231,23 +2229,8 @@ def get_admin_router() -> Router:
             return
 
         user = get_user(user_id) or {}
-        username = (user.get('username') or f'user{user_id}').lower()
-        username_slug = re.sub(r"[^a-z0-9._-]", "_", username).strip("_")[:16] or f"user{user_id}"
-        base_local = f"gift_{username_slug}"
-        candidate_local = base_local
-        attempt = 1
-        while True:
-            candidate_email = f"{candidate_local}@bot.local"
-            existing = rw_repo.get_key_by_email(candidate_email)
-            if not existing:
-                break
-            attempt += 1
-            candidate_local = f"{base_local}-{attempt}"
-            if attempt > 100:
-                candidate_local = f"{base_local}-{int(time.time())}"
-                candidate_email = f"{candidate_local}@bot.local"
-                break
-        generated_email = candidate_email
+        username_slug = rw_repo.key_email_slug(user.get('username'), user_id)
+        generated_email = rw_repo.next_free_key_email(f"gift_{username_slug}")
 
 
         try:
@@ -2982,11 +2965,11 @@ def get_admin_router() -> Router:
                 is_remote = True
             else:
 
-                data = resource_monitor.get_local_metrics()
+                data = await resource_monitor.get_local_metrics_async()
                 is_remote = False
         except Exception:
 
-            data = resource_monitor.get_local_metrics()
+            data = await resource_monitor.get_local_metrics_async()
             is_remote = False
         
         try:
@@ -3018,7 +3001,7 @@ def get_admin_router() -> Router:
                 load1=load1,
                 net_bytes_sent=net_sent,
                 net_bytes_recv=net_recv,
-                raw_json=json.dumps(data, ensure_ascii=False)
+                raw_json=resource_monitor.dumps_metrics(resource_monitor.flatten_metrics(data))
             )
         except Exception:
             pass
@@ -3154,7 +3137,7 @@ def get_admin_router() -> Router:
                 mem_percent=mem_p,
                 disk_percent=disk_p,
                 load1=(data.get('loadavg') or [None])[0],
-                raw_json=json.dumps(data, ensure_ascii=False)
+                raw_json=resource_monitor.dumps_metrics(resource_monitor.flatten_metrics(data))
             )
         except Exception:
             pass
@@ -3284,7 +3267,7 @@ def get_admin_router() -> Router:
                 mem_percent=mem_p,
                 disk_percent=disk_p,
                 load1=(data.get('loadavg') or [None])[0],
-                raw_json=json.dumps(data, ensure_ascii=False)
+                raw_json=resource_monitor.dumps_metrics(resource_monitor.flatten_metrics(data))
             )
         except Exception:
             pass
@@ -3380,7 +3363,7 @@ def get_admin_router() -> Router:
             return
         
         await callback.answer("🔄 Получение детальной статистики...")
-        data = resource_monitor.get_local_metrics()
+        data = await resource_monitor.get_local_metrics_async()
         
         if not data.get('ok'):
             txt = [
@@ -1317,14 +1317,15 @@ def get_user_router() -> Router:
         except Exception:
             targets = []
         lines = []
+        try:
+            latest = rw_repo.get_latest_speedtests_for_hosts([(t.get('target_name') or '').strip() for t in targets])
+        except Exception:
+            latest = {}
         for t in targets:
             name = (t.get('target_name') or '').strip()
             if not name:
                 continue
-            try:
-                last = rw_repo.get_latest_speedtest(name)
-            except Exception:
-                last = None
+            last = latest.get(name)
             if not last:
                 lines.append(f"• <b>{name}</b>: данных нет")
                 continue
@@ -1622,21 +1623,8 @@ def get_user_router() -> Router:
         try:
 
             user_data = get_user(user_id) or {}
-            raw_username = (user_data.get('username') or f'user{user_id}').lower()
-            username_slug = re.sub(r"[^a-z0-9._-]", "_", raw_username).strip("_")[:16] or f"user{user_id}"
-            base_local = f"trial_{username_slug}"
-            candidate_local = base_local
-            attempt = 1
-            while True:
-                candidate_email = f"{candidate_local}@bot.local"
-                if not rw_repo.get_key_by_email(candidate_email):
-                    break
-                attempt += 1
-                candidate_local = f"{base_local}-{attempt}"
-                if attempt > 100:
-                    candidate_local = f"{base_local}-{int(datetime.now().timestamp())}"
-                    candidate_email = f"{candidate_local}@bot.local"
-                    break
+            username_slug = rw_repo.key_email_slug(user_data.get('username'), user_id)
+            candidate_email = rw_repo.next_free_key_email(f"trial_{username_slug}")
 
             result = await remnawave_api.create_or_update_key_on_host(
                 host_name=host_name,
@@ -3003,21 +2991,7 @@ async def process_successful_payment(bot: Bot, metadata: dict):
         if action == "new":
 
             user_data = get_user(user_id) or {}
-            raw_username = (user_data.get('username') or f'user{user_id}').lower()
-            username_slug = re.sub(r"[^a-z0-9._-]", "_", raw_username).strip("_")[:16] or f"user{user_id}"
-            base_local = f"{username_slug}"
-            candidate_local = base_local
-            attempt = 1
-            while True:
-                candidate_email = f"{candidate_local}@bot.local"
-                if not rw_repo.get_key_by_email(candidate_email):
-                    break
-                attempt += 1
-                candidate_local = f"{base_local}-{attempt}"
-                if attempt > 100:
-                    candidate_local = f"{base_local}-{int(datetime.now().timestamp())}"
-                    candidate_email = f"{candidate_local}@bot.local"
-                    break
+            candidate_email = rw_repo.next_free_key_email(rw_repo.key_email_slug(user_data.get('username'), user_id))
         else:
 
             existing_key = rw_repo.get_key_by_id(key_id)
@@ -1,4 +1,5 @@
 import sqlite3
+from contextlib import nullcontext
 from datetime import datetime, timezone
 import logging
 from pathlib import Path
@@ -24,6 +25,11 @@ else:
     DB_FILE = Path("users.db")
 
 
+def _read_conn(conn: sqlite3.Connection | None):
+    """Соединение из пула репозитория (без закрытия) или новое на один вызов."""
+    return nullcontext(conn) if conn is not None else sqlite3.connect(DB_FILE)
+
+
 def _now_str() -> str:
     return datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
 
@@ -450,6 +456,10 @@ def _ensure_hosts_columns(cursor: sqlite3.Cursor) -> None:
     }
     for column, definition in extras.items():
         _ensure_table_column(cursor, "xui_hosts", column, definition)
+    cursor.execute("UPDATE xui_hosts SET is_active = 1 WHERE is_active IS NULL")
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_xui_hosts_active_order ON xui_hosts(sort_order, host_name) WHERE is_active = 1"
+    )
 
 
 def _ensure_plans_columns(cursor: sqlite3.Cursor) -> None:
@@ -475,7 +485,42 @@ def _ensure_support_tickets_columns(cursor: sqlite3.Cursor) -> None:
         _ensure_table_column(cursor, "support_tickets", column, definition)
 
 
+def _ensure_vpn_keys_email_norm(cursor: sqlite3.Cursor) -> None:
+    """Уникальный индекс по lower(trim(email)) для UPSERT ключей.
+    Если в старой базе есть email, различающиеся только регистром или пробелами,
+    индекс не создаётся и UPSERT работает по точному email (см. _key_upsert_sql).
+    """
+    cursor.execute("PRAGMA table_xinfo(vpn_keys)")
+    if "email_norm" in {row[1] for row in cursor.fetchall()}:
+        # Прежняя схема: генерируемый столбец попадал в каждый SELECT * по ключам.
+        cursor.execute("DROP INDEX IF EXISTS uq_vpn_keys_email_norm")
+        try:
+            cursor.execute("ALTER TABLE vpn_keys DROP COLUMN email_norm")
+        except sqlite3.OperationalError as e:
+            logging.warning("Не удалось удалить столбец vpn_keys.email_norm: %s", e)
+    cursor.execute(
+        """
+        SELECT lower(trim(email)) FROM vpn_keys
+        WHERE email IS NOT NULL
+        GROUP BY lower(trim(email))
+        HAVING COUNT(*) > 1
+        LIMIT 20
+        """
+    )
+    duplicates = [row[0] for row in cursor.fetchall()]
+    if duplicates:
+        cursor.execute("DROP INDEX IF EXISTS uq_vpn_keys_email_norm")
+        logging.warning(
+            "vpn_keys: email, различающиеся регистром или пробелами, мешают индексу uq_vpn_keys_email_norm; "
+            "ключи обновляются по точному email. Дубликаты: %s",
+            ", ".join(duplicates),
+        )
+        return
+    _ensure_unique_index(cursor, "uq_vpn_keys_email_norm", "vpn_keys", "lower(trim(email))")
+
+
 def _finalize_vpn_key_indexes(cursor: sqlite3.Cursor) -> None:
+    _ensure_vpn_keys_email_norm(cursor)
     _ensure_unique_index(cursor, "uq_vpn_keys_email", "vpn_keys", "email")
     _ensure_unique_index(cursor, "uq_vpn_keys_key_email", "vpn_keys", "key_email")
     _ensure_index(cursor, "idx_vpn_keys_user_id", "vpn_keys", "user_id")
@@ -690,6 +735,41 @@ def insert_resource_metric(
         return None
 
 
+def insert_resource_metrics(rows: list[dict]) -> int:
+    """Пакетный insert_resource_metric одной транзакцией.
+    Каждая строка — dict с ключами scope, object_name и необязательными метриками.
+    Возвращает число вставленных строк.
+    """
+    params = [
+        (
+            (row.get('scope') or '').strip(),
+            (row.get('object_name') or '').strip(),
+            row.get('cpu_percent'), row.get('mem_percent'), row.get('disk_percent'), row.get('load1'),
+            row.get('net_bytes_sent'), row.get('net_bytes_recv'), row.get('raw_json'),
+        )
+        for row in rows
+    ]
+    if not params:
+        return 0
+    try:
+        with sqlite3.connect(DB_FILE) as conn:
+            cursor = conn.cursor()
+            cursor.executemany(
+                '''
+                INSERT INTO resource_metrics (
+                    scope, object_name, cpu_percent, mem_percent, disk_percent, load1,
+                    net_bytes_sent, net_bytes_recv, raw_json
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''',
+                params,
+            )
+            conn.commit()
+            return cursor.rowcount
+    except sqlite3.Error as e:
+        logging.error("Failed to insert %s resource metrics: %s", len(params), e)
+        return 0
+
+
 def get_latest_resource_metric(scope: str, object_name: str) -> dict | None:
     try:
         with sqlite3.connect(DB_FILE) as conn:
@@ -711,11 +791,12 @@ def get_latest_resource_metric(scope: str, object_name: str) -> dict | None:
         return None
 
 
-def get_metrics_series(scope: str, object_name: str, *, since_hours: int = 24, limit: int = 500) -> list[dict]:
+def get_metrics_series(scope: str, object_name: str, *, since_hours: int = 24, limit: int = 500,
+                       conn: sqlite3.Connection | None = None) -> list[dict]:
     try:
-        with sqlite3.connect(DB_FILE) as conn:
-            conn.row_factory = sqlite3.Row
+        with _read_conn(conn) as conn:
             cursor = conn.cursor()
+            cursor.row_factory = sqlite3.Row
             
 
 
@@ -1080,6 +1161,44 @@ def get_latest_speedtest(host_name: str) -> dict | None:
         logging.error(f"Не удалось получить последний speedtest для хоста '{host_name}': {e}")
         return None
 
+def get_latest_speedtests_for_hosts(host_names: list[str]) -> dict[str, dict]:
+    """Последний спидтест для каждого из хостов одним запросом: {host_name: row}."""
+    by_norm: dict[str, list[str]] = {}
+    for name in host_names:
+        by_norm.setdefault(normalize_host_name(name), []).append(name)
+    by_norm.pop("", None)
+    if not by_norm:
+        return {}
+    result: dict[str, dict] = {}
+    try:
+        with sqlite3.connect(DB_FILE) as conn:
+            conn.row_factory = sqlite3.Row
+            cursor = conn.cursor()
+            # host_name нормализуется при вставке: сравнение без TRIM() даёт по одному
+            # поиску в idx_host_speedtests_host_time на хост вместо скана всей истории.
+            values = ",".join(["(?)"] * len(by_norm))
+            cursor.execute(
+                f"""
+                WITH names(name) AS (VALUES {values})
+                SELECT t.id, t.host_name, t.method, t.ping_ms, t.jitter_ms, t.download_mbps, t.upload_mbps,
+                       t.server_name, t.server_id, t.ok, t.error, t.created_at
+                FROM names
+                JOIN host_speedtests t ON t.id = (
+                    SELECT id FROM host_speedtests
+                    WHERE host_name = names.name
+                    ORDER BY created_at DESC, id DESC
+                    LIMIT 1
+                )
+                """,
+                tuple(by_norm),
+            )
+            for row in cursor.fetchall():
+                for name in by_norm.get(row['host_name'], ()):
+                    result[name] = dict(row)
+    except sqlite3.Error as e:
+        logging.error(f"Не удалось получить последние speedtest для хостов {host_names}: {e}")
+    return result
+
 def insert_host_speedtest(
     host_name: str,
     method: str,
@@ -1170,6 +1289,7 @@ def _ensure_gift_tokens_table(cursor: sqlite3.Cursor) -> None:
             activation_limit INTEGER DEFAULT 1,
             activations_used INTEGER DEFAULT 0,
             expires_at TIMESTAMP,
+            expires_at_ms INTEGER,
             created_by INTEGER,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             last_claimed_at TIMESTAMP,
@@ -1177,6 +1297,14 @@ def _ensure_gift_tokens_table(cursor: sqlite3.Cursor) -> None:
         )
         """
     )
+    _ensure_table_column(cursor, "gift_tokens", "expires_at_ms", "INTEGER")
+    cursor.execute(
+        """
+        UPDATE gift_tokens
+        SET expires_at_ms = CAST(strftime('%s', expires_at) AS INTEGER) * 1000
+        WHERE expires_at IS NOT NULL AND expires_at_ms IS NULL
+        """
+    )
     _ensure_index(cursor, "idx_gift_tokens_host", "gift_tokens", "host_name")
     _ensure_index(cursor, "idx_gift_tokens_expires", "gift_tokens", "expires_at")
     cursor.execute(
@@ -1195,24 +1323,91 @@ def _ensure_gift_tokens_table(cursor: sqlite3.Cursor) -> None:
     _ensure_index(cursor, "idx_gift_token_claims_user", "gift_token_claims", "user_id")
 
 
+_PROMO_CODES_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS {table} (
+        code TEXT PRIMARY KEY COLLATE NOCASE,
+        discount_percent REAL,
+        discount_amount REAL,
+        usage_limit_total INTEGER,
+        usage_limit_per_user INTEGER,
+        used_total INTEGER DEFAULT 0,
+        valid_from TIMESTAMP,
+        valid_until TIMESTAMP,
+        valid_from_ms INTEGER,
+        valid_until_ms INTEGER,
+        is_active INTEGER DEFAULT 1,
+        created_by INTEGER,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        description TEXT
+    )
+"""
+
+
+def _rename_promo_code_case_duplicates(cursor: sqlite3.Cursor) -> None:
+    """Переименовать коды, совпадающие с другими без учёта регистра, иначе копия в NOCASE-таблицу упадёт.
+    В группе остаётся код в верхнем регистре (только такие находил прежний поиск), иначе — самый ранний;
+    остальные получают суффикс -dup<rowid>, история их использования переносится вместе с ними.
+    """
+    cursor.execute(
+        """
+        SELECT rowid, code FROM promo_codes
+        WHERE lower(code) IN (SELECT lower(code) FROM promo_codes GROUP BY lower(code) HAVING COUNT(*) > 1)
+        ORDER BY lower(code), code = upper(code) DESC, rowid
+        """
+    )
+    rows = cursor.fetchall()
+    if not rows:
+        return
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='promo_code_usages'")
+    has_usages = cursor.fetchone() is not None
+    kept: set[str] = set()
+    for rowid, code in rows:
+        if code.lower() not in kept:
+            kept.add(code.lower())
+            continue
+        new_code = f"{code}-dup{rowid}"
+        cursor.execute("UPDATE promo_codes SET code = ? WHERE rowid = ?", (new_code, rowid))
+        if has_usages:
+            cursor.execute("UPDATE promo_code_usages SET code = ? WHERE code = ?", (new_code, code))
+        logging.warning(f"Промокод '{code}' совпадает с другим без учёта регистра и переименован в '{new_code}'")
+
+
+def _rebuild_promo_codes_nocase(cursor: sqlite3.Cursor) -> None:
+    """Пересоздать promo_codes с COLLATE NOCASE на code, если таблица создана старой схемой."""
+    cursor.execute("SELECT sql FROM sqlite_master WHERE type='table' AND name='promo_codes'")
+    row = cursor.fetchone()
+    if row is None or "NOCASE" in (row[0] or "").upper():
+        return
+    _rename_promo_code_case_duplicates(cursor)
+    cursor.execute(_PROMO_CODES_TABLE_SQL.format(table="promo_codes_new"))
+    new_columns = _get_table_columns(cursor, "promo_codes_new")
+    shared = ", ".join(c for c in _get_table_columns(cursor, "promo_codes") if c in new_columns)
+    cursor.execute(f"INSERT INTO promo_codes_new ({shared}) SELECT {shared} FROM promo_codes")
+    cursor.execute("DROP TABLE promo_codes")
+    cursor.execute("ALTER TABLE promo_codes_new RENAME TO promo_codes")
+
+
 def _ensure_promo_tables(cursor: sqlite3.Cursor) -> None:
     """Создание таблиц промокодов и истории их использования."""
+    cursor.execute(_PROMO_CODES_TABLE_SQL.format(table="promo_codes"))
+    _ensure_table_column(cursor, "promo_codes", "valid_from_ms", "INTEGER")
+    _ensure_table_column(cursor, "promo_codes", "valid_until_ms", "INTEGER")
+    _rebuild_promo_codes_nocase(cursor)
     cursor.execute(
         """
-        CREATE TABLE IF NOT EXISTS promo_codes (
-            code TEXT PRIMARY KEY,
-            discount_percent REAL,
-            discount_amount REAL,
-            usage_limit_total INTEGER,
-            usage_limit_per_user INTEGER,
-            used_total INTEGER DEFAULT 0,
-            valid_from TIMESTAMP,
-            valid_until TIMESTAMP,
-            is_active INTEGER DEFAULT 1,
-            created_by INTEGER,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            description TEXT
-        )
+        UPDATE promo_codes
+        SET valid_from_ms = CASE
+                WHEN valid_from IS NOT NULL AND valid_from_ms IS NULL
+                THEN CAST(strftime('%s', valid_from) AS INTEGER) * 1000
+                ELSE valid_from_ms
+            END,
+            valid_until_ms = CASE
+                WHEN valid_until IS NOT NULL AND valid_until_ms IS NULL
+                THEN CAST(strftime('%s', valid_until) AS INTEGER) * 1000
+                ELSE valid_until_ms
+            END
+        WHERE (valid_from IS NOT NULL AND valid_from_ms IS NULL)
+           OR (valid_until IS NOT NULL AND valid_until_ms IS NULL)
         """
     )
     _ensure_index(cursor, "idx_promo_codes_valid", "promo_codes", "valid_until")
@@ -1231,6 +1426,7 @@ def _ensure_promo_tables(cursor: sqlite3.Cursor) -> None:
     )
     _ensure_index(cursor, "idx_promo_code_usages_code", "promo_code_usages", "code")
     _ensure_index(cursor, "idx_promo_code_usages_user", "promo_code_usages", "user_id")
+    _ensure_index(cursor, "idx_promo_code_usages_code_user", "promo_code_usages", "code, user_id")
 
 
 def get_all_ssh_targets() -> list[dict]:
@@ -1472,6 +1668,33 @@ def get_all_keys() -> list[dict]:
         return []
 
 
+_EXPIRED_KEY_COLUMNS = "key_id, user_id, host_name, squad_uuid, email, key_email, expire_at"
+
+
+def get_expired_keys() -> list[dict]:
+    """Ключи с истёкшим сроком (только поля для удаления и уведомления); ключи без срока не попадают.
+
+    Грубый строковый фильтр по expire_at идёт по индексу idx_vpn_keys_expire_at с запасом
+    на часовые пояса в ISO-строках; точное сравнение делает datetime().
+    """
+    try:
+        with sqlite3.connect(DB_FILE) as conn:
+            conn.row_factory = sqlite3.Row
+            cursor = conn.cursor()
+            cursor.execute(
+                f"""
+                SELECT {_EXPIRED_KEY_COLUMNS}
+                FROM vpn_keys
+                WHERE expire_at < date('now', '+2 days')
+                  AND datetime(expire_at) <= CURRENT_TIMESTAMP
+                """
+            )
+            return [_normalize_key_row(row) for row in cursor.fetchall()]
+    except sqlite3.Error as e:
+        logging.error(f"Failed to get expired keys: {e}")
+        return []
+
+
 def get_keys_for_user(user_id: int) -> list[dict]:
     return get_user_keys(user_id)
 
@@ -1516,6 +1739,23 @@ def get_setting(key: str) -> str | None:
         logging.error(f"Failed to get setting '{key}': {e}")
         return None
 
+def get_settings_bulk(keys: list[str]) -> dict[str, str | None]:
+    """Несколько настроек одним запросом; отсутствующие ключи возвращаются как None."""
+    result: dict[str, str | None] = dict.fromkeys(keys)
+    if not keys:
+        return result
+    try:
+        with sqlite3.connect(DB_FILE) as conn:
+            placeholders = ",".join("?" * len(keys))
+            for key, value in conn.execute(
+                f"SELECT key, value FROM bot_settings WHERE key IN ({placeholders})",
+                tuple(keys),
+            ):
+                result[key] = value
+    except sqlite3.Error as e:
+        logging.error(f"Failed to get settings {keys}: {e}")
+    return result
+
 def get_admin_ids() -> set[int]:
     """Возвращает множество ID администраторов из настроек.
     Поддерживает оба варианта: одиночный 'admin_telegram_id' и список 'admin_telegram_ids'
@@ -2440,6 +2680,34 @@ def get_total_spent_sum() -> float:
         logging.error(f"Failed to get total spent sum: {e}")
         return 0.0
 
+def get_dashboard_stats() -> dict:
+    """Счётчики дашборда одним запросом: user_count, total_keys, total_spent, host_count."""
+    try:
+        with sqlite3.connect(DB_FILE) as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                SELECT
+                    (SELECT COUNT(*) FROM users),
+                    (SELECT COUNT(*) FROM vpn_keys),
+                    (SELECT COALESCE(SUM(amount_rub), 0.0)
+                       FROM transactions
+                      WHERE LOWER(COALESCE(status, '')) IN ('paid', 'completed', 'success')
+                        AND LOWER(COALESCE(payment_method, '')) <> 'balance'),
+                    (SELECT COUNT(*) FROM xui_hosts)
+                """
+            )
+            user_count, total_keys, total_spent, host_count = cursor.fetchone()
+            return {
+                "user_count": user_count or 0,
+                "total_keys": total_keys or 0,
+                "total_spent": total_spent or 0.0,
+                "host_count": host_count or 0,
+            }
+    except sqlite3.Error as e:
+        logging.error(f"Failed to get dashboard stats: {e}")
+        return {"user_count": 0, "total_keys": 0, "total_spent": 0.0, "host_count": 0}
+
 def create_pending_transaction(payment_id: str, user_id: int, amount_rub: float, metadata: dict) -> int:
     try:
         with sqlite3.connect(DB_FILE) as conn:
@@ -2492,14 +2760,15 @@ def log_transaction(username: str, transaction_id: str | None, payment_id: str |
     except sqlite3.Error as e:
         logging.error(f"Failed to log transaction for user {user_id}: {e}")
 
-def get_paginated_transactions(page: int = 1, per_page: int = 15) -> tuple[list[dict], int]:
+def get_paginated_transactions(page: int = 1, per_page: int = 15,
+                               conn: sqlite3.Connection | None = None) -> tuple[list[dict], int]:
     offset = (page - 1) * per_page
     transactions = []
     total = 0
     try:
-        with sqlite3.connect(DB_FILE) as conn:
-            conn.row_factory = sqlite3.Row
+        with _read_conn(conn) as conn:
             cursor = conn.cursor()
+            cursor.row_factory = sqlite3.Row
             
             cursor.execute("SELECT COUNT(*) FROM transactions")
             total = cursor.fetchone()[0]
@@ -2615,6 +2884,159 @@ def add_new_key(
         return None
 
 
+_REBIND_KEY_EMAIL_BY_UUID_SQL = """
+    UPDATE vpn_keys
+    SET email = lower(trim(:email)), key_email = lower(trim(:email))
+    WHERE key_id = (
+            SELECT key_id FROM vpn_keys WHERE remnawave_user_uuid = :remnawave_user_uuid LIMIT 1
+        )
+      AND COALESCE(:remnawave_user_uuid, '') != ''
+      AND NOT EXISTS (SELECT 1 FROM vpn_keys WHERE lower(trim(email)) = lower(trim(:email)))
+"""
+
+_UPSERT_KEY_SQL_TEMPLATE = """
+    INSERT INTO vpn_keys (
+        user_id,
+        host_name,
+        squad_uuid,
+        remnawave_user_uuid,
+        short_uuid,
+        email,
+        key_email,
+        subscription_url,
+        expire_at,
+        created_at,
+        updated_at,
+        traffic_limit_bytes,
+        traffic_limit_strategy,
+        tag,
+        description
+    ) VALUES (
+        :user_id,
+        NULLIF(trim(replace(replace(replace(replace(replace(
+            :host_name, char(160), ''), char(8203), ''), char(8204), ''), char(8205), ''), char(65279), ''),
+            ' ' || char(9, 10, 13)), ''),
+        :squad_uuid,
+        :remnawave_user_uuid,
+        :short_uuid,
+        lower(trim(:email)),
+        lower(trim(:email)),
+        :subscription_url,
+        :expire_at,
+        :now,
+        :now,
+        :traffic_limit_bytes,
+        COALESCE(:traffic_limit_strategy, 'NO_RESET'),
+        :tag,
+        :description
+    )
+    ON CONFLICT({conflict_target}) DO UPDATE SET
+        host_name = COALESCE(NULLIF(excluded.host_name, ''), vpn_keys.host_name),
+        squad_uuid = COALESCE(NULLIF(excluded.squad_uuid, ''), vpn_keys.squad_uuid),
+        remnawave_user_uuid = COALESCE(NULLIF(excluded.remnawave_user_uuid, ''), vpn_keys.remnawave_user_uuid),
+        short_uuid = COALESCE(NULLIF(excluded.short_uuid, ''), vpn_keys.short_uuid),
+        subscription_url = COALESCE(excluded.subscription_url, vpn_keys.subscription_url),
+        expire_at = excluded.expire_at,
+        updated_at = excluded.updated_at,
+        traffic_limit_bytes = COALESCE(excluded.traffic_limit_bytes, vpn_keys.traffic_limit_bytes),
+        traffic_limit_strategy = COALESCE(:traffic_limit_strategy, vpn_keys.traffic_limit_strategy),
+        tag = COALESCE(excluded.tag, vpn_keys.tag),
+        description = COALESCE(excluded.description, vpn_keys.description)
+"""
+_UPSERT_KEY_SQL = _UPSERT_KEY_SQL_TEMPLATE.format(conflict_target="lower(trim(email))")
+# Для баз, где uq_vpn_keys_email_norm не создан из-за дубликатов email.
+_UPSERT_KEY_SQL_EXACT = _UPSERT_KEY_SQL_TEMPLATE.format(conflict_target="email")
+_email_norm_index_ready = False
+
+
+def _key_upsert_sql(cursor: sqlite3.Cursor) -> str:
+    """UPSERT по lower(trim(email)), если есть индекс, иначе по точному email."""
+    global _email_norm_index_ready
+    if not _email_norm_index_ready:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'uq_vpn_keys_email_norm'")
+        if cursor.fetchone() is None:
+            return _UPSERT_KEY_SQL_EXACT
+        _email_norm_index_ready = True
+    return _UPSERT_KEY_SQL
+
+
+def _key_upsert_params(
+    user_id: int,
+    host_name: str | None,
+    remnawave_user_uuid: str | None,
+    key_email: str,
+    expiry_timestamp_ms: int | None,
+    *,
+    squad_uuid: str | None = None,
+    short_uuid: str | None = None,
+    subscription_url: str | None = None,
+    traffic_limit_bytes: int | None = None,
+    traffic_limit_strategy: str | None = None,
+    description: str | None = None,
+    tag: str | None = None,
+) -> dict[str, Any]:
+    now_str = _now_str()
+    return {
+        "user_id": user_id,
+        "host_name": host_name,
+        "squad_uuid": squad_uuid,
+        "remnawave_user_uuid": remnawave_user_uuid,
+        "short_uuid": short_uuid,
+        "email": key_email,
+        "subscription_url": subscription_url,
+        "expire_at": _to_datetime_str(expiry_timestamp_ms) or now_str,
+        "now": now_str,
+        "traffic_limit_bytes": traffic_limit_bytes,
+        "traffic_limit_strategy": traffic_limit_strategy or None,
+        "tag": tag,
+        "description": description,
+    }
+
+
+def upsert_key(
+    user_id: int,
+    host_name: str | None,
+    remnawave_user_uuid: str | None,
+    key_email: str,
+    expiry_timestamp_ms: int | None,
+    **fields: Any,
+) -> int | None:
+    """Создать ключ или обновить существующий (по email, затем по UUID Remnawave) без предварительных SELECT."""
+    params = _key_upsert_params(user_id, host_name, remnawave_user_uuid, key_email, expiry_timestamp_ms, **fields)
+    if not (key_email or "").strip():
+        logging.error("Failed to upsert key for user %s: email is required", user_id)
+        return None
+    try:
+        with sqlite3.connect(DB_FILE) as conn:
+            cursor = conn.cursor()
+            cursor.execute(_REBIND_KEY_EMAIL_BY_UUID_SQL, params)
+            cursor.execute(_key_upsert_sql(cursor) + " RETURNING key_id", params)
+            row = cursor.fetchone()
+            conn.commit()
+            return row[0] if row else None
+    except sqlite3.Error as e:
+        logging.error("Failed to upsert key for user %s: %s", user_id, e)
+        return None
+
+
+def upsert_keys(rows: list[dict[str, Any]]) -> int:
+    """Пакетный вариант upsert_key: rows — словари с аргументами upsert_key. Возвращает число записей."""
+    params = [_key_upsert_params(**row) for row in rows]
+    params = [item for item in params if (item["email"] or "").strip()]
+    if not params:
+        return 0
+    try:
+        with sqlite3.connect(DB_FILE) as conn:
+            cursor = conn.cursor()
+            cursor.executemany(_REBIND_KEY_EMAIL_BY_UUID_SQL, params)
+            cursor.executemany(_key_upsert_sql(cursor), params)
+            conn.commit()
+            return len(params)
+    except sqlite3.Error as e:
+        logging.error("Failed to upsert %s keys: %s", len(params), e)
+        return 0
+
+
 def _apply_key_updates(key_id: int, updates: dict[str, Any]) -> bool:
     if not updates:
         return False
@@ -2745,6 +3167,55 @@ def get_key_by_email(key_email: str) -> dict | None:
         return None
 
 
+def _like_escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def get_taken_key_emails(base_local: str, domain: str = "bot.local") -> set[str]:
+    """Занятые адреса вида base_local*@domain одним запросом (для подбора свободного email)."""
+    base_local = (base_local or "").strip().lower()
+    domain = (domain or "").strip().lower()
+    pattern = f"{_like_escape(base_local)}%@{_like_escape(domain)}"
+    taken: set[str] = set()
+    try:
+        with sqlite3.connect(DB_FILE) as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT email, key_email FROM vpn_keys "
+                "WHERE email LIKE ? ESCAPE '\\' OR key_email LIKE ? ESCAPE '\\'",
+                (pattern, pattern),
+            )
+            for email, key_email in cursor.fetchall():
+                for value in (email, key_email):
+                    if value:
+                        taken.add(value.strip().lower())
+    except sqlite3.Error as e:
+        logging.error("Failed to get taken key emails for %s@%s: %s", base_local, domain, e)
+    return taken
+
+
+_EMAIL_SLUG_RE = re.compile(r"[^a-z0-9._-]")
+
+
+def key_email_slug(username: str | None, user_id: int) -> str:
+    """Локальная часть email ключа из username: безопасные символы, не длиннее 16."""
+    raw = (username or f"user{user_id}").lower()
+    return _EMAIL_SLUG_RE.sub("_", raw).strip("_")[:16] or f"user{user_id}"
+
+
+def next_free_key_email(base_local: str, domain: str = "bot.local", *, first_suffix: int = 2) -> str:
+    """Первый свободный из base_local@domain, base_local-<first_suffix>@domain, ... без запроса на каждый вариант."""
+    base_local = (base_local or "").strip().lower()
+    domain = (domain or "").strip().lower()
+    taken = get_taken_key_emails(base_local, domain)
+    candidate = f"{base_local}@{domain}"
+    suffix = first_suffix
+    while candidate in taken:
+        candidate = f"{base_local}-{suffix}@{domain}"
+        suffix += 1
+    return candidate
+
+
 def get_key_by_remnawave_uuid(remnawave_uuid: str) -> dict | None:
     if not remnawave_uuid:
         return None
@@ -2823,26 +3294,32 @@ def get_all_vpn_users() -> list[dict]:
         return []
 
 
+def _server_key_fields(client_data) -> tuple[str | None, int | None, str | None]:
+    """(remnawave_user_uuid, expiry_ms, subscription_url) из ответа панели (dict или объект)."""
+    if isinstance(client_data, dict):
+        remote_uuid = client_data.get('uuid') or client_data.get('id')
+        expire_value = client_data.get('expireAt') or client_data.get('expiryDate')
+        subscription_url = client_data.get('subscriptionUrl') or client_data.get('subscription_url')
+        expiry_ms = None
+        if expire_value:
+            try:
+                remote_dt = datetime.fromisoformat(str(expire_value).replace('Z', '+00:00'))
+                expiry_ms = int(remote_dt.timestamp() * 1000)
+            except Exception:
+                expiry_ms = None
+    else:
+        remote_uuid = getattr(client_data, 'id', None) or getattr(client_data, 'uuid', None)
+        expiry_ms = getattr(client_data, 'expiry_time', None)
+        subscription_url = getattr(client_data, 'subscription_url', None)
+    return remote_uuid, expiry_ms, subscription_url
+
+
 def update_key_status_from_server(key_email: str, client_data) -> bool:
     try:
         normalized_email = _normalize_email(key_email) or key_email.strip()
         existing = get_key_by_email(normalized_email)
         if client_data:
-            if isinstance(client_data, dict):
-                remote_uuid = client_data.get('uuid') or client_data.get('id')
-                expire_value = client_data.get('expireAt') or client_data.get('expiryDate')
-                subscription_url = client_data.get('subscriptionUrl') or client_data.get('subscription_url')
-                expiry_ms = None
-                if expire_value:
-                    try:
-                        remote_dt = datetime.fromisoformat(str(expire_value).replace('Z', '+00:00'))
-                        expiry_ms = int(remote_dt.timestamp() * 1000)
-                    except Exception:
-                        expiry_ms = None
-            else:
-                remote_uuid = getattr(client_data, 'id', None) or getattr(client_data, 'uuid', None)
-                expiry_ms = getattr(client_data, 'expiry_time', None)
-                subscription_url = getattr(client_data, 'subscription_url', None)
+            remote_uuid, expiry_ms, subscription_url = _server_key_fields(client_data)
             if not existing:
                 return False
             return update_key_fields(
@@ -2859,11 +3336,78 @@ def update_key_status_from_server(key_email: str, client_data) -> bool:
         return False
 
 
-def get_daily_stats_for_charts(days: int = 30) -> dict:
-    stats = {'users': {}, 'keys': {}}
+_UPDATE_KEY_FROM_SERVER_SQL = """
+    UPDATE vpn_keys SET
+        remnawave_user_uuid = COALESCE(:remnawave_user_uuid, remnawave_user_uuid),
+        expire_at = COALESCE(:expire_at, expire_at),
+        subscription_url = COALESCE(:subscription_url, subscription_url),
+        updated_at = :updated_at
+    WHERE key_id = (SELECT key_id FROM vpn_keys WHERE email = :email OR key_email = :email LIMIT 1)
+      AND (:remnawave_user_uuid IS NOT NULL OR :expire_at IS NOT NULL OR :subscription_url IS NOT NULL)
+"""
+
+
+def update_keys_from_server(rows: list[tuple[str, Any]]) -> int:
+    """Пакетный update_key_status_from_server для пар (email, client_data) с непустыми данными панели.
+    Возвращает число обновлённых ключей.
+    """
+    now = _now_str()
+    params = []
+    for key_email, client_data in rows:
+        lookup = _normalize_email(key_email) or (key_email or "").strip()
+        if not lookup or not client_data:
+            continue
+        remote_uuid, expiry_ms, subscription_url = _server_key_fields(client_data)
+        params.append({
+            "email": lookup,
+            "remnawave_user_uuid": remote_uuid,
+            "expire_at": (_to_datetime_str(expiry_ms) or now) if expiry_ms is not None else None,
+            "subscription_url": subscription_url,
+            "updated_at": now,
+        })
+    if not params:
+        return 0
     try:
         with sqlite3.connect(DB_FILE) as conn:
             cursor = conn.cursor()
+            cursor.executemany(_UPDATE_KEY_FROM_SERVER_SQL, params)
+            conn.commit()
+            return cursor.rowcount
+    except sqlite3.Error as e:
+        logging.error("Failed to update %s keys from server: %s", len(params), e)
+        return 0
+
+
+def delete_keys_by_email(emails: list[str]) -> int:
+    """Пакетный delete_key_by_email; возвращает число удалённых ключей."""
+    params = []
+    for email in emails:
+        lookup = _normalize_email(email) or (email or "").strip()
+        if lookup:
+            params.append((lookup, lookup))
+    if not params:
+        return 0
+    try:
+        with sqlite3.connect(DB_FILE) as conn:
+            cursor = conn.cursor()
+            cursor.executemany(
+                "DELETE FROM vpn_keys WHERE email = ? OR key_email = ?",
+                params,
+            )
+            conn.commit()
+            logger.debug("delete_keys_by_email(%s) affected=%s", len(params), cursor.rowcount)
+            return cursor.rowcount
+    except sqlite3.Error as e:
+        logging.error("Failed to delete %s keys: %s", len(params), e)
+        return 0
+
+
+def get_daily_stats_for_charts(days: int = 30, conn: sqlite3.Connection | None = None) -> dict:
+    stats = {'users': {}, 'keys': {}}
+    try:
+        with _read_conn(conn) as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = None
             cursor.execute(
                 """
                 SELECT date(registration_date) AS day, COUNT(*)
@@ -2991,6 +3535,55 @@ def get_users_paginated(page: int = 1, per_page: int = 30, q: str | None = None)
         logging.error(f"Failed to get users paginated: {e}")
         return [], 0
 
+def _users_filter(q: str | None) -> tuple[str, tuple]:
+    """WHERE-условие поиска пользователей, общее для списка и счётчика."""
+    if not q or not q.strip():
+        return "", ()
+    q_like = f"%{q.strip()}%"
+    return "WHERE (username LIKE ?) OR (CAST(telegram_id AS TEXT) LIKE ?)", (q_like, q_like)
+
+def get_users_count(q: str | None = None) -> int:
+    """Число пользователей с тем же фильтром, что и в get_users_paginated."""
+    where, params = _users_filter(q)
+    try:
+        with sqlite3.connect(DB_FILE) as conn:
+            cursor = conn.cursor()
+            cursor.execute(f"SELECT COUNT(*) FROM users {where}", params)
+            return cursor.fetchone()[0] or 0
+    except sqlite3.Error as e:
+        logging.error(f"Failed to count users: {e}")
+        return 0
+
+def get_users_paginated_with_key_counts(page: int = 1, per_page: int = 30, q: str | None = None,
+                                        conn: sqlite3.Connection | None = None) -> tuple[list[dict], int]:
+    """Как get_users_paginated, но каждая строка сразу содержит keys_count."""
+    page = max(1, int(page or 1))
+    per_page = max(1, int(per_page or 30))
+    offset = (page - 1) * per_page
+    where, params = _users_filter(q)
+    try:
+        with _read_conn(conn) as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = sqlite3.Row
+            cursor.execute(f"SELECT COUNT(*) FROM users {where}", params)
+            total = cursor.fetchone()[0] or 0
+            cursor.execute(
+                f"""
+                SELECT u.*,
+                       (SELECT COUNT(*) FROM vpn_keys k WHERE k.user_id = u.telegram_id) AS keys_count
+                FROM users u
+                {where}
+                ORDER BY u.registration_date DESC
+                LIMIT ? OFFSET ?
+                """,
+                params + (per_page, offset),
+            )
+            users = [dict(row) for row in cursor.fetchall()]
+            return users, total
+    except sqlite3.Error as e:
+        logging.error(f"Failed to get users paginated with key counts: {e}")
+        return [], 0
+
 def get_keys_counts_for_users(user_ids: list[int]) -> dict[int, int]:
     """Вернуть словарь {user_id: keys_count} по списку пользователей."""
     result: dict[int, int] = {}
@@ -3284,5 +3877,20 @@ def get_all_tickets_count() -> int:
         logging.error("Failed to get all tickets count: %s", e)
         return 0
 
+def get_ticket_counts_grouped() -> dict[str, int]:
+    """Счётчики тикетов одним запросом: {'open': …, 'closed': …, 'all': …}."""
+    counts = {"open": 0, "closed": 0, "all": 0}
+    try:
+        with sqlite3.connect(DB_FILE) as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT status, COUNT(*) FROM support_tickets GROUP BY status")
+            for status, count in cursor.fetchall():
+                if status in ("open", "closed"):
+                    counts[status] = count or 0
+                counts["all"] += count or 0
+    except sqlite3.Error as e:
+        logging.error("Failed to get grouped tickets count: %s", e)
+    return counts
+
 
 
@@ -1,7 +1,13 @@
 import logging
+import queue
 import sqlite3
-from datetime import datetime
-from typing import Any
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from functools import lru_cache
+from datetime import datetime, timezone
+from typing import Any, Iterable, Iterator
 
 from shop_bot.data_manager import database
 
@@ -11,44 +17,211 @@ DB_FILE = database.DB_FILE
 normalize_host_name = database.normalize_host_name
 
 
-def _connect() -> sqlite3.Connection:
-    conn = sqlite3.connect(DB_FILE)
+_READER_POOL_SIZE = 4
+_BUSY_TIMEOUT_MS = 5000
+_MMAP_SIZE = 256 * 1024 * 1024
+
+_pool_lock = threading.RLock()
+_reader_pool: queue.Queue[sqlite3.Connection] | None = None
+_writer_conn: sqlite3.Connection | None = None
+_writer_lock = threading.Lock()
+
+
+def _open_connection(read_only: bool = False) -> sqlite3.Connection:
+    if read_only:
+        uri = f"{Path(DB_FILE).resolve().as_uri()}?mode=ro"
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+    else:
+        conn = sqlite3.connect(DB_FILE, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        # В WAL режим NORMAL не теряет согласованность, а fsync идёт только на checkpoint.
+        conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA busy_timeout = {_BUSY_TIMEOUT_MS}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute(f"PRAGMA mmap_size = {_MMAP_SIZE}")
     conn.row_factory = sqlite3.Row
     return conn
 
 
-def _normalize_email(value: str | None) -> str:
-    return (value or "").strip().lower()
+def _get_reader_pool() -> queue.Queue[sqlite3.Connection]:
+    global _reader_pool
+    if _reader_pool is None:
+        with _pool_lock:
+            if _reader_pool is None:
+                # Писатель открывается первым, чтобы включить WAL до появления читателей.
+                _get_writer()
+                pool: queue.Queue[sqlite3.Connection] = queue.Queue()
+                for _ in range(_READER_POOL_SIZE):
+                    pool.put(_open_connection(read_only=True))
+                _reader_pool = pool
+    return _reader_pool
+
+
+def _get_writer() -> sqlite3.Connection:
+    global _writer_conn
+    if _writer_conn is None:
+        with _pool_lock:
+            if _writer_conn is None:
+                _writer_conn = _open_connection()
+    return _writer_conn
+
+
+@contextmanager
+def _reader() -> Iterator[sqlite3.Connection]:
+    """Соединение только для чтения из пула; без commit на выходе."""
+    pool = _get_reader_pool()
+    conn = pool.get()
+    try:
+        yield conn
+    finally:
+        pool.put(conn)
+
+
+@contextmanager
+def _writer() -> Iterator[sqlite3.Connection]:
+    """Единственное пишущее соединение: явная транзакция BEGIN IMMEDIATE ... COMMIT под блокировкой."""
+    with _writer_lock:
+        conn = _get_writer()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
 
 
 def _default_expire_at_ms() -> int:
-    return int(datetime.utcnow().timestamp() * 1000)
+    return _now_ms()
+
+
+def _now_ms() -> int:
+    return time.time_ns() // 1_000_000
+
+
+def _to_epoch_ms(value: datetime | str | None) -> int | None:
+    """Перевести момент времени в epoch-ms; наивные значения считаются UTC."""
+    if value is None or value == "":
+        return None
+    if not isinstance(value, datetime):
+        try:
+            value = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+        except ValueError:
+            return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return int(value.timestamp() * 1000)
+
+
+@lru_cache(maxsize=4096)
+def _iso_to_ms(value: str) -> int | None:
+    """Разобрать ISO-8601 из Remnawave в epoch-ms; повторяющиеся даты берутся из кэша."""
+    try:
+        return int(datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp() * 1000)
+    except Exception:
+        return None
+
+
+def _projection(columns: tuple[str, ...] | None) -> str:
+    if not columns:
+        return "*"
+    for column in columns:
+        if not column.isidentifier():
+            raise ValueError(f"invalid column name: {column!r}")
+    return ", ".join(columns)
 
 
-def list_squads(active_only: bool = False) -> list[dict[str, Any]]:
-    query = "SELECT * FROM xui_hosts"
+def _paginate(query: str, params: list[Any], limit: int | None, offset: int) -> str:
+    if limit is not None:
+        query += " LIMIT ? OFFSET ?"
+        params.extend((int(limit), int(offset)))
+    return query
+
+
+def list_squads(
+    active_only: bool = False,
+    *,
+    columns: tuple[str, ...] | None = None,
+    limit: int | None = None,
+    offset: int = 0,
+) -> list[dict[str, Any]]:
+    query = f"SELECT {_projection(columns)} FROM xui_hosts"
     params: list[Any] = []
     if active_only:
-        query += " WHERE COALESCE(is_active, 1) = 1"
+        query += " WHERE is_active = 1"
     query += " ORDER BY sort_order ASC, host_name ASC"
-    with _connect() as conn:
+    query = _paginate(query, params, limit, offset)
+    with _reader() as conn:
+        return [dict(row) for row in conn.execute(query, params)]
+
+
+def list_squads_brief(active_only: bool = False) -> tuple[tuple[str, str | None], ...]:
+    """Только (host_name, squad_uuid) без обёртки в dict — для списков и синхронизации."""
+    query = "SELECT host_name, squad_uuid FROM xui_hosts"
+    if active_only:
+        query += " WHERE is_active = 1"
+    query += " ORDER BY sort_order ASC, host_name ASC"
+    with _reader() as conn:
         cursor = conn.cursor()
-        cursor.execute(query, params)
-        return [dict(row) for row in cursor.fetchall()]
+        cursor.row_factory = None
+        return tuple(cursor.execute(query).fetchall())
+
+
+_SQUAD_COLUMNS = (
+    "host_name",
+    "squad_uuid",
+    "subscription_url",
+    "sort_order",
+    "is_active",
+    "default_traffic_limit_bytes",
+    "default_traffic_strategy",
+    "remnawave_base_url",
+    "remnawave_api_token",
+)
+_GIFT_TOKEN_COLUMNS = (
+    "token",
+    "host_name",
+    "days",
+    "activation_limit",
+    "activations_used",
+    "expires_at",
+    "last_claimed_at",
+)
+_PROMO_CODE_COLUMNS = (
+    "code",
+    "discount_percent",
+    "discount_amount",
+    "usage_limit_total",
+    "usage_limit_per_user",
+    "used_total",
+    "valid_from",
+    "valid_until",
+    "is_active",
+)
 
 
-def get_squad(identifier: str) -> dict[str, Any] | None:
+def _row_to_dict(cursor: sqlite3.Cursor, columns: tuple[str, ...] | None) -> dict[str, Any] | None:
+    """Первая строка курсора как dict; при известной проекции — через zip по кортежу без sqlite3.Row."""
+    if columns:
+        cursor.row_factory = None
+        row = cursor.fetchone()
+        return dict(zip(columns, row)) if row else None
+    row = cursor.fetchone()
+    return dict(row) if row else None
+
+
+def _fetch_squad(identifier: str, columns: tuple[str, ...] | None) -> dict[str, Any] | None:
     if not identifier:
         return None
     ident = identifier.strip()
     if not ident:
         return None
     normalized = normalize_host_name(ident)
-    with _connect() as conn:
-        cursor = conn.cursor()
-        cursor.execute(
-            """
-            SELECT *
+    with _reader() as conn:
+        cursor = conn.execute(
+            f"""
+            SELECT {_projection(columns)}
             FROM xui_hosts
             WHERE TRIM(host_name) = TRIM(?)
                OR TRIM(host_name) = TRIM(?)
@@ -58,8 +231,37 @@ def get_squad(identifier: str) -> dict[str, Any] | None:
             """,
             (ident, normalized, ident, normalized),
         )
-        row = cursor.fetchone()
-        return dict(row) if row else None
+        return _row_to_dict(cursor, columns)
+
+
+def get_squad(identifier: str) -> dict[str, Any] | None:
+    """Сквад по имени хоста или squad_uuid — только поля, нужные для выдачи ключей и вызовов API."""
+    return _fetch_squad(identifier, _SQUAD_COLUMNS)
+
+
+def get_squad_full(identifier: str) -> dict[str, Any] | None:
+    return _fetch_squad(identifier, None)
+
+
+# Тяжёлые выборки панели: SQL общий с database, соединение — из пула читателей.
+def get_metrics_series(scope: str, object_name: str, *, since_hours: int = 24, limit: int = 500) -> list[dict]:
+    with _reader() as conn:
+        return database.get_metrics_series(scope, object_name, since_hours=since_hours, limit=limit, conn=conn)
+
+
+def get_paginated_transactions(page: int = 1, per_page: int = 15) -> tuple[list[dict], int]:
+    with _reader() as conn:
+        return database.get_paginated_transactions(page, per_page, conn=conn)
+
+
+def get_daily_stats_for_charts(days: int = 30) -> dict:
+    with _reader() as conn:
+        return database.get_daily_stats_for_charts(days, conn=conn)
+
+
+def get_users_paginated_with_key_counts(page: int = 1, per_page: int = 30, q: str | None = None) -> tuple[list[dict], int]:
+    with _reader() as conn:
+        return database.get_users_paginated_with_key_counts(page, per_page, q, conn=conn)
 
 
 def get_key_by_id(key_id: int) -> dict | None:
@@ -90,39 +292,12 @@ def record_key(
     description: str | None = None,
 ) -> int | None:
     expire_ms = expire_at_ms if expire_at_ms is not None else _default_expire_at_ms()
-    email_normalized = _normalize_email(email)
-    host_name_norm = normalize_host_name(host_name) if host_name else None
-
-    existing = None
-    if email_normalized:
-        existing = database.get_key_by_email(email_normalized)
-    if not existing and remnawave_user_uuid:
-        existing = database.get_key_by_remnawave_uuid(remnawave_user_uuid)
-
     try:
-        if existing:
-            key_id = existing['key_id']
-            database.update_key_fields(
-                key_id,
-                host_name=host_name_norm or existing.get('host_name'),
-                squad_uuid=squad_uuid or existing.get('squad_uuid'),
-                remnawave_user_uuid=remnawave_user_uuid or existing.get('remnawave_user_uuid'),
-                short_uuid=short_uuid or existing.get('short_uuid'),
-                email=email_normalized or existing.get('email'),
-                subscription_url=subscription_url,
-                expire_at_ms=expire_ms,
-                traffic_limit_bytes=traffic_limit_bytes,
-                traffic_limit_strategy=traffic_limit_strategy,
-                tag=tag,
-                description=description,
-            )
-            return key_id
-
-        return database.add_new_key(
+        return database.upsert_key(
             user_id=user_id,
-            host_name=host_name_norm,
+            host_name=host_name,
             remnawave_user_uuid=remnawave_user_uuid,
-            key_email=email_normalized or email,
+            key_email=email,
             expiry_timestamp_ms=expire_ms,
             squad_uuid=squad_uuid,
             short_uuid=short_uuid,
@@ -137,43 +312,84 @@ def record_key(
         return None
 
 
-def record_key_from_payload(
-    user_id: int,
+def _key_fields_from_payload(
     payload: dict[str, Any],
     *,
     host_name: str | None = None,
     description: str | None = None,
     tag: str | None = None,
-) -> int | None:
-    if not payload:
-        return None
+) -> dict[str, Any]:
     squad_uuid = (payload.get('squad_uuid') or payload.get('squadUuid') or '').strip()
     remnawave_user_uuid = (payload.get('client_uuid') or payload.get('uuid') or payload.get('id') or '').strip()
     email = payload.get('email') or payload.get('accountEmail') or ''
     expire_at_ms = payload.get('expiry_timestamp_ms')
     if expire_at_ms is None:
         expire_iso = payload.get('expireAt') or payload.get('expiryDate')
-        if expire_iso:
-            try:
-                expire_at_ms = int(datetime.fromisoformat(str(expire_iso).replace('Z', '+00:00')).timestamp() * 1000)
-            except Exception:
-                expire_at_ms = None
-    return record_key(
-        user_id=user_id,
-        squad_uuid=squad_uuid,
-        remnawave_user_uuid=remnawave_user_uuid,
-        email=email,
-        host_name=host_name or payload.get('host_name'),
-        expire_at_ms=expire_at_ms,
-        short_uuid=payload.get('short_uuid') or payload.get('shortUuid'),
-        subscription_url=payload.get('subscription_url')
+        expire_at_ms = _iso_to_ms(str(expire_iso)) if expire_iso else None
+    return {
+        'squad_uuid': squad_uuid,
+        'remnawave_user_uuid': remnawave_user_uuid,
+        'email': email,
+        'host_name': host_name or payload.get('host_name'),
+        'expire_at_ms': expire_at_ms,
+        'short_uuid': payload.get('short_uuid') or payload.get('shortUuid'),
+        'subscription_url': payload.get('subscription_url')
             or payload.get('connection_string')
             or payload.get('subscriptionUrl'),
-        traffic_limit_bytes=payload.get('traffic_limit_bytes') or payload.get('trafficLimitBytes'),
-        traffic_limit_strategy=payload.get('traffic_limit_strategy') or payload.get('trafficLimitStrategy'),
-        tag=tag or payload.get('tag'),
-        description=description or payload.get('description'),
-    )
+        'traffic_limit_bytes': payload.get('traffic_limit_bytes') or payload.get('trafficLimitBytes'),
+        'traffic_limit_strategy': payload.get('traffic_limit_strategy') or payload.get('trafficLimitStrategy'),
+        'tag': tag or payload.get('tag'),
+        'description': description or payload.get('description'),
+    }
+
+
+def record_key_from_payload(
+    user_id: int,
+    payload: dict[str, Any],
+    *,
+    host_name: str | None = None,
+    description: str | None = None,
+    tag: str | None = None,
+) -> int | None:
+    if not payload:
+        return None
+    fields = _key_fields_from_payload(payload, host_name=host_name, description=description, tag=tag)
+    return record_key(user_id=user_id, **fields)
+
+
+def record_keys_bulk(
+    entries: Iterable[tuple[int, dict[str, Any]]],
+    *,
+    host_name: str | None = None,
+) -> int:
+    """Записать пачку пар (user_id, payload) одним executemany; возвращает число записанных ключей."""
+    rows: list[dict[str, Any]] = []
+    for user_id, payload in entries:
+        if not payload:
+            continue
+        fields = _key_fields_from_payload(payload, host_name=host_name)
+        expire_ms = fields['expire_at_ms'] if fields['expire_at_ms'] is not None else _default_expire_at_ms()
+        rows.append({
+            'user_id': user_id,
+            'host_name': fields['host_name'],
+            'remnawave_user_uuid': fields['remnawave_user_uuid'],
+            'key_email': fields['email'],
+            'expiry_timestamp_ms': expire_ms,
+            'squad_uuid': fields['squad_uuid'],
+            'short_uuid': fields['short_uuid'],
+            'subscription_url': fields['subscription_url'],
+            'traffic_limit_bytes': fields['traffic_limit_bytes'],
+            'traffic_limit_strategy': fields['traffic_limit_strategy'],
+            'description': fields['description'],
+            'tag': fields['tag'],
+        })
+    if not rows:
+        return 0
+    try:
+        return database.upsert_keys(rows)
+    except Exception:
+        logger.exception("Remnawave repository failed to record %s keys", len(rows))
+        return 0
 
 
 def update_key(
@@ -211,9 +427,18 @@ def delete_key_by_email(email: str) -> bool:
     return database.delete_key_by_email(email)
 
 
+def bulk_delete_keys_by_email(emails: Iterable[str]) -> int:
+    return database.delete_keys_by_email(list(emails))
+
+
+def bulk_update_keys_from_server(rows: Iterable[tuple[str, dict[str, Any]]]) -> int:
+    """Обновить ключи по данным панели пачкой пар (email, remote_user)."""
+    return database.update_keys_from_server(list(rows))
+
+
 
 
-_LEGACY_FORWARDERS = (
+_LEGACY_FORWARDERS = frozenset({
     "add_support_message",
     "add_to_balance",
     "add_to_referral_balance",
@@ -247,14 +472,14 @@ _LEGACY_FORWARDERS = (
     "get_all_users",
     "get_balance",
     "get_closed_tickets_count",
-    "get_daily_stats_for_charts",
+    "get_expired_keys",
     "get_host",
     "get_keys_for_host",
     "get_keys_for_user",
     "get_latest_speedtest",
+    "get_latest_speedtests_for_hosts",
     "get_next_key_number",
     "get_open_tickets_count",
-    "get_paginated_transactions",
     "get_plan_by_id",
     "get_plans_for_host",
     "get_recent_transactions",
@@ -263,25 +488,32 @@ _LEGACY_FORWARDERS = (
     "get_referral_count",
     "get_referrals_for_user",
     "get_setting",
+    "get_settings_bulk",
     "get_speedtests",
+    "get_taken_key_emails",
     "get_ticket",
     "get_ticket_by_thread",
+    "get_ticket_counts_grouped",
     "get_ticket_messages",
     "get_or_create_open_ticket",
     "get_tickets_paginated",
     "get_total_keys_count",
     "get_total_spent_sum",
+    "get_dashboard_stats",
     "get_user",
     "get_user_count",
     "get_user_keys",
 
     "get_users_paginated",
+    "get_users_count",
     "get_keys_counts_for_users",
     "get_user_tickets",
     "insert_host_speedtest",
     "initialize_db",
     "is_admin",
+    "key_email_slug",
     "log_transaction",
+    "next_free_key_email",
     "register_user_if_not_exists",
     "run_migration",
     "set_referral_start_bonus_received",
@@ -311,23 +543,41 @@ _LEGACY_FORWARDERS = (
     "delete_ssh_target",
 
     "insert_resource_metric",
+    "insert_resource_metrics",
     "get_latest_resource_metric",
-    "get_metrics_series",
-)
+})
+
+
+
+def __getattr__(name: str) -> Any:
+    """Лениво пробросить устаревшие функции из database при первом обращении (PEP 562)."""
+    if name in _LEGACY_FORWARDERS:
+        value = getattr(database, name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-for _name in _LEGACY_FORWARDERS:
-    if _name not in globals():
-        globals()[_name] = getattr(database, _name)
+
+_ALL_EXCLUDES = frozenset({
+    "logging", "queue", "sqlite3", "threading", "time", "contextmanager", "lru_cache", "Path",
+    "datetime", "timezone", "Any", "Iterable", "Iterator", "database", "logger",
+})
 
 __all__ = sorted(
-    name for name in globals()
-    if not name.startswith('_') and name not in {"logging", "sqlite3", "datetime", "Any", "database", "logger"}
+    _LEGACY_FORWARDERS.union(name for name in globals() if not name.startswith('_')) - _ALL_EXCLUDES
 )
 
 
 
 
-def create_gift_token(
+_INSERT_GIFT_TOKEN_SQL = """
+    INSERT {or_ignore}INTO gift_tokens (
+        token, host_name, days, activation_limit, expires_at, expires_at_ms, created_by, comment
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+
+def _gift_token_row(
     token: str,
     host_name: str,
     days: int,
@@ -336,72 +586,106 @@ def create_gift_token(
     expires_at: datetime | None = None,
     created_by: int | None = None,
     comment: str | None = None,
-) -> bool:
+) -> tuple:
     token_s = (token or "").strip()
     if not token_s:
         raise ValueError("token is required")
-    host_name_n = normalize_host_name(host_name)
     days_i = int(days)
     limit_i = int(activation_limit or 1)
     if days_i <= 0 or limit_i <= 0:
         raise ValueError("days and activation_limit must be positive")
+    return (
+        token_s,
+        normalize_host_name(host_name),
+        days_i,
+        limit_i,
+        expires_at.isoformat() if isinstance(expires_at, datetime) else expires_at,
+        _to_epoch_ms(expires_at),
+        created_by,
+        comment,
+    )
 
+
+def create_gift_token(
+    token: str,
+    host_name: str,
+    days: int,
+    *,
+    activation_limit: int = 1,
+    expires_at: datetime | None = None,
+    created_by: int | None = None,
+    comment: str | None = None,
+) -> bool:
+    row = _gift_token_row(
+        token,
+        host_name,
+        days,
+        activation_limit=activation_limit,
+        expires_at=expires_at,
+        created_by=created_by,
+        comment=comment,
+    )
     try:
-        with _connect() as conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                """
-                INSERT INTO gift_tokens (token, host_name, days, activation_limit, expires_at, created_by, comment)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-                """,
-                (
-                    token_s,
-                    host_name_n,
-                    days_i,
-                    limit_i,
-                    expires_at.isoformat() if isinstance(expires_at, datetime) else expires_at,
-                    created_by,
-                    comment,
-                ),
-            )
-            conn.commit()
+        with _writer() as conn:
+            conn.execute(_INSERT_GIFT_TOKEN_SQL.format(or_ignore=""), row)
             return True
     except sqlite3.IntegrityError:
         return False
 
 
-def get_gift_token(token: str) -> dict | None:
+def create_gift_tokens_bulk(rows: Iterable[dict[str, Any]], *, ignore_existing: bool = False) -> int:
+    """Создать много токенов одним executemany; rows — аргументы create_gift_token. Возвращает число вставленных."""
+    params = [_gift_token_row(**row) for row in rows]
+    if not params:
+        return 0
+    with _writer() as conn:
+        before = conn.total_changes
+        conn.executemany(_INSERT_GIFT_TOKEN_SQL.format(or_ignore="OR IGNORE " if ignore_existing else ""), params)
+        return conn.total_changes - before
+
+
+def _fetch_gift_token(token: str, columns: tuple[str, ...] | None) -> dict | None:
     token_s = (token or "").strip()
     if not token_s:
         return None
-    with _connect() as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM gift_tokens WHERE token = ?", (token_s,))
-        row = cursor.fetchone()
-        return dict(row) if row else None
+    with _reader() as conn:
+        cursor = conn.execute(f"SELECT {_projection(columns)} FROM gift_tokens WHERE token = ?", (token_s,))
+        return _row_to_dict(cursor, columns)
+
+
+def get_gift_token(token: str) -> dict | None:
+    return _fetch_gift_token(token, _GIFT_TOKEN_COLUMNS)
 
 
-def list_gift_tokens(active_only: bool = False) -> list[dict]:
-    query = "SELECT * FROM gift_tokens"
+def get_gift_token_full(token: str) -> dict | None:
+    return _fetch_gift_token(token, None)
+
+
+def list_gift_tokens(
+    active_only: bool = False,
+    *,
+    columns: tuple[str, ...] | None = None,
+    limit: int | None = None,
+    offset: int = 0,
+) -> list[dict]:
+    query = f"SELECT {_projection(columns)} FROM gift_tokens"
     params: list[Any] = []
     if active_only:
         query += " WHERE (activation_limit IS NULL OR activation_limit > activations_used)"
-        query += " AND (expires_at IS NULL OR datetime(expires_at) >= datetime('now'))"
+        query += " AND (expires_at_ms IS NULL OR expires_at_ms >= ?)"
+        params.append(_now_ms())
     query += " ORDER BY created_at DESC"
-    with _connect() as conn:
-        cursor = conn.cursor()
-        cursor.execute(query, params)
-        return [dict(row) for row in cursor.fetchall()]
+    query = _paginate(query, params, limit, offset)
+    with _reader() as conn:
+        return [dict(row) for row in conn.execute(query, params)]
 
 
 def delete_gift_token(token: str) -> bool:
     token_s = (token or "").strip()
     if not token_s:
         return False
-    with _connect() as conn:
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM gift_tokens WHERE token = ?", (token_s,))
-        conn.commit()
+    with _writer() as conn:
+        cursor = conn.execute("DELETE FROM gift_tokens WHERE token = ?", (token_s,))
         return cursor.rowcount > 0
 
 
@@ -410,65 +694,54 @@ def claim_gift_token(token: str, user_id: int, key_id: int | None = None) -> dic
     if not token_s:
         return None
     user_id_i = int(user_id)
-    now_iso = datetime.utcnow().isoformat()
-    with _connect() as conn:
-        cursor = conn.cursor()
-        cursor.execute(
-            """
-            SELECT token, host_name, days, activation_limit, activations_used, expires_at
-            FROM gift_tokens
-            WHERE token = ?
-            """,
-            (token_s,),
-        )
-        row = cursor.fetchone()
-        if row is None:
-            return None
-        record = dict(row)
-        expires_at = record.get("expires_at")
-        if expires_at:
-            try:
-                exp_dt = datetime.fromisoformat(str(expires_at))
-            except Exception:
-                exp_dt = None
-            if exp_dt and exp_dt < datetime.utcnow():
-                return None
-        activation_limit = record.get("activation_limit") or 0
-        activations_used = record.get("activations_used") or 0
-        if activation_limit and activations_used >= activation_limit:
-            return None
-
-        try:
-            cursor.execute(
+    now_dt = datetime.utcnow()
+    now_iso = now_dt.isoformat()
+    now_ms = _to_epoch_ms(now_dt)
+    try:
+        with _writer() as conn:
+            row = conn.execute(
                 """
                 UPDATE gift_tokens
-                SET activations_used = activations_used + 1,
+                SET activations_used = COALESCE(activations_used, 0) + 1,
                     last_claimed_at = ?
                 WHERE token = ?
+                  AND (COALESCE(activation_limit, 0) = 0 OR COALESCE(activations_used, 0) < activation_limit)
+                  AND (expires_at_ms IS NULL OR expires_at_ms >= ?)
+                RETURNING token, host_name, days, activation_limit, activations_used, expires_at
                 """,
-                (now_iso, token_s),
-            )
-            cursor.execute(
+                (now_iso, token_s, now_ms),
+            ).fetchone()
+            if row is None:
+                return None
+            record = dict(row)
+            conn.execute(
                 """
                 INSERT INTO gift_token_claims (token, user_id, key_id, claimed_at)
                 VALUES (?, ?, ?, ?)
                 """,
                 (token_s, user_id_i, key_id, now_iso),
             )
-            conn.commit()
-            record["activations_used"] = activations_used + 1
-            record["claimed_by"] = user_id_i
-            record["claimed_at"] = now_iso
-            record["key_id"] = key_id
-            return record
-        except sqlite3.Error:
-            conn.rollback()
-            return None
+    except sqlite3.Error:
+        return None
+    record["claimed_by"] = user_id_i
+    record["claimed_at"] = now_iso
+    record["key_id"] = key_id
+    return record
 
 
 
 
-def create_promo_code(
+_INSERT_PROMO_CODE_SQL = """
+    INSERT {or_ignore}INTO promo_codes (
+        code, discount_percent, discount_amount,
+        usage_limit_total, usage_limit_per_user,
+        valid_from, valid_until, valid_from_ms, valid_until_ms,
+        created_by, description
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+
+def _promo_code_row(
     code: str,
     *,
     discount_percent: float | None = None,
@@ -479,76 +752,115 @@ def create_promo_code(
     valid_until: datetime | None = None,
     created_by: int | None = None,
     description: str | None = None,
-) -> bool:
+) -> tuple:
     code_s = (code or "").strip().upper()
     if not code_s:
         raise ValueError("code is required")
     if (discount_percent or 0) <= 0 and (discount_amount or 0) <= 0:
         raise ValueError("discount must be positive")
+    return (
+        code_s,
+        float(discount_percent) if discount_percent is not None else None,
+        float(discount_amount) if discount_amount is not None else None,
+        usage_limit_total,
+        usage_limit_per_user,
+        valid_from.isoformat() if isinstance(valid_from, datetime) else valid_from,
+        valid_until.isoformat() if isinstance(valid_until, datetime) else valid_until,
+        _to_epoch_ms(valid_from),
+        _to_epoch_ms(valid_until),
+        created_by,
+        description,
+    )
+
+
+def create_promo_code(
+    code: str,
+    *,
+    discount_percent: float | None = None,
+    discount_amount: float | None = None,
+    usage_limit_total: int | None = None,
+    usage_limit_per_user: int | None = None,
+    valid_from: datetime | None = None,
+    valid_until: datetime | None = None,
+    created_by: int | None = None,
+    description: str | None = None,
+) -> bool:
+    row = _promo_code_row(
+        code,
+        discount_percent=discount_percent,
+        discount_amount=discount_amount,
+        usage_limit_total=usage_limit_total,
+        usage_limit_per_user=usage_limit_per_user,
+        valid_from=valid_from,
+        valid_until=valid_until,
+        created_by=created_by,
+        description=description,
+    )
     try:
-        with _connect() as conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                """
-                INSERT INTO promo_codes (
-                    code, discount_percent, discount_amount,
-                    usage_limit_total, usage_limit_per_user,
-                    valid_from, valid_until, created_by, description
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """,
-                (
-                    code_s,
-                    float(discount_percent) if discount_percent is not None else None,
-                    float(discount_amount) if discount_amount is not None else None,
-                    usage_limit_total,
-                    usage_limit_per_user,
-                    valid_from.isoformat() if isinstance(valid_from, datetime) else valid_from,
-                    valid_until.isoformat() if isinstance(valid_until, datetime) else valid_until,
-                    created_by,
-                    description,
-                ),
-            )
-            conn.commit()
+        with _writer() as conn:
+            conn.execute(_INSERT_PROMO_CODE_SQL.format(or_ignore=""), row)
             return True
     except sqlite3.IntegrityError:
         return False
 
 
-def get_promo_code(code: str) -> dict | None:
-    code_s = (code or "").strip().upper()
+def create_promo_codes_bulk(rows: Iterable[dict[str, Any]], *, ignore_existing: bool = False) -> int:
+    """Создать много промокодов одним executemany; rows — аргументы create_promo_code. Возвращает число вставленных."""
+    params = [_promo_code_row(**row) for row in rows]
+    if not params:
+        return 0
+    with _writer() as conn:
+        before = conn.total_changes
+        conn.executemany(_INSERT_PROMO_CODE_SQL.format(or_ignore="OR IGNORE " if ignore_existing else ""), params)
+        return conn.total_changes - before
+
+
+def _fetch_promo_code(code: str, columns: tuple[str, ...] | None) -> dict | None:
+    code_s = (code or "").strip()
     if not code_s:
         return None
-    with _connect() as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM promo_codes WHERE code = ?", (code_s,))
-        row = cursor.fetchone()
-        return dict(row) if row else None
+    with _reader() as conn:
+        cursor = conn.execute(f"SELECT {_projection(columns)} FROM promo_codes WHERE code = ?", (code_s,))
+        return _row_to_dict(cursor, columns)
+
+
+def get_promo_code(code: str) -> dict | None:
+    return _fetch_promo_code(code, _PROMO_CODE_COLUMNS)
 
 
-def list_promo_codes(include_inactive: bool = True) -> list[dict]:
-    query = "SELECT * FROM promo_codes"
+def get_promo_code_full(code: str) -> dict | None:
+    return _fetch_promo_code(code, None)
+
+
+def list_promo_codes(
+    include_inactive: bool = True,
+    *,
+    columns: tuple[str, ...] | None = None,
+    limit: int | None = None,
+    offset: int = 0,
+) -> list[dict]:
+    query = f"SELECT {_projection(columns)} FROM promo_codes"
+    params: list[Any] = []
     if not include_inactive:
         query += " WHERE is_active = 1"
     query += " ORDER BY created_at DESC"
-    with _connect() as conn:
-        cursor = conn.cursor()
-        cursor.execute(query)
-        return [dict(row) for row in cursor.fetchall()]
+    query = _paginate(query, params, limit, offset)
+    with _reader() as conn:
+        return [dict(row) for row in conn.execute(query, params)]
 
 
 def check_promo_code_available(code: str, user_id: int) -> tuple[dict | None, str | None]:
     """Проверить возможность использования промокода, не изменяя лимиты."""
-    code_s = (code or "").strip().upper()
+    code_s = (code or "").strip()
     if not code_s:
         return None, "empty_code"
     user_id_i = int(user_id)
-    with _connect() as conn:
-        cursor = conn.cursor()
-        cursor.execute(
+    with _reader() as conn:
+        cursor = conn.execute(
             """
             SELECT code, discount_percent, discount_amount,
                    usage_limit_total, usage_limit_per_user,
-                   used_total, valid_from, valid_until, is_active
+                   used_total, valid_from, valid_until, valid_from_ms, valid_until_ms, is_active
             FROM promo_codes
             WHERE code = ?
             """,
@@ -560,43 +872,34 @@ def check_promo_code_available(code: str, user_id: int) -> tuple[dict | None, st
         promo = dict(promo_row)
         if not promo.get("is_active"):
             return None, "inactive"
-        now_dt = datetime.utcnow()
-        valid_from = promo.get("valid_from")
-        if valid_from:
+        now_ms = _now_ms()
+        valid_from_ms = promo.get("valid_from_ms")
+        if valid_from_ms is not None and valid_from_ms > now_ms:
+            return None, "not_started"
+        valid_until_ms = promo.get("valid_until_ms")
+        if valid_until_ms is not None and valid_until_ms < now_ms:
             try:
-                if datetime.fromisoformat(str(valid_from)) > now_dt:
-                    return None, "not_started"
-            except Exception:
-                pass
-        valid_until = promo.get("valid_until")
-        if valid_until:
-            try:
-                if datetime.fromisoformat(str(valid_until)) < now_dt:
-                    try:
-                        update_promo_code_status(code_s, is_active=False)
-                    except Exception:
-                        pass
-                    return None, "expired"
+                update_promo_code_status(code_s, is_active=False)
             except Exception:
                 pass
+            return None, "expired"
         usage_limit_total = promo.get("usage_limit_total")
         used_total = promo.get("used_total") or 0
         if usage_limit_total and used_total >= usage_limit_total:
             return None, "total_limit_reached"
         usage_limit_per_user = promo.get("usage_limit_per_user")
         if usage_limit_per_user:
-            cursor.execute(
-                "SELECT COUNT(1) FROM promo_code_usages WHERE code = ? AND user_id = ?",
-                (code_s, user_id_i),
-            )
-            per_user_count = cursor.fetchone()[0]
-            if per_user_count >= usage_limit_per_user:
+            usages = conn.execute(
+                "SELECT 1 FROM promo_code_usages WHERE code = ? AND user_id = ? LIMIT ?",
+                (promo["code"], user_id_i, usage_limit_per_user),
+            ).fetchall()
+            if len(usages) >= usage_limit_per_user:
                 return None, "user_limit_reached"
         return promo, None
 
 
 def update_promo_code_status(code: str, *, is_active: bool | None = None) -> bool:
-    code_s = (code or "").strip().upper()
+    code_s = (code or "").strip()
     if not code_s:
         return False
     sets: list[str] = []
@@ -607,109 +910,84 @@ def update_promo_code_status(code: str, *, is_active: bool | None = None) -> boo
     if not sets:
         return False
     params.append(code_s)
-    with _connect() as conn:
-        cursor = conn.cursor()
-        cursor.execute(f"UPDATE promo_codes SET {', '.join(sets)} WHERE code = ?", params)
-        conn.commit()
+    with _writer() as conn:
+        cursor = conn.execute(f"UPDATE promo_codes SET {', '.join(sets)} WHERE code = ?", params)
         return cursor.rowcount > 0
 
 
 def delete_promo_code(code: str) -> bool:
-    code_s = (code or "").strip().upper()
+    code_s = (code or "").strip()
     if not code_s:
         return False
-    with _connect() as conn:
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM promo_codes WHERE code = ?", (code_s,))
-        conn.commit()
+    with _writer() as conn:
+        cursor = conn.execute("DELETE FROM promo_codes WHERE code = ?", (code_s,))
         return cursor.rowcount > 0
 
 
 def redeem_promo_code(code: str, user_id: int, *, applied_amount: float, order_id: str | None = None) -> dict | None:
-    code_s = (code or "").strip().upper()
+    code_s = (code or "").strip()
     if not code_s:
         return None
     user_id_i = int(user_id)
     applied_amount_f = float(applied_amount)
-    now_iso = datetime.utcnow().isoformat()
-    with _connect() as conn:
-        cursor = conn.cursor()
-        cursor.execute(
-            """
-            SELECT code, discount_percent, discount_amount,
-                   usage_limit_total, usage_limit_per_user,
-                   used_total, valid_from, valid_until, is_active
-            FROM promo_codes
-            WHERE code = ?
-            """,
-            (code_s,),
-        )
-        promo_row = cursor.fetchone()
-        if promo_row is None:
-            return None
-        promo = dict(promo_row)
-        if not promo.get("is_active"):
-            return None
-        valid_from = promo.get("valid_from")
-        valid_until = promo.get("valid_until")
-        now_dt = datetime.utcnow()
-        if valid_from:
-            try:
-                if datetime.fromisoformat(str(valid_from)) > now_dt:
-                    return None
-            except Exception:
-                pass
-        if valid_until:
-            try:
-                if datetime.fromisoformat(str(valid_until)) < now_dt:
-                    try:
-                        update_promo_code_status(code_s, is_active=False)
-                    except Exception:
-                        pass
-                    return None
-            except Exception:
-                pass
-        usage_limit_total = promo.get("usage_limit_total")
-        used_total = promo.get("used_total") or 0
-        if usage_limit_total and used_total >= usage_limit_total:
-            return None
-        usage_limit_per_user = promo.get("usage_limit_per_user")
-        per_user_count = 0
-        if usage_limit_per_user:
-            cursor.execute(
-                "SELECT COUNT(1) FROM promo_code_usages WHERE code = ? AND user_id = ?",
-                (code_s, user_id_i),
-            )
-            per_user_count = cursor.fetchone()[0]
-            if per_user_count >= usage_limit_per_user:
+    now_dt = datetime.utcnow()
+    now_iso = now_dt.isoformat()
+    now_ms = _to_epoch_ms(now_dt)
+    try:
+        with _writer() as conn:
+            promo_row = conn.execute(
+                """
+                UPDATE promo_codes
+                SET used_total = COALESCE(used_total, 0) + 1
+                WHERE code = :code
+                  AND is_active = 1
+                  AND (COALESCE(usage_limit_total, 0) = 0 OR COALESCE(used_total, 0) < usage_limit_total)
+                  AND (valid_from_ms IS NULL OR valid_from_ms <= :now_ms)
+                  AND (valid_until_ms IS NULL OR valid_until_ms >= :now_ms)
+                  AND (
+                      COALESCE(usage_limit_per_user, 0) = 0
+                      OR (
+                          SELECT COUNT(1) FROM promo_code_usages
+                          WHERE promo_code_usages.code = promo_codes.code AND promo_code_usages.user_id = :user_id
+                      ) < usage_limit_per_user
+                  )
+                RETURNING code, discount_percent, discount_amount,
+                          usage_limit_total, usage_limit_per_user,
+                          used_total, valid_from, valid_until, is_active,
+                          (
+                              SELECT COUNT(1) FROM promo_code_usages
+                              WHERE promo_code_usages.code = promo_codes.code AND promo_code_usages.user_id = :user_id
+                          ) AS per_user_count
+                """,
+                {"code": code_s, "user_id": user_id_i, "now_ms": now_ms},
+            ).fetchone()
+            if promo_row is None:
+                # Просроченный промокод деактивируем, как и раньше при проверке в Python.
+                conn.execute(
+                    """
+                    UPDATE promo_codes SET is_active = 0
+                    WHERE code = ? AND is_active = 1
+                      AND valid_until_ms IS NOT NULL AND valid_until_ms < ?
+                    """,
+                    (code_s, now_ms),
+                )
                 return None
-        try:
-            cursor.execute(
+            promo = dict(promo_row)
+            per_user_count = promo.pop("per_user_count") or 0
+            conn.execute(
                 """
                 INSERT INTO promo_code_usages (code, user_id, applied_amount, order_id, used_at)
                 VALUES (?, ?, ?, ?, ?)
                 """,
-                (code_s, user_id_i, applied_amount_f, order_id, now_iso),
-            )
-            cursor.execute(
-                """
-                UPDATE promo_codes
-                SET used_total = COALESCE(used_total, 0) + 1
-                WHERE code = ?
-                """,
-                (code_s,),
+                (promo["code"], user_id_i, applied_amount_f, order_id, now_iso),
             )
-            conn.commit()
-            promo["used_total"] = used_total + 1
-            promo["usage_limit_per_user"] = usage_limit_per_user
-            promo["user_used_count"] = per_user_count + 1
-            promo["redeemed_by"] = user_id_i
-            promo["applied_amount"] = applied_amount_f
-            promo["order_id"] = order_id
-            promo["used_at"] = now_iso
-            return promo
-        except sqlite3.Error as e:
-            conn.rollback()
-            if str(e).startswith("FOREIGN KEY constraint failed"):
-                return None
-            raise
+    except sqlite3.Error as e:
+        if str(e).startswith("FOREIGN KEY constraint failed"):
+            return None
+        raise
+    promo["user_used_count"] = per_user_count + 1
+    promo["redeemed_by"] = user_id_i
+    promo["applied_amount"] = applied_amount_f
+    promo["order_id"] = order_id
+    promo["used_at"] = now_iso
+    return promo
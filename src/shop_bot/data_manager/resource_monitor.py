@@ -1,20 +1,82 @@
+import asyncio
+import atexit
+import copy
+import functools
 import os
 import time
 import platform
+import re
+import shlex
 import json
 import logging
-from typing import Any, Dict, List
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, Iterable, List
 
 try:
     import psutil
 except Exception:
     psutil = None
 
+try:
+    import orjson
+except Exception:
+    orjson = None
+
 from shop_bot.data_manager import remnawave_repository as rw_repo
 from shop_bot.data_manager import speedtest_runner
 
 logger = logging.getLogger(__name__)
 
+_REMOTE_MAX_WORKERS = 16
+_remote_executor: ThreadPoolExecutor | None = None
+_remote_executor_lock = threading.Lock()
+
+
+_METRICS_TTL_SEC = 2.0
+
+
+def _ttl_cache(seconds: float, maxsize: int = 128):
+    """Кэшировать результат на `seconds` секунд по аргументам вызова.
+    Ответы с `ok: False` не кэшируются; каждый вызов получает свою копию.
+    Счётчики попаданий — через `.cache_info()`, сброс — через `.cache_clear()`.
+    """
+    def decorator(fn):
+        cache: Dict[tuple, tuple[float, Dict[str, Any]]] = {}
+        stats = {"hits": 0, "misses": 0}
+        lock = threading.Lock()
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            key = (args, tuple(sorted(kwargs.items())))
+            with lock:
+                entry = cache.get(key)
+                fresh = entry is not None and time.monotonic() - entry[0] < seconds
+                stats["hits" if fresh else "misses"] += 1
+            if fresh:
+                return copy.deepcopy(entry[1])
+            value = fn(*args, **kwargs)
+            with lock:
+                cache.pop(key, None)
+                if isinstance(value, dict) and value.get("ok") is not False:
+                    if len(cache) >= maxsize:
+                        cache.pop(next(iter(cache)))
+                    cache[key] = (time.monotonic(), copy.deepcopy(value))
+            return value
+
+        def cache_info() -> Dict[str, int]:
+            with lock:
+                return dict(stats, size=len(cache))
+
+        def cache_clear() -> None:
+            with lock:
+                cache.clear()
+
+        wrapper.cache_info = cache_info
+        wrapper.cache_clear = cache_clear
+        return wrapper
+    return decorator
+
 
 def _safe_percent(numerator: float | int, denominator: float | int) -> float | None:
     try:
@@ -26,255 +88,404 @@ def _safe_percent(numerator: float | int, denominator: float | int) -> float | N
         return None
 
 
-def get_local_metrics() -> Dict[str, Any]:
-    """Собрать базовые метрики локальной системы (панели).
-    Требует psutil. Если psutil недоступен, возвращает ограниченную информацию.
-    """
-    data: Dict[str, Any] = {
-        "ok": True,
-        "hostname": platform.node(),
-        "platform": platform.platform(),
-        "python": platform.python_version(),
-        "uptime_sec": None,
-        "cpu": {},
-        "memory": {},
-        "swap": {},
-        "disks": [],
-        "net": {},
-        "error": None,
-    }
+def _static_probe(fn, *args, **kwargs):
     try:
-        if psutil is None:
-            data["ok"] = False
-            data["error"] = "psutil not installed"
-            logger.warning("psutil не установлен - мониторинг недоступен")
-
-            try:
-                data["uptime_sec"] = max(0, int(time.time() - psutil.boot_time())) if psutil else None
-            except Exception:
-                pass
-            return data
+        return fn(*args, **kwargs)
+    except Exception:
+        return None
 
 
+def _platform_string() -> str:
+    """Краткое описание ОС из /etc/os-release (Linux); на прочих системах — platform.platform()."""
+    if platform.system() == "Linux":
         try:
-            data["uptime_sec"] = max(0, int(time.time() - psutil.boot_time()))
-        except Exception:
-            data["uptime_sec"] = None
+            info = platform.freedesktop_os_release()
+            return f"{info.get('ID', 'linux')}-{info.get('VERSION_ID', '')}-{platform.machine()}"
+        except OSError:
+            pass
+    return platform.platform()
 
 
-        try:
-            data["cpu"] = {
-                "count_logical": psutil.cpu_count(logical=True),
-                "count_physical": psutil.cpu_count(logical=False),
-                "percent": psutil.cpu_percent(interval=0.2),
-                "loadavg": None,
-            }
-            try:
-                data["cpu"]["loadavg"] = os.getloadavg()
-            except Exception:
-                data["cpu"]["loadavg"] = None
-        except Exception:
-            data["cpu"] = {}
+# Значения, не меняющиеся за время жизни процесса, вычисляем один раз при импорте.
+_HOSTNAME = platform.node()
+_PLATFORM = _platform_string()
+_PYVER = platform.python_version()
+_BOOT_TIME = _static_probe(psutil.boot_time) if psutil else None
+_CPU_LOGICAL = _static_probe(psutil.cpu_count, logical=True) if psutil else None
+_CPU_PHYSICAL = _static_probe(psutil.cpu_count, logical=False) if psutil else None
 
+# Минимальный интервал между замерами CPU: при более частых вызовах отдаём прошлое значение вместо 0.0.
+_CPU_MIN_GAP = 0.1
+_cpu_last: tuple[float, float] | None = None
+_cpu_lock = threading.Lock()
 
-        try:
-            vm = psutil.virtual_memory()
-            data["memory"] = {
-                "total": vm.total,
-                "available": vm.available,
-                "used": vm.used,
-                "percent": vm.percent,
-            }
-        except Exception:
-            data["memory"] = {}
+if psutil is not None:
+    try:
+        # Первый вызов с interval=None всегда возвращает 0.0 — задаём точку отсчёта при импорте.
+        psutil.cpu_percent(interval=None)
+    except Exception:
+        pass
 
 
-        try:
-            sm = psutil.swap_memory()
-            data["swap"] = {
-                "total": sm.total,
-                "used": sm.used,
-                "percent": sm.percent,
-            }
-        except Exception:
-            data["swap"] = {}
+def _cpu_percent() -> float:
+    """Неблокирующая загрузка CPU с момента предыдущего замера."""
+    global _cpu_last
+    with _cpu_lock:
+        now = time.monotonic()
+        if _cpu_last is not None and now - _cpu_last[0] < _CPU_MIN_GAP:
+            return _cpu_last[1]
+        value = psutil.cpu_percent(interval=None)
+        _cpu_last = (now, value)
+        return value
 
 
-        disks: List[Dict[str, Any]] = []
-        try:
-            for part in psutil.disk_partitions(all=False):
-
-                if any(x in (part.fstype or '').lower() for x in ["tmpfs", "devtmpfs", "squashfs", "overlay"]):
-                    continue
-                try:
-                    usage = psutil.disk_usage(part.mountpoint)
-                    disks.append({
-                        "device": part.device,
-                        "mountpoint": part.mountpoint,
-                        "fstype": part.fstype,
-                        "total": usage.total,
-                        "used": usage.used,
-                        "free": usage.free,
-                        "percent": usage.percent,
-                    })
-                except Exception:
-                    continue
-        except Exception:
-            pass
-        data["disks"] = disks
-        
+_SKIP_FSTYPES = frozenset({"tmpfs", "devtmpfs", "squashfs", "overlay", "fuse.lxcfs", "autofs"})
+_DISK_USAGE_TIMEOUT_SEC = 0.5
+_DISK_WORKERS = 4
+_disk_executor: ThreadPoolExecutor | None = None
+_disk_lock = threading.Lock()
+# Точки монтирования, чей statvfs не уложился в таймаут: незавершённый вызов занимает поток пула.
+_hung_mounts: dict[str, tuple[ThreadPoolExecutor, Future]] = {}
 
-        try:
-            disk_percents = [d.get('percent') for d in data["disks"] or [] if d.get('percent') is not None]
-            data["disk_percent"] = max(disk_percents) if disk_percents else None
-        except Exception:
-            data["disk_percent"] = None
 
+def _disk_usage(mountpoint: str):
+    """psutil.disk_usage с таймаутом: зависший statvfs (NFS и т.п.) не блокирует сбор метрик.
 
-        try:
-            io = psutil.net_io_counters()
-            data["net"] = {
-                "bytes_sent": io.bytes_sent,
-                "bytes_recv": io.bytes_recv,
-                "packets_sent": io.packets_sent,
-                "packets_recv": io.packets_recv,
-                "errin": io.errin,
-                "errout": io.errout,
-                "dropin": io.dropin,
-                "dropout": io.dropout,
-            }
-            logger.debug(f"Сетевые данные получены: sent={io.bytes_sent}, recv={io.bytes_recv}")
-        except Exception as e:
-            logger.warning(f"Ошибка получения сетевых данных: {e}")
-            data["net"] = {}
+    Зависшая точка пропускается, пока её вызов не завершится. Если зависшие заняли все
+    потоки, пул заменяется новым — старые потоки остаются висеть, но не мешают остальным дискам.
+    """
+    global _disk_executor
+    with _disk_lock:
+        pending = _hung_mounts.get(mountpoint)
+        if pending is not None:
+            if not pending[1].done():
+                raise TimeoutError(f"disk_usage({mountpoint}) всё ещё не завершён")
+            del _hung_mounts[mountpoint]
+        if _disk_executor is None:
+            _disk_executor = ThreadPoolExecutor(max_workers=_DISK_WORKERS, thread_name_prefix="disk-usage")
+        executor = _disk_executor
+        fut = executor.submit(psutil.disk_usage, mountpoint)
+    try:
+        return fut.result(timeout=_DISK_USAGE_TIMEOUT_SEC)
+    except TimeoutError:
+        with _disk_lock:
+            _hung_mounts[mountpoint] = (executor, fut)
+            stuck = sum(1 for ex, f in _hung_mounts.values() if ex is executor and not f.done())
+            if stuck >= _DISK_WORKERS and _disk_executor is executor:
+                executor.shutdown(wait=False, cancel_futures=True)
+                _disk_executor = None
+        logger.warning(f"disk_usage({mountpoint}) не ответил за {_DISK_USAGE_TIMEOUT_SEC} с, точка пропускается до завершения вызова")
+        raise
 
 
-        try:
-            processes = []
-            for proc in psutil.process_iter(['pid', 'name', 'cpu_percent', 'memory_percent', 'status']):
-                try:
-                    proc_info = proc.info
-                    if proc_info['cpu_percent'] > 0 or proc_info['memory_percent'] > 1:
-                        processes.append({
-                            'pid': proc_info['pid'],
-                            'name': proc_info['name'],
-                            'cpu_percent': proc_info['cpu_percent'],
-                            'memory_percent': proc_info['memory_percent'],
-                            'status': proc_info['status']
-                        })
-                except (psutil.NoSuchProcess, psutil.AccessDenied):
-                    continue
-            
-
-            processes.sort(key=lambda x: x['cpu_percent'], reverse=True)
-            data["top_processes"] = processes[:10]
-        except Exception:
-            data["top_processes"] = []
+# Предыдущий замер сетевых счётчиков: (time.monotonic(), snetio).
+_LAST_NET: tuple[float, Any] | None = None
+_net_lock = threading.Lock()
 
 
-        try:
-            if hasattr(psutil, 'getloadavg'):
-                load_avg = psutil.getloadavg()
-                data["load_avg"] = {
-                    "1min": load_avg[0],
-                    "5min": load_avg[1],
-                    "15min": load_avg[2]
-                }
-        except Exception:
-            data["load_avg"] = {}
+def _net_rates(io) -> tuple[float | None, float | None]:
+    """Скорость (байт/с) отправки и приёма с предыдущего замера; None при первом замере или сбросе счётчиков."""
+    global _LAST_NET
+    now = time.monotonic()
+    with _net_lock:
+        last = _LAST_NET
+        _LAST_NET = (now, io)
+    if last is None:
+        return None, None
+    dt = now - last[0]
+    sent = io.bytes_sent - last[1].bytes_sent
+    recv = io.bytes_recv - last[1].bytes_recv
+    if dt <= 0 or sent < 0 or recv < 0:
+        return None, None
+    return round(sent / dt, 2), round(recv / dt, 2)
 
 
-        try:
-            if hasattr(psutil, 'sensors_temperatures'):
-                temps = psutil.sensors_temperatures()
-                if temps:
-                    data["temperatures"] = {}
-                    for name, entries in temps.items():
-                        if entries:
-                            data["temperatures"][name] = {
-                                'current': entries[0].current,
-                                'high': entries[0].high,
-                                'critical': entries[0].critical
-                            }
-        except Exception:
-            data["temperatures"] = {}
+def _fields(obj, names: tuple[str, ...]) -> Dict[str, Any]:
+    return {name: getattr(obj, name) for name in names}
+
 
+_MEMORY_FIELDS = ("total", "available", "used", "percent")
+_SWAP_FIELDS = ("total", "used", "percent")
+_NET_FIELDS = ("bytes_sent", "bytes_recv", "packets_sent", "packets_recv", "errin", "errout", "dropin", "dropout")
+_HAS_GETLOADAVG = hasattr(os, "getloadavg")
 
+
+def _probe_cpu() -> Dict[str, Any]:
+    return {"cpu": {
+        "count_logical": _CPU_LOGICAL,
+        "count_physical": _CPU_PHYSICAL,
+        "percent": _cpu_percent(),
+        "loadavg": os.getloadavg() if _HAS_GETLOADAVG else None,
+    }}
+
+
+def _probe_memory() -> Dict[str, Any]:
+    return {"memory": _fields(psutil.virtual_memory(), _MEMORY_FIELDS)}
+
+
+def _probe_swap() -> Dict[str, Any]:
+    return {"swap": _fields(psutil.swap_memory(), _SWAP_FIELDS)}
+
+
+def _collect_disks() -> Dict[str, Any]:
+    disks: List[Dict[str, Any]] = []
+    max_pct = None
+    seen_devices: set[str] = set()
+    for part in psutil.disk_partitions(all=False):
+        if (part.fstype or '').lower() in _SKIP_FSTYPES or part.device in seen_devices:
+            continue
+        seen_devices.add(part.device)
         try:
-            boot_time = psutil.boot_time()
-            data["boot_time"] = boot_time
+            usage = _disk_usage(part.mountpoint)
         except Exception:
-            data["boot_time"] = None
+            continue
+        disks.append({
+            "device": part.device,
+            "mountpoint": part.mountpoint,
+            "fstype": part.fstype,
+            "total": usage.total,
+            "used": usage.used,
+            "free": usage.free,
+            "percent": usage.percent,
+        })
+        if max_pct is None or usage.percent > max_pct:
+            max_pct = usage.percent
+    return {"disks": disks, "disk_percent": max_pct}
+
+
+def _probe_net() -> Dict[str, Any]:
+    io = psutil.net_io_counters()
+    net = _fields(io, _NET_FIELDS)
+    net["bytes_sent_per_sec"], net["bytes_recv_per_sec"] = _net_rates(io)
+    logger.debug(f"Сетевые данные получены: sent={io.bytes_sent}, recv={io.bytes_recv}")
+    return {"net": net}
+
+
+def _collect_processes() -> Dict[str, Any]:
+    processes = []
+    # psutil>=6.0 кэширует Process между вызовами, поэтому cpu_percent() считает дельту с прошлого опроса.
+    for proc in psutil.process_iter():
+        try:
+            with proc.oneshot():
+                cpu_p = proc.cpu_percent()
+                mem_p = proc.memory_percent()
+                if cpu_p > 0 or mem_p > 1:
+                    processes.append({
+                        'pid': proc.pid,
+                        'name': proc.name(),
+                        'cpu_percent': cpu_p,
+                        'memory_percent': mem_p,
+                        'status': proc.status()
+                    })
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            pass
 
+    return {"top_processes": sorted(processes, key=lambda x: x['cpu_percent'], reverse=True)[:10]}
+
+
+def _probe_load_avg() -> Dict[str, Any]:
+    if not hasattr(psutil, 'getloadavg'):
+        return {}
+    load_avg = psutil.getloadavg()
+    return {"load_avg": {
+        "1min": load_avg[0],
+        "5min": load_avg[1],
+        "15min": load_avg[2]
+    }}
+
+
+def _probe_temperatures() -> Dict[str, Any]:
+    temps = psutil.sensors_temperatures() if hasattr(psutil, 'sensors_temperatures') else None
+    if not temps:
+        return {}
+    return {"temperatures": {
+        name: {
+            'current': entries[0].current,
+            'high': entries[0].high,
+            'critical': entries[0].critical
+        }
+        for name, entries in temps.items() if entries
+    }}
+
+
+# Независимые пробы локальных метрик: (проба, значение при ошибке). Каждая возвращает кусок итогового словаря.
+_LOCAL_PROBES = (
+    (_probe_cpu, {"cpu": {}}),
+    (_probe_memory, {"memory": {}}),
+    (_probe_swap, {"swap": {}}),
+    (_collect_disks, {"disks": [], "disk_percent": None}),
+    (_probe_net, {"net": {}}),
+    (_collect_processes, {"top_processes": []}),
+    (_probe_load_avg, {"load_avg": {}}),
+    (_probe_temperatures, {"temperatures": {}}),
+)
+
+
+def _run_probe(probe, fallback: Dict[str, Any]) -> Dict[str, Any]:
+    try:
+        return probe()
     except Exception as e:
+        logger.debug(f"Проба {probe.__name__} не удалась: {e}")
+        return dict(fallback)
+
+
+def _local_base() -> Dict[str, Any]:
+    data: Dict[str, Any] = {
+        "ok": True,
+        "hostname": _HOSTNAME,
+        "platform": _PLATFORM,
+        "python": _PYVER,
+        "uptime_sec": None,
+        "cpu": {},
+        "memory": {},
+        "swap": {},
+        "disks": [],
+        "net": {},
+        "error": None,
+    }
+    if psutil is None:
         data["ok"] = False
-        data["error"] = str(e)
+        data["error"] = "psutil not installed"
+        logger.warning("psutil не установлен - мониторинг недоступен")
+        return data
+    data["uptime_sec"] = max(0, int(time.time() - _BOOT_TIME)) if _BOOT_TIME else None
+    data["boot_time"] = _BOOT_TIME
     return data
 
 
-def _parse_free_m(text: str) -> Dict[str, Any]:
+@_ttl_cache(_METRICS_TTL_SEC)
+def _local_metrics() -> Dict[str, Any]:
+    data = _local_base()
+    if psutil is None:
+        return data
+    for probe, fallback in _LOCAL_PROBES:
+        data.update(_run_probe(probe, fallback))
+    return data
 
 
+def get_local_metrics(flat: bool = False) -> Dict[str, Any]:
+    """Собрать базовые метрики локальной системы (панели).
+    Требует psutil. Если psutil недоступен, возвращает ограниченную информацию.
+    При flat=True возвращает плоский словарь (см. flatten_metrics).
+    """
+    data = _local_metrics()
+    return flatten_metrics(data) if flat else data
 
 
-    out: Dict[str, Any] = {}
-    try:
-        lines = [l for l in (text or '').splitlines() if l.strip()]
-        for ln in lines:
-            if ln.lower().startswith("mem:"):
-                parts = [p for p in ln.split() if p]
-
-                if len(parts) >= 7:
-                    total = int(parts[1])
-                    used = int(parts[2])
-                    free = int(parts[3])
-                    avail = int(parts[6])
-                    out = {
-                        "total_mb": total,
-                        "used_mb": used,
-                        "free_mb": free,
-                        "available_mb": avail,
-                        "percent": _safe_percent(used, total),
-                    }
-                    break
-    except Exception:
-        pass
-    return out
+get_local_metrics.cache_clear = _local_metrics.cache_clear
+
+
+async def get_local_metrics_async(flat: bool = False) -> Dict[str, Any]:
+    """То же, что get_local_metrics, но пробы выполняются параллельно в потоках,
+    не блокируя event loop. Время сбора ~ самой медленной пробы, а не их сумме.
+    """
+    data = _local_base()
+    if psutil is not None:
+        results = await asyncio.gather(
+            *(asyncio.to_thread(_run_probe, probe, fallback) for probe, fallback in _LOCAL_PROBES)
+        )
+        for res in results:
+            data.update(res)
+    return flatten_metrics(data) if flat else data
+
+
+def flatten_metrics(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Развернуть вложенные метрики в плоский словарь: {"cpu.percent": ..., "disks[0].mountpoint": ...}."""
+    flat: Dict[str, Any] = {}
+
+    def _flatten(obj: Any, prefix: str) -> None:
+        if isinstance(obj, dict) and obj:
+            for key, value in obj.items():
+                _flatten(value, f"{prefix}.{key}" if prefix else str(key))
+        elif isinstance(obj, (list, tuple)) and obj:
+            for i, value in enumerate(obj):
+                _flatten(value, f"{prefix}[{i}]")
+        else:
+            flat[prefix] = obj
+
+    _flatten(data, "")
+    return flat
+
+
+def dumps_metrics(data: Dict[str, Any]) -> str:
+    """Сериализовать метрики в JSON; использует orjson, если он установлен."""
+    if orjson is not None:
+        return orjson.dumps(data).decode("utf-8")
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+
+
+_MEM_RE = re.compile(r'^mem:\s+(\d+)\s+(\d+)\s+(\d+)\s+\d+\s+\d+\s+(\d+)', re.MULTILINE | re.IGNORECASE)
+_MEMINFO_RE = re.compile(r'^(\w+):\s+(\d+)', re.MULTILINE)
+_LOADAVG_RE = re.compile(r'^\s*(\S+)\s+(\S+)\s+(\S+)')
+_DF_RE = re.compile(r'^[ \t]*(\S+)[ \t]+(\S+)[ \t]+(\S+)[ \t]+(\S+)[ \t]+(\S+)[ \t]+(\S+)', re.MULTILINE)
+_DF_HEADERS = frozenset({"Filesystem", "Source"})
+
+
+def _parse_free_m(text: str) -> Dict[str, Any]:
+    m = _MEM_RE.search(text or '')
+    if not m:
+        return {}
+    total = int(m[1])
+    used = int(m[2])
+    return {
+        "total_mb": total,
+        "used_mb": used,
+        "free_mb": int(m[3]),
+        "available_mb": int(m[4]),
+        "percent": _safe_percent(used, total),
+    }
+
+
+def _parse_meminfo(text: str) -> Dict[str, Any]:
+    """Память из /proc/meminfo в том же формате, что и _parse_free_m (МБ).
+    used считается как в `free` (procps 3.3): total - free - buffers - cache, где cache = Cached + SReclaimable,
+    чтобы значения совпадали с прежними замерами через `free -m`.
+    """
+    kb = {k: int(v) for k, v in _MEMINFO_RE.findall(text or '')}
+    total = kb.get("MemTotal")
+    if not total:
+        return {}
+    free = kb.get("MemFree", 0)
+    cache = kb.get("Cached", 0) + kb.get("SReclaimable", 0)
+    avail = kb.get("MemAvailable")
+    if avail is None:
+        avail = free + kb.get("Buffers", 0) + cache
+    used = total - free - kb.get("Buffers", 0) - cache
+    if used < 0:
+        used = total - free
+    return {
+        "total_mb": total // 1024,
+        "used_mb": used // 1024,
+        "free_mb": free // 1024,
+        "available_mb": avail // 1024,
+        "percent": _safe_percent(used, total),
+    }
 
 
 def _parse_loadavg(text: str) -> List[float] | None:
+    m = _LOADAVG_RE.match(text or '')
+    if not m:
+        return None
     try:
-        parts = (text or '').split()
-        return [float(parts[0]), float(parts[1]), float(parts[2])]
-    except Exception:
+        return [float(m[1]), float(m[2]), float(m[3])]
+    except ValueError:
         return None
 
 
 def _parse_df_h(text: str) -> List[Dict[str, Any]]:
     disks: List[Dict[str, Any]] = []
-    try:
-        lines = [l for l in (text or '').splitlines() if l.strip()]
-
-        if lines and ("Filesystem" in lines[0] or "Source" in lines[0] or "Size" in lines[0]):
-            lines = lines[1:]
-        for ln in lines:
-            parts = [p for p in ln.split() if p]
-            if len(parts) >= 6:
-                src, size, used, avail, pcent, target = parts[:6]
-                try:
-                    p_raw = int((pcent or '').strip('%'))
-                except Exception:
-                    p_raw = None
-                disks.append({
-                    "device": src,
-                    "mountpoint": target,
-                    "size": size,
-                    "used": used,
-                    "avail": avail,
-                    "percent": p_raw,
-                })
-    except Exception:
-        pass
+    for m in _DF_RE.finditer(text or ''):
+        if m[1] in _DF_HEADERS:
+            continue
+        pcent = m[5].rstrip('%')
+        disks.append({
+            "device": m[1],
+            "mountpoint": m[6],
+            "size": m[2],
+            "used": m[3],
+            "avail": m[4],
+            "percent": int(pcent) if pcent.isdigit() else None,
+        })
     return disks
 
 
@@ -291,241 +502,268 @@ def _compute_cpu_percent(loadavg: List[float] | None, cpu_count: int | None) ->
         return None
 
 
-def get_remote_metrics_for_host(host_name: str) -> Dict[str, Any]:
-    """Собрать базовые метрики по SSH для хоста из xui_hosts.
-    Требует настроенный SSH у хоста в БД (`ssh_host`, `ssh_user`, и т.п.).
+_REMOTE_SEP = "---"
+# Файлы /proc читаются встроенным read оболочки, без fork на каждый cat.
+_REMOTE_READ_FN = 'r() { while IFS= read -r l || [ -n "$l" ]; do printf \'%s\\n\' "$l"; done < "$1"; }'
+# Все удалённые пробы выполняются одним вызовом _ssh_exec; секции разделены строкой _REMOTE_SEP.
+_REMOTE_PROBES = (
+    "uname -srmo 2>/dev/null || uname -a",
+    "r /proc/uptime 2>/dev/null",
+    "r /proc/loadavg 2>/dev/null",
+    "nproc 2>/dev/null || getconf _NPROCESSORS_ONLN 2>/dev/null || echo 1",
+    "r /proc/meminfo 2>/dev/null || free -m",
+    "df -h -x tmpfs -x devtmpfs --output=source,size,used,avail,pcent,target 2>/dev/null | tail -n +2",
+    "r /proc/net/dev 2>/dev/null",
+)
+_REMOTE_SCRIPT = "sh -c " + shlex.quote(
+    _REMOTE_READ_FN + "; " + f"; echo {_REMOTE_SEP}; ".join(_REMOTE_PROBES)
+)
+# Пробы читают /proc и df; дольше этого ждать незачем — соединение, скорее всего, мёртвое.
+_REMOTE_EXEC_TIMEOUT_SEC = 15
+
+
+def _split_sections(text: str, count: int) -> List[str]:
+    sections: List[List[str]] = [[]]
+    for ln in (text or '').splitlines():
+        if ln.strip() == _REMOTE_SEP:
+            sections.append([])
+        else:
+            sections[-1].append(ln)
+    out = ["\n".join(lines) for lines in sections]
+    out.extend([""] * (count - len(out)))
+    return out[:count]
+
+
+_NET_PRIMARY = ("eth0", "ens", "enp", "wlan0")
+_NET_SKIP = ("lo:", "docker", "veth")
+
+
+def _parse_net_dev(text: str) -> tuple[int, int, int, int]:
+    """Счётчики (recv, packets_recv, sent, packets_sent) первого внешнего интерфейса из /proc/net/dev.
+    Приоритет у eth/ens/enp/wlan, иначе берётся первый интерфейс не lo/docker/veth; при неудаче — нули.
     """
-    host = rw_repo.get_host(host_name)
-    if not host:
-        return {"ok": False, "error": "host not found"}
+    picked = None
+    fallback = None
+    for ln in (text or '').splitlines()[2:]:
+        if any(x in ln for x in _NET_PRIMARY):
+            picked = ln
+            break
+        if fallback is None and not any(x in ln for x in _NET_SKIP):
+            fallback = ln
+    line = picked or fallback
+    if not line:
+        return 0, 0, 0, 0
+    # Имя интерфейса может быть склеено с первым счётчиком ("eth0:123"), поэтому режем по ':'.
+    parts = line.partition(':')[2].split()
+    try:
+        return int(parts[0]), int(parts[1]), int(parts[8]), int(parts[9])
+    except (IndexError, ValueError):
+        return 0, 0, 0, 0
+
 
+def _run_remote_script(ssh) -> str:
+    _, out, _ = speedtest_runner._ssh_exec(
+        ssh, _REMOTE_SCRIPT, timeout=_REMOTE_EXEC_TIMEOUT_SEC, combine_stderr=True
+    )
+    return out
+
+
+def _collect_remote(key: str, host_row: dict) -> Dict[str, Any]:
+    """Собрать метрики по SSH за один round-trip.
+    Если клиент из пула не отвечает, он закрывается и делается одна попытка на новом соединении.
+    """
     try:
-        ssh = speedtest_runner._ssh_connect(host)
+        ssh = _get_ssh(key, host_row)
     except Exception as e:
         return {"ok": False, "error": f"SSH connect failed: {e}"}
+    try:
+        out = _run_remote_script(ssh)
+    except Exception as e:
+        logger.warning(f"Удалённые пробы {key} не выполнены, переподключаемся: {e}")
+        _drop_ssh(key, ssh)
+        try:
+            ssh = _get_ssh(key, host_row)
+        except Exception as e:
+            return {"ok": False, "error": f"SSH connect failed: {e}"}
+        try:
+            out = _run_remote_script(ssh)
+        except Exception as e:
+            _drop_ssh(key, ssh)
+            return {"ok": False, "error": f"SSH exec failed: {e}"}
+    return _parse_remote(out)
+
+
+def _parse_remote(out: str) -> Dict[str, Any]:
+    metrics: Dict[str, Any] = {"ok": True}
+    uname_txt, uptime_txt, loadavg_txt, nproc_txt, free_txt, df_txt, netdev_txt = _split_sections(out, len(_REMOTE_PROBES))
+
+    metrics["uname"] = uname_txt.strip()
 
     try:
-        metrics: Dict[str, Any] = {"ok": True}
+        metrics["uptime_sec"] = int(float(uptime_txt.split()[0]))
+    except Exception:
+        metrics["uptime_sec"] = None
+
+    metrics["loadavg"] = _parse_loadavg(loadavg_txt)
+
+    try:
+        cpu_count = int(nproc_txt.strip().splitlines()[0])
+    except Exception:
         cpu_count = None
+    metrics["cpu_count"] = cpu_count
+    metrics["cpu_percent"] = _compute_cpu_percent(metrics.get("loadavg"), cpu_count)
 
-        try:
-            rc, out, err = speedtest_runner._ssh_exec(ssh, "uname -srmo 2>/dev/null || uname -a")
-            metrics["uname"] = (out or err or '').strip()
-        except Exception:
-            metrics["uname"] = None
+    mem = _parse_meminfo(free_txt) if "MemTotal:" in free_txt else _parse_free_m(free_txt)
+    metrics["memory"] = mem
+    metrics["mem_percent"] = mem.get("percent") if mem else None
 
-        try:
-            rc, out, err = speedtest_runner._ssh_exec(ssh, "cat /proc/uptime || uptime -p")
-            txt = (out or err or '').strip()
-            up_sec = None
-            try:
-
-                first = float(txt.split()[0])
-                up_sec = int(first)
-            except Exception:
-                up_sec = None
-            metrics["uptime_sec"] = up_sec
-        except Exception:
-            metrics["uptime_sec"] = None
+    metrics["disks"] = _parse_df_h(df_txt)
+    metrics["disk_percent"] = max(
+        (d["percent"] for d in metrics["disks"] if d["percent"] is not None), default=None
+    )
 
-        try:
-            rc, out, err = speedtest_runner._ssh_exec(ssh, "cat /proc/loadavg")
-            metrics["loadavg"] = _parse_loadavg(out)
-        except Exception:
-            metrics["loadavg"] = None
+    if metrics.get("memory"):
+        metrics["memory_percent"] = mem.get("percent")
+        metrics["memory_used_mb"] = mem.get("used_mb")
+        metrics["memory_total_mb"] = mem.get("total_mb")
 
-        try:
-            rc, out, err = speedtest_runner._ssh_exec(
-                ssh,
-                "nproc 2>/dev/null || getconf _NPROCESSORS_ONLN 2>/dev/null || echo 1"
-            )
-            first_line = (out or err or '').strip().splitlines()[0]
-            cpu_count = int(first_line)
-        except Exception:
-            cpu_count = None
-        metrics["cpu_count"] = cpu_count
-        metrics["cpu_percent"] = _compute_cpu_percent(metrics.get("loadavg"), cpu_count)
+    if metrics.get("disks"):
+        metrics["disk_mountpoint"] = metrics["disks"][0].get("mountpoint", "/")
 
-        try:
-            rc, out, err = speedtest_runner._ssh_exec(ssh, "free -m")
-            mem = _parse_free_m(out)
-            metrics["memory"] = mem
-            metrics["mem_percent"] = mem.get("percent") if mem else None
-        except Exception:
-            metrics["memory"] = {}
-            metrics["mem_percent"] = None
+    recv, packets_recv, sent, packets_sent = _parse_net_dev(netdev_txt)
+    metrics["network_recv"] = recv
+    metrics["network_sent"] = sent
+    metrics["network_packets_recv"] = packets_recv
+    metrics["network_packets_sent"] = packets_sent
+    logger.debug(f"Сетевые данные получены через SSH: sent={sent}, recv={recv}")
 
-        try:
-            rc, out, err = speedtest_runner._ssh_exec(ssh, "df -h -x tmpfs -x devtmpfs --output=source,size,used,avail,pcent,target | tail -n +2")
-            metrics["disks"] = _parse_df_h(out)
-        except Exception:
-            metrics["disks"] = []
-        try:
-            disk_percents = [d.get('percent') for d in metrics["disks"] or [] if d.get('percent') is not None]
-            metrics["disk_percent"] = max(disk_percents) if disk_percents else None
-        except Exception:
-            metrics["disk_percent"] = None
-        
-
-        if metrics.get("memory"):
-            mem = metrics["memory"]
-            metrics["memory_percent"] = mem.get("percent")
-            metrics["memory_used_mb"] = mem.get("used_mb")
-            metrics["memory_total_mb"] = mem.get("total_mb")
-        
-        if metrics.get("disks") and len(metrics["disks"]) > 0:
-            first_disk = metrics["disks"][0]
-            metrics["disk_mountpoint"] = first_disk.get("mountpoint", "/")
-        
+    return metrics
 
-        try:
-            rc, out, err = speedtest_runner._ssh_exec(ssh, "cat /proc/net/dev | grep -E 'eth0|ens|enp|wlan0' | head -1")
-            if not out or err:
-
-                rc, out, err = speedtest_runner._ssh_exec(ssh, "cat /proc/net/dev | grep -v 'lo:' | grep -v 'docker' | grep -v 'veth' | tail -n +3 | head -1")
-            if out and not err:
-
-                parts = out.strip().split()
-                if len(parts) >= 10:
-                    metrics["network_recv"] = int(parts[1])
-                    metrics["network_sent"] = int(parts[9])
-                    metrics["network_packets_recv"] = int(parts[2])
-                    metrics["network_packets_sent"] = int(parts[10])
-                    logger.debug(f"Сетевые данные получены через SSH: sent={parts[9]}, recv={parts[1]}")
-                else:
-                    metrics["network_recv"] = 0
-                    metrics["network_sent"] = 0
-                    metrics["network_packets_recv"] = 0
-                    metrics["network_packets_sent"] = 0
-            else:
-                metrics["network_recv"] = 0
-                metrics["network_sent"] = 0
-                metrics["network_packets_recv"] = 0
-                metrics["network_packets_sent"] = 0
-        except Exception:
-            metrics["network_recv"] = 0
-            metrics["network_sent"] = 0
-            metrics["network_packets_recv"] = 0
-            metrics["network_packets_sent"] = 0
-        
-        return metrics
-    finally:
-        try:
-            ssh.close()
-        except Exception:
-            pass
+
+_SSH_KEEPALIVE_SEC = 30
+_SSH_FIELDS = ("ssh_host", "ssh_port", "ssh_user", "ssh_password", "ssh_key_path")
+# Открытые SSH-клиенты: ключ -> (параметры подключения, клиент).
+_SSH_POOL: Dict[str, tuple[tuple, Any]] = {}
+_ssh_pool_lock = threading.Lock()
 
 
+def _ssh_alive(ssh) -> bool:
+    try:
+        transport = ssh.get_transport()
+        if transport is None or not transport.is_active():
+            return False
+        transport.send_ignore()
+        return True
+    except Exception:
+        return False
+
+
+def _close_quietly(ssh) -> None:
+    try:
+        ssh.close()
+    except Exception:
+        pass
+
+
+def _drop_ssh(key: str, ssh) -> None:
+    """Убрать клиент из пула (если он там ещё лежит) и закрыть его."""
+    with _ssh_pool_lock:
+        entry = _SSH_POOL.get(key)
+        if entry is not None and entry[1] is ssh:
+            _SSH_POOL.pop(key, None)
+    _close_quietly(ssh)
+
+
+def _get_ssh(key: str, host_row: dict):
+    """Вернуть SSH-клиент из пула, переподключаясь при смене настроек или обрыве."""
+    params = tuple(host_row.get(f) for f in _SSH_FIELDS)
+    with _ssh_pool_lock:
+        entry = _SSH_POOL.get(key)
+        if entry is not None and (entry[0] != params or not _ssh_alive(entry[1])):
+            _SSH_POOL.pop(key, None)
+            _close_quietly(entry[1])
+            entry = None
+    if entry is not None:
+        return entry[1]
+
+    ssh = speedtest_runner._ssh_connect(host_row)
+    try:
+        transport = ssh.get_transport()
+        if transport is not None:
+            transport.set_keepalive(_SSH_KEEPALIVE_SEC)
+    except Exception:
+        pass
+    with _ssh_pool_lock:
+        entry = _SSH_POOL.get(key)
+        if entry is not None and entry[0] == params:
+            # Параллельный вызов успел подключиться первым — используем его клиент.
+            _close_quietly(ssh)
+            return entry[1]
+        _SSH_POOL[key] = (params, ssh)
+    if entry is not None:
+        _close_quietly(entry[1])
+    return ssh
+
+
+def close_all() -> None:
+    """Закрыть все SSH-соединения из пула."""
+    with _ssh_pool_lock:
+        clients = [ssh for _, ssh in _SSH_POOL.values()]
+        _SSH_POOL.clear()
+    for ssh in clients:
+        _close_quietly(ssh)
+
+
+atexit.register(close_all)
+
+
+@_ttl_cache(_METRICS_TTL_SEC)
+def get_remote_metrics_for_host(host_name: str) -> Dict[str, Any]:
+    """Собрать базовые метрики по SSH для хоста из xui_hosts.
+    Требует настроенный SSH у хоста в БД (`ssh_host`, `ssh_user`, и т.п.).
+    """
+    host = rw_repo.get_host(host_name)
+    if not host:
+        return {"ok": False, "error": "host not found"}
+
+    return _collect_remote(f"host:{host_name}", host)
+
+
+@_ttl_cache(_METRICS_TTL_SEC)
 def get_remote_metrics_for_target(target_name: str) -> Dict[str, Any]:
     target = rw_repo.get_ssh_target(target_name)
     if not target:
         return {"ok": False, "error": "target not found"}
     host_row = speedtest_runner._target_to_host_row(target)
-    try:
-        ssh = speedtest_runner._ssh_connect(host_row)
-    except Exception as e:
-        return {"ok": False, "error": f"SSH connect failed: {e}"}
+    return _collect_remote(f"target:{target_name}", host_row)
 
-    try:
-        metrics: Dict[str, Any] = {"ok": True}
-        try:
-            rc, out, err = speedtest_runner._ssh_exec(ssh, "uname -srmo 2>/dev/null || uname -a")
-            metrics["uname"] = (out or err or '').strip()
-        except Exception:
-            metrics["uname"] = None
-        try:
-            rc, out, err = speedtest_runner._ssh_exec(ssh, "cat /proc/uptime || uptime -p")
-            txt = (out or err or '').strip()
-            up_sec = None
-            try:
-                first = float(txt.split()[0])
-                up_sec = int(first)
-            except Exception:
-                up_sec = None
-            metrics["uptime_sec"] = up_sec
-        except Exception:
-            metrics["uptime_sec"] = None
-        try:
-            rc, out, err = speedtest_runner._ssh_exec(ssh, "cat /proc/loadavg")
-            metrics["loadavg"] = _parse_loadavg(out)
-        except Exception:
-            metrics["loadavg"] = None
 
-        try:
-            rc, out, err = speedtest_runner._ssh_exec(
-                ssh,
-                "nproc 2>/dev/null || getconf _NPROCESSORS_ONLN 2>/dev/null || echo 1"
+def _get_remote_executor(max_workers: int) -> ThreadPoolExecutor:
+    """Общий пул потоков для SSH-проб; создаётся один раз, размер фиксируется первым вызовом."""
+    global _remote_executor
+    with _remote_executor_lock:
+        if _remote_executor is None:
+            _remote_executor = ThreadPoolExecutor(
+                max_workers=max(1, int(max_workers)),
+                thread_name_prefix="remote-metrics",
             )
-            first_line = (out or err or '').strip().splitlines()[0]
-            cpu_count = int(first_line)
-        except Exception:
-            cpu_count = None
-        metrics["cpu_count"] = cpu_count
-        metrics["cpu_percent"] = _compute_cpu_percent(metrics.get("loadavg"), cpu_count)
-        try:
-            rc, out, err = speedtest_runner._ssh_exec(ssh, "free -m")
-            mem = _parse_free_m(out)
-            metrics["memory"] = mem
-            metrics["mem_percent"] = mem.get("percent") if mem else None
-        except Exception:
-            metrics["memory"] = {}
-            metrics["mem_percent"] = None
-        try:
-            rc, out, err = speedtest_runner._ssh_exec(ssh, "df -h -x tmpfs -x devtmpfs --output=source,size,used,avail,pcent,target | tail -n +2")
-            metrics["disks"] = _parse_df_h(out)
-        except Exception:
-            metrics["disks"] = []
-        try:
-            disk_percents = [d.get('percent') for d in metrics["disks"] or [] if d.get('percent') is not None]
-            metrics["disk_percent"] = max(disk_percents) if disk_percents else None
-        except Exception:
-            metrics["disk_percent"] = None
-        
-
-        if metrics.get("memory"):
-            mem = metrics["memory"]
-            metrics["memory_percent"] = mem.get("percent")
-            metrics["memory_used_mb"] = mem.get("used_mb")
-            metrics["memory_total_mb"] = mem.get("total_mb")
-        
-        if metrics.get("disks") and len(metrics["disks"]) > 0:
-            first_disk = metrics["disks"][0]
-            metrics["disk_mountpoint"] = first_disk.get("mountpoint", "/")
-        
+        return _remote_executor
 
+
+def get_remote_metrics_for_hosts(host_names: Iterable[str], max_workers: int = _REMOTE_MAX_WORKERS) -> Dict[str, Dict[str, Any]]:
+    """Собрать метрики по SSH для нескольких хостов параллельно.
+    Возвращает словарь host_name -> результат get_remote_metrics_for_host.
+    """
+    names = list(dict.fromkeys(n for n in host_names if n))
+    if not names:
+        return {}
+    executor = _get_remote_executor(max_workers)
+    futures = {name: executor.submit(get_remote_metrics_for_host, name) for name in names}
+    results: Dict[str, Dict[str, Any]] = {}
+    for name, fut in futures.items():
         try:
-            rc, out, err = speedtest_runner._ssh_exec(ssh, "cat /proc/net/dev | grep -E 'eth0|ens|enp|wlan0' | head -1")
-            if not out or err:
-
-                rc, out, err = speedtest_runner._ssh_exec(ssh, "cat /proc/net/dev | grep -v 'lo:' | grep -v 'docker' | grep -v 'veth' | tail -n +3 | head -1")
-            if out and not err:
-
-                parts = out.strip().split()
-                if len(parts) >= 10:
-                    metrics["network_recv"] = int(parts[1])
-                    metrics["network_sent"] = int(parts[9])
-                    metrics["network_packets_recv"] = int(parts[2])
-                    metrics["network_packets_sent"] = int(parts[10])
-                    logger.debug(f"Сетевые данные получены через SSH: sent={parts[9]}, recv={parts[1]}")
-                else:
-                    metrics["network_recv"] = 0
-                    metrics["network_sent"] = 0
-                    metrics["network_packets_recv"] = 0
-                    metrics["network_packets_sent"] = 0
-            else:
-                metrics["network_recv"] = 0
-                metrics["network_sent"] = 0
-                metrics["network_packets_recv"] = 0
-                metrics["network_packets_sent"] = 0
-        except Exception:
-            metrics["network_recv"] = 0
-            metrics["network_sent"] = 0
-            metrics["network_packets_recv"] = 0
-            metrics["network_packets_sent"] = 0
-        
-        return metrics
-    finally:
-        try:
-            ssh.close()
-        except Exception:
-            pass
+            results[name] = fut.result()
+        except Exception as e:
+            logger.warning(f"Не удалось собрать метрики хоста {name}: {e}")
+            results[name] = {"ok": False, "error": str(e)}
+    return results
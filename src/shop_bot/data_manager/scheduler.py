@@ -1,8 +1,12 @@
 import asyncio
 import logging
-import json
+import re
+import sys
+import time
 
+from collections import OrderedDict
 from datetime import datetime, timedelta
+from functools import lru_cache
 
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from aiogram import Bot
@@ -18,17 +22,59 @@ from shop_bot.bot import keyboards
 
 CHECK_INTERVAL_SECONDS = 300
 NOTIFY_BEFORE_HOURS = {72, 48, 24, 1}
-notified_users = {}
+# Часы до истечения берутся целыми, поэтому окно (h-1, h] сводится к точному совпадению с h.
+_NOTIFY_MARKS = frozenset(NOTIFY_BEFORE_HOURS)
+# Бит на каждую отметку: отправленные уведомления по ключу хранятся одним int.
+_NOTIFY_BIT = {mark: 1 << i for i, mark in enumerate(sorted(NOTIFY_BEFORE_HOURS))}
+notified_users: dict[tuple[int, int], int] = {}
 
 logger = logging.getLogger(__name__)
 
+_USER_ID_RE = re.compile(r"user(\d+)")
+
 
 
 SPEEDTEST_INTERVAL_SECONDS = 8 * 3600
-_last_speedtests_run_at: datetime | None = None
-_last_backup_run_at: datetime | None = None
-_last_resource_collect_at: datetime | None = None
-_last_resource_alert_at: dict[tuple[str, str, str], datetime] = {}
+SYNC_CONCURRENCY = 8
+SPEEDTEST_CONCURRENCY = 3
+# Настройки, которые планировщик читает за один цикл одним запросом.
+_SCHEDULER_SETTING_KEYS = (
+    "monitoring_enabled",
+    "monitoring_interval_sec",
+    "monitoring_cpu_threshold",
+    "monitoring_mem_threshold",
+    "monitoring_disk_threshold",
+    "monitoring_alert_cooldown_sec",
+    "backup_interval_days",
+    "speedtest_concurrency",
+)
+# Последние отправки алертов для кулдауна; ограничены по размеру (LRU).
+ALERT_COOLDOWN_MAX_KEYS = 4096
+_last_resource_alert_at: OrderedDict[tuple[str, str, str, str], datetime] = OrderedDict()
+ADMIN_IDS_TTL_SEC = 30
+_admin_ids_cache: dict = {'ids': None, 'ts': 0.0}
+
+def _load_scheduler_settings(settings: dict[str, str | None] | None = None) -> dict[str, str | None]:
+    if settings is not None:
+        return settings
+    return rw_repo.get_settings_bulk(list(_SCHEDULER_SETTING_KEYS))
+
+async def _db(fn, *args, **kwargs):
+    """Синхронный вызов БД в отдельном потоке, чтобы не блокировать цикл событий."""
+    return await asyncio.to_thread(fn, *args, **kwargs)
+
+@lru_cache(maxsize=4096)
+def _parse_iso(value: str) -> datetime | None:
+    """ISO-время из БД или ответа Remnawave; одинаковые значения повторяются между ключами."""
+    if sys.version_info < (3, 11):
+        value = value.replace('Z', '+00:00')
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return None
+
+def _remote_email(remote_user: dict) -> str:
+    return (remote_user.get('email') or remote_user.get('accountEmail') or '').strip()
 
 def format_time_left(hours: int) -> str:
     if hours >= 24:
@@ -75,56 +121,48 @@ def _cleanup_notified_users(all_db_keys: list[dict]):
         return
 
     logger.debug("Scheduler: Очищаю кэш уведомлений...")
-    
-    active_key_ids = {key['key_id'] for key in all_db_keys}
-    
-    users_to_check = list(notified_users.keys())
-    
-    cleaned_users = 0
-    cleaned_keys = 0
-
-    for user_id in users_to_check:
-        keys_to_check = list(notified_users[user_id].keys())
-        for key_id in keys_to_check:
-            if key_id not in active_key_ids:
-                del notified_users[user_id][key_id]
-                cleaned_keys += 1
-        
-        if not notified_users[user_id]:
-            del notified_users[user_id]
-            cleaned_users += 1
-    
-    if cleaned_users > 0 or cleaned_keys > 0:
-        logger.debug(f"Scheduler: Очистка завершена. Удалено записей пользователей: {cleaned_users}, ключей: {cleaned_keys}.")
+
+    active = {(key['user_id'], key['key_id']) for key in all_db_keys}
+    stale = notified_users.keys() - active
+    for entry in stale:
+        del notified_users[entry]
+
+    if stale:
+        logger.debug(f"Scheduler: Очистка завершена. Удалено записей ключей: {len(stale)}.")
 
 async def check_expiring_subscriptions(bot: Bot):
     logger.debug("Scheduler: Проверяю истекающие подписки...")
     current_time = datetime.now()
-    all_keys = rw_repo.get_all_keys()
+    all_keys = await _db(rw_repo.get_all_keys)
     
     _cleanup_notified_users(all_keys)
-    
+
+    # Сначала дешёвый отбор ключей, попадающих в окно уведомлений,
+    # затем отправка только по ним.
+    horizon = current_time + timedelta(hours=max(_NOTIFY_MARKS) + 1)
+    due: list[tuple[dict, datetime, int]] = []
     for key in all_keys:
         try:
-            expiry_date = datetime.fromisoformat(key['expiry_date'])
-            time_left = expiry_date - current_time
-
-            if time_left.total_seconds() < 0:
+            expiry_date = _parse_iso(key['expiry_date'])
+            if expiry_date is None or not current_time <= expiry_date < horizon:
                 continue
+            total_hours_left = int((expiry_date - current_time).total_seconds()) // 3600
+            if total_hours_left in _NOTIFY_MARKS:
+                due.append((key, expiry_date, total_hours_left))
+        except Exception as e:
+            logger.error(f"Scheduler: Ошибка обработки истечения для ключа {key.get('key_id')}: {e}")
 
-            total_hours_left = int(time_left.total_seconds() / 3600)
+    for key, expiry_date, hours_mark in due:
+        try:
             user_id = key['user_id']
             key_id = key['key_id']
+            entry = (user_id, key_id)
+            bit = _NOTIFY_BIT[hours_mark]
+
+            if not notified_users.get(entry, 0) & bit:
+                await send_subscription_notification(bot, user_id, key_id, hours_mark, expiry_date)
+                notified_users[entry] = notified_users.get(entry, 0) | bit
 
-            for hours_mark in NOTIFY_BEFORE_HOURS:
-                if hours_mark - 1 < total_hours_left <= hours_mark:
-                    notified_users.setdefault(user_id, {}).setdefault(key_id, set())
-                    
-                    if hours_mark not in notified_users[user_id][key_id]:
-                        await send_subscription_notification(bot, user_id, key_id, hours_mark, expiry_date)
-                        notified_users[user_id][key_id].add(hours_mark)
-                    break 
-                    
         except Exception as e:
             logger.error(f"Scheduler: Ошибка обработки истечения для ключа {key.get('key_id')}: {e}")
 
@@ -132,33 +170,50 @@ async def sync_keys_with_panels():
     logger.debug("Scheduler: Запускаю синхронизацию с Remnawave API...")
     total_affected_records = 0
 
-    squads = rw_repo.list_squads()
+    squads = await _db(rw_repo.list_squads_brief)
     if not squads:
         logger.debug("Scheduler: Сквады Remnawave не настроены. Синхронизация пропущена.")
         return
 
-    for squad in squads:
-        host_name = (squad.get('host_name') or squad.get('name') or '').strip() or 'unknown'
-        squad_uuid = (squad.get('squad_uuid') or squad.get('squadUuid') or '').strip()
+    targets: list[tuple[str, str]] = []
+    for raw_host_name, raw_squad_uuid in squads:
+        host_name = (raw_host_name or '').strip() or 'unknown'
+        squad_uuid = (raw_squad_uuid or '').strip()
         if not squad_uuid:
             logger.warning("Scheduler: Сквад '%s' не имеет squad_uuid — пропускаю синхронизацию.", host_name)
             continue
+        targets.append((host_name, squad_uuid))
 
-        try:
-            remote_users = await remnawave_api.list_users(host_name=host_name, squad_uuid=squad_uuid)
-        except Exception as exc:
-            logger.error("Scheduler: Не удалось получить пользователей Remnawave для '%s': %s", host_name, exc)
+    # Пользователей всех сквадов запрашиваем параллельно, сверку с БД делаем последовательно.
+    sem = asyncio.Semaphore(SYNC_CONCURRENCY)
+
+    async def _fetch(host_name: str, squad_uuid: str) -> list[dict]:
+        async with sem:
+            return await remnawave_api.list_users(host_name=host_name, squad_uuid=squad_uuid)
+
+    fetched = await asyncio.gather(
+        *(_fetch(host_name, squad_uuid) for host_name, squad_uuid in targets),
+        return_exceptions=True,
+    )
+
+    for (host_name, squad_uuid), remote_users in zip(targets, fetched):
+        if isinstance(remote_users, BaseException):
+            logger.error("Scheduler: Не удалось получить пользователей Remnawave для '%s': %s", host_name, remote_users)
             continue
 
-        remote_by_email: dict[str, tuple[str, dict]] = {}
-        for remote_user in remote_users or []:
-            raw_email = (remote_user.get('email') or remote_user.get('accountEmail') or '').strip()
-            if not raw_email:
-                continue
-            remote_by_email[raw_email.lower()] = (raw_email, remote_user)
+        remote_by_email: dict[str, tuple[str, dict]] = {
+            email.lower(): (email, remote_user)
+            for remote_user in remote_users or []
+            for email in (_remote_email(remote_user),)
+            if email
+        }
 
-        keys_in_db = rw_repo.get_keys_for_host(host_name) or []
+        keys_in_db = await _db(rw_repo.get_keys_for_host, host_name) or []
         now = datetime.now()
+        # Изменения копим по скваду и записываем пачками после обхода ключей.
+        pending_updates: list[tuple[str, dict]] = []
+        pending_deletes: list[str] = []
+        pending_inserts: list[tuple[int, dict]] = []
 
         for db_key in keys_in_db:
             raw_email = (db_key.get('key_email') or db_key.get('email') or '').strip()
@@ -173,13 +228,7 @@ async def sync_keys_with_panels():
                 remote_email, remote_user = remote_entry
 
             expiry_raw = db_key.get('expiry_date') or db_key.get('expire_at')
-            try:
-                expiry_date = datetime.fromisoformat(str(expiry_raw)) if expiry_raw else None
-            except Exception:
-                try:
-                    expiry_date = datetime.fromisoformat(str(expiry_raw).replace('Z', '+00:00'))
-                except Exception:
-                    expiry_date = None
+            expiry_date = _parse_iso(str(expiry_raw)) if expiry_raw else None
 
             if expiry_date and expiry_date < now - timedelta(days=5):
                 logger.debug(
@@ -195,18 +244,12 @@ async def sync_keys_with_panels():
                         raw_email,
                         exc,
                     )
-                if rw_repo.delete_key_by_email(raw_email):
-                    total_affected_records += 1
+                pending_deletes.append(raw_email)
                 continue
 
             if remote_user:
                 expire_value = remote_user.get('expireAt') or remote_user.get('expiryDate')
-                remote_dt = None
-                if expire_value:
-                    try:
-                        remote_dt = datetime.fromisoformat(str(expire_value).replace('Z', '+00:00'))
-                    except Exception:
-                        remote_dt = None
+                remote_dt = _parse_iso(str(expire_value)) if expire_value else None
                 local_ms = int(expiry_date.timestamp() * 1000) if expiry_date else None
                 remote_ms = int(remote_dt.timestamp() * 1000) if remote_dt else None
                 subscription_url = remnawave_api.extract_subscription_url(remote_user)
@@ -219,27 +262,28 @@ async def sync_keys_with_panels():
                     needs_update = True
 
                 if needs_update:
-                    if rw_repo.update_key_status_from_server(raw_email, remote_user):
-                        total_affected_records += 1
-                        logger.debug(
-                            "Scheduler: Обновлён ключ '%s' на основе данных Remnawave (host '%s').",
-                            raw_email,
-                            host_name,
-                        )
+                    pending_updates.append((raw_email, remote_user))
+                    logger.debug(
+                        "Scheduler: Ключ '%s' будет обновлён на основе данных Remnawave (host '%s').",
+                        raw_email,
+                        host_name,
+                    )
             else:
                 logger.warning(
                     "Scheduler: Ключ '%s' (host '%s') отсутствует в Remnawave. Помечаю к удалению в локальной БД.",
                     raw_email,
                     host_name,
                 )
-                if rw_repo.update_key_status_from_server(raw_email, None):
-                    total_affected_records += 1
+                pending_deletes.append(raw_email)
+
+        if pending_deletes:
+            total_affected_records += await _db(rw_repo.bulk_delete_keys_by_email, pending_deletes)
+        if pending_updates:
+            total_affected_records += await _db(rw_repo.bulk_update_keys_from_server, pending_updates)
 
         if remote_by_email:
             for normalized_email, (remote_email, remote_user) in remote_by_email.items():
-                import re
-
-                match = re.search(r"user(\d+)", remote_email)
+                match = _USER_ID_RE.search(remote_email)
                 user_id = int(match.group(1)) if match else None
                 if not user_id:
                     logger.warning(
@@ -248,7 +292,7 @@ async def sync_keys_with_panels():
                     )
                     continue
 
-                if not rw_repo.get_user(user_id):
+                if not await _db(rw_repo.get_user, user_id):
                     logger.warning(
                         "Scheduler: Осиротевший пользователь '%s' ссылается на несуществующего user_id=%s.",
                         remote_email,
@@ -256,7 +300,7 @@ async def sync_keys_with_panels():
                     )
                     continue
 
-                if rw_repo.get_key_by_email(remote_email):
+                if await _db(rw_repo.get_key_by_email, remote_email):
                     continue
 
                 payload = dict(remote_user)
@@ -264,89 +308,158 @@ async def sync_keys_with_panels():
                 payload.setdefault('squad_uuid', squad_uuid)
                 payload.setdefault('squadUuid', squad_uuid)
 
-                new_id = rw_repo.record_key_from_payload(
-                    user_id=user_id,
-                    payload=payload,
-                    host_name=host_name,
-                    description=payload.get('description'),
-                    tag=payload.get('tag'),
+                pending_inserts.append((user_id, payload))
+                logger.info(
+                    "Scheduler: Привязываю осиротевшего пользователя '%s' (host '%s') к user_id=%s.",
+                    remote_email,
+                    host_name,
+                    user_id,
+                )
+
+        if pending_inserts:
+            recorded = await _db(rw_repo.record_keys_bulk, pending_inserts, host_name=host_name)
+            total_affected_records += recorded
+            if recorded < len(pending_inserts):
+                logger.warning(
+                    "Scheduler: Не удалось привязать %s осиротевших пользователей (host '%s').",
+                    len(pending_inserts) - recorded,
+                    host_name,
                 )
-                if new_id:
-                    total_affected_records += 1
-                    logger.info(
-                        "Scheduler: Привязал осиротевшего пользователя '%s' (host '%s') к user_id=%s как key_id=%s.",
-                        remote_email,
-                        host_name,
-                        user_id,
-                        new_id,
-                    )
-                else:
-                    logger.warning(
-                        "Scheduler: Не удалось привязать осиротевшего пользователя '%s' (host '%s').",
-                        remote_email,
-                        host_name,
-                    )
 
     logger.debug(
         "Scheduler: Синхронизация с Remnawave API завершена. Затронуто записей: %s.",
         total_affected_records,
     )
-async def periodic_subscription_check(bot_controller: BotController):
-    logger.info("Scheduler: Планировщик фоновых задач запущен.")
-    await asyncio.sleep(10)
+def _running_bot(bot_controller: BotController) -> Bot | None:
+    if not bot_controller.get_status().get("is_running"):
+        return None
+    return bot_controller.get_bot_instance()
 
-    while True:
-        try:
-            await sync_keys_with_panels()
 
+def _monitoring_interval(settings: dict[str, str | None]) -> int | None:
+    if (settings.get("monitoring_enabled") or "true").strip().lower() != "true":
+        return None
+    try:
+        interval_sec = int((settings.get("monitoring_interval_sec") or "300").strip() or 300)
+    except Exception:
+        interval_sec = 300
+    return max(30, interval_sec)
 
-            await _maybe_run_periodic_speedtests()
 
+def _backup_interval(settings: dict[str, str | None]) -> int | None:
+    try:
+        days = int(str(settings.get("backup_interval_days") or "1").strip() or "1")
+    except Exception:
+        days = 1
+    if days <= 0:
+        return None
+    return days * 24 * 3600
 
-            bot = bot_controller.get_bot_instance() if bot_controller.get_status().get("is_running") else None
-            if bot:
-                await _maybe_run_daily_backup(bot)
 
+async def _task_sync(bot_controller: BotController, settings: dict[str, str | None]) -> bool:
+    await sync_keys_with_panels()
+    return True
 
-            bot = bot_controller.get_bot_instance() if bot_controller.get_status().get("is_running") else None
-            await _maybe_collect_resource_metrics(bot)
 
-            if bot_controller.get_status().get("is_running"):
-                bot = bot_controller.get_bot_instance()
-                if bot:
-                    await check_expiring_subscriptions(bot)
-                else:
-                    logger.warning("Scheduler: Бот помечен как запущенный, но экземпляр недоступен.")
-            else:
-                logger.debug("Scheduler: Бот остановлен, уведомления пользователям пропущены.")
+async def _task_speedtests(bot_controller: BotController, settings: dict[str, str | None]) -> bool:
+    return await _maybe_run_periodic_speedtests(settings=settings)
+
 
+async def _task_backup(bot_controller: BotController, settings: dict[str, str | None]) -> bool:
+    bot = _running_bot(bot_controller)
+    if not bot:
+        return False
+    return await _maybe_run_daily_backup(bot, settings=settings)
+
+
+async def _task_resource_metrics(bot_controller: BotController, settings: dict[str, str | None]) -> bool:
+    await _maybe_collect_resource_metrics(_running_bot(bot_controller), settings=settings)
+    return True
+
+
+async def _task_expiring(bot_controller: BotController, settings: dict[str, str | None]) -> bool:
+    if not bot_controller.get_status().get("is_running"):
+        logger.debug("Scheduler: Бот остановлен, уведомления пользователям пропущены.")
+        return True
+    bot = bot_controller.get_bot_instance()
+    if not bot:
+        logger.warning("Scheduler: Бот помечен как запущенный, но экземпляр недоступен.")
+        return True
+    await check_expiring_subscriptions(bot)
+    return True
+
+
+# Таблица фоновых задач: (имя, интервал в секундах по настройкам, задача).
+# Интервал None — задача выключена; задача, вернувшая False, повторяется
+# через CHECK_INTERVAL_SECONDS.
+_SCHEDULED_TASKS = (
+    ("sync", lambda settings: CHECK_INTERVAL_SECONDS, _task_sync),
+    ("speedtests", lambda settings: SPEEDTEST_INTERVAL_SECONDS, _task_speedtests),
+    ("backup", _backup_interval, _task_backup),
+    ("resource_metrics", _monitoring_interval, _task_resource_metrics),
+    ("expiring", lambda settings: CHECK_INTERVAL_SECONDS, _task_expiring),
+)
+
+
+async def _run_scheduled_task(name: str, task, bot_controller: BotController, settings: dict[str, str | None]) -> bool:
+    """Ошибка одной задачи не должна отменять остальные задачи группы."""
+    try:
+        return await task(bot_controller, settings) is True
+    except Exception as e:
+        logger.error(f"Scheduler: Необработанная ошибка в задаче {name}: {e}", exc_info=True)
+        return False
+
+
+async def periodic_subscription_check(bot_controller: BotController):
+    logger.info("Scheduler: Планировщик фоновых задач запущен.")
+    await asyncio.sleep(10)
+
+    next_run: dict[str, datetime] = {name: datetime.now() for name, _, _ in _SCHEDULED_TASKS}
+    while True:
+        now = datetime.now()
+        try:
+            settings = await _db(_load_scheduler_settings)
         except Exception as e:
-            logger.error(f"Scheduler: Необработанная ошибка в основном цикле: {e}", exc_info=True)
-            
-        logger.info(f"Scheduler: Цикл завершён. Следующая проверка через {CHECK_INTERVAL_SECONDS} сек.")
-        await asyncio.sleep(CHECK_INTERVAL_SECONDS)
-
-async def _maybe_run_periodic_speedtests():
-    global _last_speedtests_run_at
-    now = datetime.now()
-    if _last_speedtests_run_at and (now - _last_speedtests_run_at).total_seconds() < SPEEDTEST_INTERVAL_SECONDS:
-        return
+            logger.error(f"Scheduler: Не удалось прочитать настройки: {e}", exc_info=True)
+            settings = {}
+
+        due = [t for t in _SCHEDULED_TASKS if next_run[t[0]] <= now]
+        running: list[asyncio.Task] = []
+        try:
+            async with asyncio.TaskGroup() as tg:
+                for name, _, task in due:
+                    running.append(tg.create_task(_run_scheduled_task(name, task, bot_controller, settings)))
+        except* Exception as eg:
+            logger.error(f"Scheduler: Необработанная ошибка в основном цикле: {eg!r}", exc_info=True)
+        for (name, interval_fn, _), t in zip(due, running):
+            done = t.done() and not t.cancelled() and t.exception() is None and t.result()
+            interval = interval_fn(settings)
+            if not done or interval is None:
+                interval = CHECK_INTERVAL_SECONDS
+            next_run[name] = now + timedelta(seconds=interval)
+
+        delay = max(1.0, (min(next_run.values()) - datetime.now()).total_seconds())
+        logger.info(f"Scheduler: Цикл завершён. Следующая проверка через {int(delay)} сек.")
+        await asyncio.sleep(delay)
+
+async def _maybe_run_periodic_speedtests(settings: dict[str, str | None] | None = None) -> bool:
     try:
-        await _run_speedtests_for_all_ssh_targets()
-        _last_speedtests_run_at = now
+        await _run_speedtests_for_all_ssh_targets(settings=settings)
+        return True
     except Exception as e:
         logger.error(f"Scheduler: Ошибка запуска speedtests: {e}", exc_info=True)
+        return False
 
-async def _run_speedtests_for_all_hosts():
-    hosts = rw_repo.get_all_hosts()
-    if not hosts:
-        logger.debug("Scheduler: Нет хостов для измерений скорости.")
-        return
-    logger.info(f"Scheduler: Запускаю speedtest для {len(hosts)} хост(ов)...")
-    for h in hosts:
-        host_name = h.get('host_name')
-        if not host_name:
-            continue
+def _speedtest_concurrency(settings: dict[str, str | None] | None = None) -> int:
+    settings = _load_scheduler_settings(settings)
+    try:
+        return max(1, int((settings.get("speedtest_concurrency") or "").strip() or SPEEDTEST_CONCURRENCY))
+    except Exception:
+        return SPEEDTEST_CONCURRENCY
+
+
+async def _run_speedtest_for_host(sem: asyncio.Semaphore, host_name: str):
+    async with sem:
         try:
             logger.info(f"Scheduler: Speedtest для '{host_name}' запущен...")
 
@@ -367,16 +480,22 @@ async def _run_speedtests_for_all_hosts():
         except Exception as e:
             logger.error(f"Scheduler: Ошибка выполнения speedtest для '{host_name}': {e}", exc_info=True)
 
-async def _run_speedtests_for_all_ssh_targets():
-    targets = rw_repo.get_all_ssh_targets() or []
-    if not targets:
-        logger.debug("Scheduler: Нет SSH-целей для измерений скорости.")
+
+async def _run_speedtests_for_all_hosts(settings: dict[str, str | None] | None = None):
+    hosts = await _db(rw_repo.get_all_hosts)
+    if not hosts:
+        logger.debug("Scheduler: Нет хостов для измерений скорости.")
         return
-    logger.info(f"Scheduler: Запускаю SSH speedtest для {len(targets)} цел(ей)...")
-    for t in targets:
-        target_name = (t.get('target_name') or '').strip()
-        if not target_name:
-            continue
+    logger.info(f"Scheduler: Запускаю speedtest для {len(hosts)} хост(ов)...")
+    sem = asyncio.Semaphore(_speedtest_concurrency(settings))
+    await asyncio.gather(
+        *(_run_speedtest_for_host(sem, h['host_name']) for h in hosts if h.get('host_name')),
+        return_exceptions=True,
+    )
+
+
+async def _run_speedtest_for_target(sem: asyncio.Semaphore, target_name: str):
+    async with sem:
         try:
             logger.info(f"Scheduler: SSH speedtest для цели '{target_name}' запущен...")
             try:
@@ -396,8 +515,34 @@ async def _run_speedtests_for_all_ssh_targets():
             logger.error(f"Scheduler: Ошибка выполнения SSH speedtest для цели '{target_name}': {e}", exc_info=True)
 
 
+async def _run_speedtests_for_all_ssh_targets(settings: dict[str, str | None] | None = None):
+    targets = await _db(rw_repo.get_all_ssh_targets) or []
+    if not targets:
+        logger.debug("Scheduler: Нет SSH-целей для измерений скорости.")
+        return
+    logger.info(f"Scheduler: Запускаю SSH speedtest для {len(targets)} цел(ей)...")
+    sem = asyncio.Semaphore(_speedtest_concurrency(settings))
+    names = [(t.get('target_name') or '').strip() for t in targets]
+    await asyncio.gather(
+        *(_run_speedtest_for_target(sem, name) for name in names if name),
+        return_exceptions=True,
+    )
+
+
+
+def _disks_max(disks: list[dict] | None) -> float | None:
+    """Максимальная заполненность среди дисков; None, если дисков нет."""
+    return max((d.get('percent') or 0 for d in disks or ()), default=None)
+
 
-async def _maybe_collect_resource_metrics(bot: Bot | None):
+def _store_resource_metrics(rows: list[dict]) -> int:
+    """Сериализовать raw_json и записать все метрики тика одной транзакцией."""
+    for row in rows:
+        row['raw_json'] = resource_monitor.dumps_metrics(resource_monitor.flatten_metrics(row['raw_json']))
+    return rw_repo.insert_resource_metrics(rows)
+
+
+async def _maybe_collect_resource_metrics(bot: Bot | None, settings: dict[str, str | None] | None = None):
     """Периодический сбор метрик (локально + SSH на хостах) и отправка алертов при превышении порогов.
     Читает настройки:
       - monitoring_enabled (true/false)
@@ -405,18 +550,11 @@ async def _maybe_collect_resource_metrics(bot: Bot | None):
       - monitoring_cpu_threshold, monitoring_mem_threshold, monitoring_disk_threshold (проценты)
       - monitoring_alert_cooldown_sec (по умолчанию 3600)
     """
-    global _last_resource_collect_at, _last_resource_alert_at
     try:
-        enabled = (rw_repo.get_setting("monitoring_enabled") or "true").strip().lower() == "true"
-        if not enabled:
+        settings = _load_scheduler_settings(settings)
+        if _monitoring_interval(settings) is None:
             return
-        try:
-            interval_sec = int((rw_repo.get_setting("monitoring_interval_sec") or "300").strip() or 300)
-        except Exception:
-            interval_sec = 300
         now = datetime.now()
-        if _last_resource_collect_at and (now - _last_resource_collect_at).total_seconds() < max(30, interval_sec):
-            return
 
 
         def _to_int(s: str | None, default: int) -> int:
@@ -424,78 +562,77 @@ async def _maybe_collect_resource_metrics(bot: Bot | None):
                 return int((s or "").strip() or default)
             except Exception:
                 return default
-        cpu_thr = _to_int(rw_repo.get_setting("monitoring_cpu_threshold"), 90)
-        mem_thr = _to_int(rw_repo.get_setting("monitoring_mem_threshold"), 90)
-        disk_thr = _to_int(rw_repo.get_setting("monitoring_disk_threshold"), 90)
-        cooldown = _to_int(rw_repo.get_setting("monitoring_alert_cooldown_sec"), 3600)
+        cpu_thr = _to_int(settings.get("monitoring_cpu_threshold"), 90)
+        mem_thr = _to_int(settings.get("monitoring_mem_threshold"), 90)
+        disk_thr = _to_int(settings.get("monitoring_disk_threshold"), 90)
+        cooldown = _to_int(settings.get("monitoring_alert_cooldown_sec"), 3600)
 
 
+        metric_rows: list[dict] = []
         try:
-            local = resource_monitor.get_local_metrics()
+            local = await resource_monitor.get_local_metrics_async()
             cpu_p = (local.get('cpu') or {}).get('percent')
             mem_p = (local.get('memory') or {}).get('percent')
-            disks = local.get('disks') or []
-            disk_p = max((d.get('percent') or 0) for d in disks) if disks else None
-            rw_repo.insert_resource_metric(
-                'local', 'panel',
+            disk_p = _disks_max(local.get('disks'))
+            metric_rows.append(dict(
+                scope='local', object_name='panel',
                 cpu_percent=cpu_p, mem_percent=mem_p, disk_percent=disk_p,
                 load1=(local.get('cpu') or {}).get('loadavg',[None])[0] if (local.get('cpu') or {}).get('loadavg') else None,
                 net_bytes_sent=(local.get('net') or {}).get('bytes_sent'),
                 net_bytes_recv=(local.get('net') or {}).get('bytes_recv'),
-                raw_json=json.dumps(local, ensure_ascii=False)
-            )
+                raw_json=local,
+            ))
             await _maybe_alert(bot, scope='local', name='panel', cpu=cpu_p, mem=mem_p, disk=disk_p,
-                               cpu_thr=cpu_thr, mem_thr=mem_thr, disk_thr=disk_thr, cooldown_sec=cooldown)
+                               cpu_thr=cpu_thr, mem_thr=mem_thr, disk_thr=disk_thr, cooldown_sec=cooldown, now=now)
         except Exception:
             logger.debug("Scheduler: local metrics collection failed", exc_info=True)
 
 
-        hosts = rw_repo.get_all_hosts() or []
-        for h in hosts:
-            name = h.get('host_name') or ''
-            if not name:
-                continue
-
-            if not (h.get('ssh_host') and h.get('ssh_user')):
-                continue
+        hosts = await _db(rw_repo.get_all_hosts) or []
+        names = [
+            h.get('host_name') for h in hosts
+            if h.get('host_name') and h.get('ssh_host') and h.get('ssh_user')
+        ]
+        try:
+            remote = await asyncio.get_running_loop().run_in_executor(
+                None, resource_monitor.get_remote_metrics_for_hosts, names
+            )
+        except Exception:
+            logger.debug("Scheduler: host metrics collection failed", exc_info=True)
+            remote = {}
+        alerts = []
+        for name in names:
             try:
-                rm = resource_monitor.get_remote_metrics_for_host(name)
+                rm = remote.get(name) or {}
                 mem_p = (rm.get('memory') or {}).get('percent')
-                disks = rm.get('disks') or []
-                disk_p = max((d.get('percent') or 0) for d in disks) if disks else None
-                rw_repo.insert_resource_metric(
-                    'host', name,
+                disk_p = _disks_max(rm.get('disks'))
+                metric_rows.append(dict(
+                    scope='host', object_name=name,
                     mem_percent=mem_p,
                     disk_percent=disk_p,
                     load1=(rm.get('loadavg') or [None])[0],
-                    raw_json=json.dumps(rm, ensure_ascii=False)
-                )
-                await _maybe_alert(bot, scope='host', name=name, cpu=None, mem=mem_p, disk=disk_p,
-                                   cpu_thr=cpu_thr, mem_thr=mem_thr, disk_thr=disk_thr, cooldown_sec=cooldown)
+                    raw_json=rm,
+                ))
+                alerts.append(_maybe_alert(bot, scope='host', name=name, cpu=None, mem=mem_p, disk=disk_p,
+                                           cpu_thr=cpu_thr, mem_thr=mem_thr, disk_thr=disk_thr, cooldown_sec=cooldown, now=now))
             except Exception:
                 logger.debug("Scheduler: host metrics collection failed for %s", name, exc_info=True)
-
-        _last_resource_collect_at = now
+        try:
+            await _db(_store_resource_metrics, metric_rows)
+        except Exception:
+            logger.error("Scheduler: Не удалось сохранить метрики ресурсов", exc_info=True)
+        if alerts:
+            await asyncio.gather(*alerts, return_exceptions=True)
     except Exception:
         logger.error("Scheduler: Ошибка сбора метрик ресурсов", exc_info=True)
 
 
-async def _maybe_run_daily_backup(bot: Bot):
-    """Ежедневный автобэкап базы и отправка админам. Интервал задаётся в настройках backup_interval_days."""
-    global _last_backup_run_at
-    now = datetime.now()
+async def _maybe_run_daily_backup(bot: Bot, settings: dict[str, str | None] | None = None) -> bool:
+    """Автобэкап базы и отправка админам. Интервал задаётся в настройках backup_interval_days."""
+    if _backup_interval(_load_scheduler_settings(settings)) is None:
+        return True
     try:
-        s = rw_repo.get_setting("backup_interval_days") or "1"
-        days = int(str(s).strip() or "1")
-    except Exception:
-        days = 1
-    if days <= 0:
-        return
-    interval_seconds = max(1, days) * 24 * 3600
-    if _last_backup_run_at and (now - _last_backup_run_at).total_seconds() < interval_seconds:
-        return
-    try:
-        zip_path = backup_manager.create_backup_file()
+        zip_path = await _db(backup_manager.create_backup_file)
         if zip_path and zip_path.exists():
             try:
                 sent = await backup_manager.send_backup_to_admins(bot, zip_path)
@@ -503,12 +640,20 @@ async def _maybe_run_daily_backup(bot: Bot):
             except Exception as e:
                 logger.error(f"Scheduler: Не удалось отправить бэкап: {e}")
             try:
-                backup_manager.cleanup_old_backups(keep=7)
+                await _db(backup_manager.cleanup_old_backups, keep=7)
             except Exception:
                 pass
-        _last_backup_run_at = now
+        return True
     except Exception as e:
         logger.error(f"Scheduler: Критическая ошибка при создании и отправке бэкапа: {e}", exc_info=True)
+        return False
+
+
+def _touch_alert(key: tuple[str, str, str, str], now: datetime) -> None:
+    _last_resource_alert_at[key] = now
+    _last_resource_alert_at.move_to_end(key)
+    if len(_last_resource_alert_at) > ALERT_COOLDOWN_MAX_KEYS:
+        _last_resource_alert_at.popitem(last=False)
 
 
 async def _maybe_alert(
@@ -523,9 +668,11 @@ async def _maybe_alert(
     mem_thr: int,
     disk_thr: int,
     cooldown_sec: int,
+    now: datetime | None = None,
 ):
     if not bot:
         return
+    now = now or datetime.now()
     
 
     cpu_warning = max(50, cpu_thr - 20)
@@ -595,32 +742,25 @@ async def _maybe_alert(
 
     if breaches:
         key = (scope, name, "critical", ",".join(sorted([b['type'] for b in breaches])))
-        now = datetime.now()
         last = _last_resource_alert_at.get(key)
         if not last or (now - last).total_seconds() >= max(60, cooldown_sec):
-            _last_resource_alert_at[key] = now
-            await _send_alert(bot, scope, name, breaches, 'critical')
+            _touch_alert(key, now)
+            await _send_alert(bot, scope, name, breaches, 'critical', now=now)
     
 
     if alerts:
         key = (scope, name, "warning", ",".join(sorted([a['type'] for a in alerts])))
-        now = datetime.now()
         last = _last_resource_alert_at.get(key)
         if not last or (now - last).total_seconds() >= max(300, cooldown_sec * 2):
-            _last_resource_alert_at[key] = now
-            await _send_alert(bot, scope, name, alerts, 'warning')
+            _touch_alert(key, now)
+            await _send_alert(bot, scope, name, alerts, 'warning', now=now)
 
 
-async def _send_alert(bot: Bot, scope: str, name: str, issues: list[dict], level: str):
-    """Отправка алерта админам"""
-    try:
-        admin_ids = rw_repo.get_admin_ids() or set()
-    except Exception:
-        admin_ids = set()
-    if not admin_ids:
-        return
-    
-
+@lru_cache(maxsize=128)
+def _format_alert_text(scope: str, name: str, issues: tuple[tuple[str, float, int, str], ...], level: str) -> tuple[str, str]:
+    """Текст алерта без отметки времени: (часть до времени, часть после).
+    issues — кортежи (тип, значение с точностью 0.1, порог, эмодзи).
+    """
     if level == 'critical':
         header_emoji = "🚨"
         header_text = "КРИТИЧЕСКОЕ ПРЕДУПРЕЖДЕНИЕ"
@@ -639,39 +779,60 @@ async def _send_alert(bot: Bot, scope: str, name: str, issues: list[dict], level
         obj_name = f"❓ {scope}:{name}"
     
 
-    text_lines = [
+    head = "\n".join([
         f"{header_emoji} <b>{header_text}</b>",
         "",
         f"🎯 <b>Объект:</b> {obj_name}",
-        f"⏰ <b>Время:</b> <code>{datetime.now().strftime('%d.%m.%Y %H:%M:%S')}</code>",
+    ])
+
+    tail_lines = [
         "",
         "📊 <b>Проблемы:</b>"
     ]
     
-    for issue in issues:
-        emoji = issue['emoji']
-        type_name = issue['type']
-        value = issue['value']
-        threshold = issue['threshold']
-        text_lines.append(f"  {emoji} <b>{type_name}:</b> {value:.1f}% (порог: {threshold}%)")
+    for type_name, value, threshold, emoji in issues:
+        tail_lines.append(f"  {emoji} <b>{type_name}:</b> {value:.1f}% (порог: {threshold}%)")
     
 
-    text_lines.extend([
+    tail_lines.extend([
         "",
         "💡 <b>Рекомендации:</b>",
         "• Проверьте нагрузку на систему",
         "• Освободите место на диске",
         "• Перезапустите сервисы при необходимости"
     ])
-    
-    text = "\n".join(text_lines)
-    
+    return head, "\n".join(tail_lines)
 
-    for admin_id in admin_ids:
+
+async def _admin_ids() -> set[int]:
+    """Список админов с кэшем на ADMIN_IDS_TTL_SEC: алерты одного тика не дёргают БД повторно."""
+    now = time.monotonic()
+    if _admin_ids_cache['ids'] is None or now - _admin_ids_cache['ts'] > ADMIN_IDS_TTL_SEC:
         try:
-            await bot.send_message(admin_id, text, parse_mode='HTML')
+            _admin_ids_cache['ids'] = set(await _db(rw_repo.get_admin_ids) or ())
+            _admin_ids_cache['ts'] = now
         except Exception:
-            continue
+            return set()
+    return _admin_ids_cache['ids']
 
 
+async def _send_alert(bot: Bot, scope: str, name: str, issues: list[dict], level: str, now: datetime | None = None):
+    """Отправка алерта админам"""
+    admin_ids = await _admin_ids()
+    if not admin_ids:
+        return
 
+    head, tail = _format_alert_text(
+        scope,
+        name,
+        tuple((i['type'], round(i['value'], 1), i['threshold'], i['emoji']) for i in issues),
+        level,
+    )
+    stamp = f"⏰ <b>Время:</b> <code>{(now or datetime.now()).strftime('%d.%m.%Y %H:%M:%S')}</code>"
+    text = f"{head}\n{stamp}\n{tail}"
+    
+
+    await asyncio.gather(
+        *(bot.send_message(admin_id, text, parse_mode='HTML') for admin_id in admin_ids),
+        return_exceptions=True,
+    )
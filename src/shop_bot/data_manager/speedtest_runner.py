@@ -314,7 +314,18 @@ def _ssh_connect(host_row: dict) -> paramiko.SSHClient:
     return ssh
 
 
-def _ssh_exec(ssh: paramiko.SSHClient, cmd: str, timeout: int = 180) -> tuple[int, str, str]:
+def _ssh_exec(ssh: paramiko.SSHClient, cmd: str, timeout: int = 180, combine_stderr: bool = False) -> tuple[int, str, str]:
+    if combine_stderr:
+        # stderr идёт в тот же поток, что и stdout: читаем один буфер, err всегда пустой.
+        chan = ssh.get_transport().open_session(timeout=timeout)
+        try:
+            chan.set_combine_stderr(True)
+            chan.settimeout(timeout)
+            chan.exec_command(cmd)
+            out = chan.makefile('rb').read().decode('utf-8', errors='ignore')
+            return chan.recv_exit_status(), out, ''
+        finally:
+            chan.close()
     stdin, stdout, stderr = ssh.exec_command(cmd, timeout=timeout)
     out = stdout.read().decode('utf-8', errors='ignore')
     err = stderr.read().decode('utf-8', errors='ignore')
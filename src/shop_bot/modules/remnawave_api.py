@@ -1,6 +1,9 @@
+import asyncio
+import http.cookiejar
 import json
 import logging
 import time
+import weakref
 from datetime import datetime, timezone, timedelta
 from typing import Any
 from urllib.parse import quote
@@ -22,6 +25,36 @@ class RemnawaveAPIError(RuntimeError):
     """Base error for Remnawave API interactions."""
 
 
+# Один клиент с keep-alive пулом на цикл событий: без повторных TCP/TLS-рукопожатий
+# на каждый запрос. httpx-клиент привязан к циклу, в котором создан, поэтому ключ — цикл.
+_HTTP_LIMITS = httpx.Limits(max_connections=50, max_keepalive_connections=20, keepalive_expiry=60.0)
+_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = weakref.WeakKeyDictionary()
+
+
+def _get_client() -> httpx.AsyncClient:
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None or client.is_closed:
+        # Клиент общий для всех панелей: Set-Cookie одной панели не должен уходить в другую,
+        # поэтому банка cookie ничего не принимает, а заданные cookie идут заголовком (_build_headers).
+        jar = http.cookiejar.CookieJar(policy=http.cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+        client = httpx.AsyncClient(timeout=30.0, limits=_HTTP_LIMITS, cookies=jar)
+        _clients[loop] = client
+    return client
+
+
+async def init_http_client() -> None:
+    """Создать общий клиент в текущем цикле заранее (при старте приложения)."""
+    _get_client()
+
+
+async def close_http_client() -> None:
+    """Закрыть клиент текущего цикла (при остановке приложения)."""
+    client = _clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+
 def _normalize_email_for_remnawave(email: str) -> str:
     """Normalize and validate email for Remnawave API.
 
@@ -117,6 +150,8 @@ def _build_headers(config: dict[str, Any]) -> dict[str, str]:
         "Authorization": f"Bearer {config['token']}",
         "Content-Type": "application/json",
     }
+    if config.get("cookies"):
+        headers["Cookie"] = "; ".join(f"{k}={v}" for k, v in config["cookies"].items())
     if config.get("is_local"):
         headers["X-Forwarded-Proto"] = "https"
         headers["X-Forwarded-For"] = "127.0.0.1"
@@ -136,28 +171,27 @@ async def _request(
     url = f"{config['base_url']}{path}"
     headers = _build_headers(config)
 
-    async with httpx.AsyncClient(cookies=config["cookies"], timeout=30.0) as client:
-
-        try:
-            full_url = httpx.URL(url).copy_merge_params(params or {})
-            logger.info("➡️ Remnawave: %s %s", method.upper(), str(full_url))
-        except Exception:
-            pass
-        t0 = time.perf_counter()
-        response = await client.request(
-            method=method,
-            url=url,
-            headers=headers,
-            json=json_payload,
-            params=params,
-        )
-        dt_ms = int((time.perf_counter() - t0) * 1000)
-        try:
-            status = response.status_code
-            ok = "OK" if status in expected_status else "ERROR"
-            logger.info("⬅️ Remnawave: %s %s — %s (%d мс)", method.upper(), path, f"{status} {ok}", dt_ms)
-        except Exception:
-            pass
+    client = _get_client()
+    try:
+        full_url = httpx.URL(url).copy_merge_params(params or {})
+        logger.info("➡️ Remnawave: %s %s", method.upper(), str(full_url))
+    except Exception:
+        pass
+    t0 = time.perf_counter()
+    response = await client.request(
+        method=method,
+        url=url,
+        headers=headers,
+        json=json_payload,
+        params=params,
+    )
+    dt_ms = int((time.perf_counter() - t0) * 1000)
+    try:
+        status = response.status_code
+        ok = "OK" if status in expected_status else "ERROR"
+        logger.info("⬅️ Remnawave: %s %s — %s (%d мс)", method.upper(), path, f"{status} {ok}", dt_ms)
+    except Exception:
+        pass
 
     if response.status_code not in expected_status:
         try:
@@ -183,28 +217,27 @@ async def _request_for_host(
     url = f"{config['base_url']}{path}"
     headers = _build_headers(config)
 
-    async with httpx.AsyncClient(cookies=config["cookies"], timeout=30.0) as client:
-
-        try:
-            full_url = httpx.URL(url).copy_merge_params(params or {})
-            logger.info("➡️ Remnawave[%s]: %s %s", host_name, method.upper(), str(full_url))
-        except Exception:
-            pass
-        t0 = time.perf_counter()
-        response = await client.request(
-            method=method,
-            url=url,
-            headers=headers,
-            json=json_payload,
-            params=params,
-        )
-        dt_ms = int((time.perf_counter() - t0) * 1000)
-        try:
-            status = response.status_code
-            ok = "OK" if status in expected_status else "ERROR"
-            logger.info("⬅️ Remnawave[%s]: %s %s — %s (%d мс)", host_name, method.upper(), path, f"{status} {ok}", dt_ms)
-        except Exception:
-            pass
+    client = _get_client()
+    try:
+        full_url = httpx.URL(url).copy_merge_params(params or {})
+        logger.info("➡️ Remnawave[%s]: %s %s", host_name, method.upper(), str(full_url))
+    except Exception:
+        pass
+    t0 = time.perf_counter()
+    response = await client.request(
+        method=method,
+        url=url,
+        headers=headers,
+        json=json_payload,
+        params=params,
+    )
+    dt_ms = int((time.perf_counter() - t0) * 1000)
+    try:
+        status = response.status_code
+        ok = "OK" if status in expected_status else "ERROR"
+        logger.info("⬅️ Remnawave[%s]: %s %s — %s (%d мс)", host_name, method.upper(), path, f"{status} {ok}", dt_ms)
+    except Exception:
+        pass
 
     if response.status_code not in expected_status:
         try:
@@ -6,17 +6,27 @@ import hashlib
 import html as html_escape
 import base64
 import time
+import threading
 import uuid
 from hmac import compare_digest
 from datetime import datetime, timezone, timedelta
 from functools import wraps
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from math import ceil
-from flask import Flask, request, render_template, redirect, url_for, flash, session, current_app, jsonify, send_file
+from flask import Flask, request, render_template, redirect, url_for, flash, session, current_app, jsonify, send_file, g, Response
+from flask import copy_current_request_context
+from flask.json.provider import DefaultJSONProvider
 from flask_wtf.csrf import CSRFProtect, generate_csrf
 import secrets
 import urllib.parse
 import urllib.request
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 logging.getLogger('werkzeug').setLevel(logging.WARNING)
@@ -24,6 +34,7 @@ logging.getLogger('werkzeug').setLevel(logging.WARNING)
 from shop_bot.modules import remnawave_api
 from shop_bot.bot import handlers
 from shop_bot.bot import keyboards
+from aiogram.exceptions import TelegramRetryAfter
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from shop_bot.support_bot_controller import SupportBotController
 from shop_bot.data_manager import speedtest_runner
@@ -31,20 +42,20 @@ from shop_bot.data_manager import resource_monitor
 from shop_bot.data_manager import backup_manager
 from shop_bot.data_manager import remnawave_repository as rw_repo
 from shop_bot.data_manager.remnawave_repository import (
-    get_all_settings, update_setting, get_all_hosts, get_plans_for_host,
-    create_host, delete_host, create_plan, delete_plan, update_plan, get_user_count,
-    get_total_keys_count, get_total_spent_sum, get_daily_stats_for_charts,
+    get_all_settings, get_settings_bulk, update_setting, get_all_hosts, get_plans_for_host,
+    create_host, delete_host, create_plan, delete_plan, update_plan,
+    get_daily_stats_for_charts,
     get_recent_transactions, get_paginated_transactions, get_all_users, get_user_keys,
     ban_user, unban_user, delete_user_keys, get_setting, find_and_complete_ton_transaction,
     find_and_complete_pending_transaction,
-    get_tickets_paginated, get_open_tickets_count, get_ticket, get_ticket_messages,
+    get_tickets_paginated, get_ticket, get_ticket_messages,
     add_support_message, set_ticket_status, delete_ticket,
-    get_closed_tickets_count, get_all_tickets_count, update_host_subscription_url,
-    update_host_url, update_host_name, update_host_ssh_settings, get_latest_speedtest, get_speedtests,
+    update_host_subscription_url,
+    update_host_url, update_host_name, update_host_ssh_settings, get_latest_speedtests_for_hosts, get_speedtests,
     get_all_keys, get_keys_for_user, delete_key_by_id, update_key_comment,
     get_balance, adjust_user_balance, get_referrals_for_user,
 
-    get_users_paginated, get_keys_counts_for_users,
+    get_users_paginated_with_key_counts, get_users_count,
 
     get_all_ssh_targets, get_ssh_target, create_ssh_target, update_ssh_target_fields, delete_ssh_target,
     get_user
@@ -58,7 +69,7 @@ from shop_bot.data_manager.database import update_host_remnawave_settings, get_p
 _bot_controller = None
 _support_bot_controller = SupportBotController()
 
-ALL_SETTINGS_KEYS = [
+ALL_SETTINGS_KEYS = frozenset([
     "panel_login", "panel_password", "about_text", "terms_url", "privacy_url",
     "support_user", "support_text", "channel_url", "telegram_bot_token",
     "telegram_bot_username", "admin_telegram_id", "yookassa_shop_id",
@@ -90,7 +101,390 @@ ALL_SETTINGS_KEYS = [
     "yoomoney_enabled", "yoomoney_wallet", "yoomoney_secret", "stars_per_rub", "stars_enabled",
 
     "yoomoney_api_token", "yoomoney_client_id", "yoomoney_client_secret", "yoomoney_redirect_uri",
-]
+])
+
+class OrjsonProvider(DefaultJSONProvider):
+    """JSON-ответы через orjson, если он установлен.
+    Даты и прочие нестандартные типы сериализуются так же, как в Flask по умолчанию.
+    """
+
+    def dumps(self, obj, **kwargs) -> str:
+        # response() всегда передаёт separators для компактного вывода — orjson и так компактен.
+        if orjson is None or kwargs.keys() - {"separators"}:
+            return super().dumps(obj, **kwargs)
+        try:
+            return orjson.dumps(
+                obj,
+                default=self.default,
+                option=orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME,
+            ).decode("utf-8")
+        except TypeError:
+            return super().dumps(obj, **kwargs)
+
+
+# Кэш настроек для страниц панели: они читаются почти на каждом запросе.
+# Сбрасывается при сохранении настроек из панели; изменения из бота подхватятся по TTL.
+SETTINGS_CACHE_TTL_SEC = 30
+REQUIRED_FOR_START = ('telegram_bot_token', 'telegram_bot_username', 'admin_telegram_id')
+REQUIRED_SUPPORT_FOR_START = ('support_bot_token', 'support_bot_username', 'admin_telegram_id')
+# Только те ключи, что нужны логину и общим данным шаблонов, а не все ~70 настроек.
+PANEL_SETTINGS_KEYS = tuple(dict.fromkeys((
+    'panel_login', 'panel_password', 'panel_brand_title',
+    *REQUIRED_FOR_START, *REQUIRED_SUPPORT_FOR_START,
+)))
+_settings_cache: dict = {"val": None, "derived": None, "ts": 0.0}
+_settings_cache_lock = threading.Lock()
+
+
+def _load_settings_cache() -> None:
+    settings = get_settings_bulk(list(PANEL_SETTINGS_KEYS))
+    _settings_cache["val"] = settings
+    # Флаги готовности меняются только вместе с настройками — считаем их при загрузке.
+    _settings_cache["derived"] = {
+        "all_settings_ok": all(settings.get(key) for key in REQUIRED_FOR_START),
+        "support_settings_ok": all(settings.get(key) for key in REQUIRED_SUPPORT_FOR_START),
+    }
+    _settings_cache["ts"] = time.monotonic()
+
+
+def get_panel_settings_cached() -> dict:
+    with _settings_cache_lock:
+        if _settings_cache["val"] is None or time.monotonic() - _settings_cache["ts"] > SETTINGS_CACHE_TTL_SEC:
+            _load_settings_cache()
+        return _settings_cache["val"]
+
+
+def get_settings_derived_cached() -> dict:
+    """all_settings_ok / support_settings_ok из того же кэша настроек."""
+    with _settings_cache_lock:
+        if _settings_cache["val"] is None or time.monotonic() - _settings_cache["ts"] > SETTINGS_CACHE_TTL_SEC:
+            _load_settings_cache()
+        return _settings_cache["derived"]
+
+
+def _invalidate_settings_cache() -> None:
+    with _settings_cache_lock:
+        _settings_cache["ts"] = 0.0
+        _settings_cache["val"] = None
+        _settings_cache["derived"] = None
+
+
+# Кэш JSON-ответов /monitor/series: браузер опрашивает их каждые несколько секунд,
+# и все открытые вкладки получают один и тот же сериализованный ответ.
+# Текущие метрики здесь не кэшируются — их уже кэширует resource_monitor.
+_monitor_cache: dict[str, tuple[float, bytes, dict]] = {}
+_monitor_cache_lock = threading.Lock()
+_MONITOR_CACHE_MAX = 256
+
+
+def ttl_cached(seconds: float):
+    """Кэшировать успешный JSON-ответ view на `seconds` по пути и query-строке."""
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            key = request.full_path
+            now = time.monotonic()
+            with _monitor_cache_lock:
+                hit = _monitor_cache.get(key)
+            if hit and hit[0] > now:
+                return Response(hit[1], mimetype='application/json', headers=hit[2]).make_conditional(request)
+            resp = current_app.make_response(f(*args, **kwargs))
+            if resp.status_code == 200:
+                body = resp.get_data()
+                headers = {h: resp.headers[h] for h in ('ETag', 'Cache-Control') if h in resp.headers}
+                with _monitor_cache_lock:
+                    if len(_monitor_cache) >= _MONITOR_CACHE_MAX:
+                        for k in [k for k, (exp, _, _) in _monitor_cache.items() if exp <= now] or list(_monitor_cache):
+                            del _monitor_cache[k]
+                    _monitor_cache[key] = (now + seconds, body, headers)
+            return resp
+        return wrapper
+    return decorator
+
+
+# Фоновые задачи панели: долгие вызовы Remnawave не держат запрос открытым.
+# Клиент шлёт X-Background-Task: 1, получает 202 + task_id и опрашивает /admin/tasks/<id>.
+ADMIN_TASKS_MAX = 256
+_admin_task_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="panel-task")
+_admin_tasks: "OrderedDict[str, dict]" = OrderedDict()
+_admin_tasks_lock = threading.Lock()
+
+
+def _set_admin_task(task_id: str, state: dict) -> None:
+    with _admin_tasks_lock:
+        _admin_tasks[task_id] = state
+        _admin_tasks.move_to_end(task_id)
+        while len(_admin_tasks) > ADMIN_TASKS_MAX:
+            _admin_tasks.popitem(last=False)
+
+
+def _get_admin_task(task_id: str) -> dict | None:
+    with _admin_tasks_lock:
+        return _admin_tasks.get(task_id)
+
+
+def background_capable(f):
+    """Разрешить выполнить JSON-view в фоне по заголовку X-Background-Task; без него — как обычно."""
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        if request.headers.get('X-Background-Task') != '1':
+            return f(*args, **kwargs)
+        request.form  # тело читается сейчас, пока поток запроса открыт
+        task_id = uuid.uuid4().hex
+
+        @copy_current_request_context
+        def job():
+            try:
+                resp = current_app.make_response(f(*args, **kwargs))
+                result = {"done": True, "status": resp.status_code, "result": resp.get_json(silent=True)}
+            except Exception as e:
+                logger.error(f"Фоновая задача {task_id} ({f.__name__}) завершилась ошибкой: {e}", exc_info=True)
+                result = {"done": True, "status": 500, "result": {"ok": False, "error": "internal_error"}}
+            _set_admin_task(task_id, result)
+
+        _set_admin_task(task_id, {"done": False})
+        _admin_task_pool.submit(job)
+        return jsonify({"ok": True, "task_id": task_id, "status_url": url_for('admin_task_status', task_id=task_id)}), 202
+    return wrapper
+
+
+# Счётчик для пагинации пользователей: частые перерисовки при листании не пересчитывают COUNT(*).
+USERS_COUNT_TTL_SEC = 5
+_users_count_cache: dict[str, tuple[float, int]] = {}
+_users_count_lock = threading.Lock()
+
+
+def _users_count_cached(q: str) -> int:
+    now = time.monotonic()
+    with _users_count_lock:
+        hit = _users_count_cache.get(q)
+        if hit and hit[0] > now:
+            return hit[1]
+    total = get_users_count(q or None)
+    with _users_count_lock:
+        if len(_users_count_cache) > 256:
+            _users_count_cache.clear()
+        _users_count_cache[q] = (now + USERS_COUNT_TTL_SEC, total)
+    return total
+
+
+# Год для футера шаблонов: пересчитывается раз в сутки (UTC), а не на каждый рендер.
+_year_cache = [-1, 0]  # [номер суток от epoch, год]
+
+
+def _current_year() -> int:
+    day = int(time.time() // 86400)
+    if _year_cache[0] != day:
+        _year_cache[1] = datetime.utcnow().year
+        _year_cache[0] = day
+    return _year_cache[1]
+
+
+_fallback_loop: asyncio.AbstractEventLoop | None = None
+_fallback_loop_lock = threading.Lock()
+
+
+def _get_fallback_loop() -> asyncio.AbstractEventLoop:
+    """Постоянный цикл событий в фоновом потоке на случай, когда цикл бота не запущен.
+    Заменяет asyncio.run: не создаёт и не закрывает цикл на каждый вызов.
+    """
+    global _fallback_loop
+    with _fallback_loop_lock:
+        if _fallback_loop is None or _fallback_loop.is_closed():
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="panel-async-loop", daemon=True).start()
+            _fallback_loop = loop
+        return _fallback_loop
+
+
+def _bot_loop() -> asyncio.AbstractEventLoop:
+    loop = current_app.config.get('EVENT_LOOP')
+    if loop and loop.is_running():
+        return loop
+    return _get_fallback_loop()
+
+
+SERIES_MAX_AGE_SEC = 30
+
+
+def _json_with_etag(etag: str, build_payload):
+    """JSON-ответ с ETag и Cache-Control; при совпадении If-None-Match — 304 без сериализации."""
+    if request.if_none_match.contains(etag):
+        resp = Response(status=304)
+    else:
+        resp = jsonify(build_payload())
+    resp.set_etag(etag)
+    resp.cache_control.private = True
+    resp.cache_control.max_age = SERIES_MAX_AGE_SEC
+    return resp
+
+
+def _run_on_bot_loop(coro, timeout: float | None = None):
+    """Выполнить корутину в общем цикле событий бота и дождаться результата.
+
+    По истечении timeout корутина отменяется, чтобы не висеть в цикле после ответа.
+    """
+    fut = asyncio.run_coroutine_threadsafe(coro, _bot_loop())
+    try:
+        return fut.result(timeout)
+    except TimeoutError:
+        fut.cancel()
+        raise
+
+
+REMNAWAVE_CALL_TIMEOUT_SEC = 30
+
+
+def _run_remnawave(coro):
+    """Вызов Remnawave API из обработчика панели: общий цикл и сессия бота, ограниченное ожидание."""
+    return _run_on_bot_loop(coro, timeout=REMNAWAVE_CALL_TIMEOUT_SEC)
+
+
+_fire_tasks: set[asyncio.Task] = set()
+
+
+def _spawn(coro) -> None:
+    """В потоке цикла: создать задачу и держать ссылку до завершения; ошибку — в лог."""
+    task = asyncio.ensure_future(coro)
+    _fire_tasks.add(task)
+    task.add_done_callback(_on_fire_done)
+
+
+def _on_fire_done(task: asyncio.Task) -> None:
+    _fire_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.warning(f"Фоновая операция бота завершилась ошибкой: {task.exception()}")
+
+
+def _fire(loop: asyncio.AbstractEventLoop, coro) -> None:
+    """Запустить корутину в цикле без ожидания и без concurrent.futures.Future для вызывающего потока."""
+    loop.call_soon_threadsafe(_spawn, coro)
+
+
+# Уведомления пользователям из панели идут через одну очередь на цикл событий:
+# при 429 ждёт только отправитель, а не каждое сообщение по отдельности.
+NOTIFY_MAX_RETRIES = 3
+_notify_queues: dict[asyncio.AbstractEventLoop, tuple[asyncio.Queue, asyncio.Task]] = {}
+
+
+def _enqueue_notification(item: tuple) -> None:
+    """Вызывается в потоке цикла: создаёт очередь и отправителя при первом сообщении."""
+    loop = asyncio.get_running_loop()
+    entry = _notify_queues.get(loop)
+    if entry is None or entry[1].done():
+        queue: asyncio.Queue = asyncio.Queue()
+        entry = _notify_queues[loop] = (queue, loop.create_task(_notification_sender(queue)))
+    entry[0].put_nowait(item)
+
+
+async def _notification_sender(queue: asyncio.Queue) -> None:
+    while True:
+        bot, chat_id, text, kwargs, attempt = await queue.get()
+        try:
+            await bot.send_message(chat_id=chat_id, text=text, **kwargs)
+        except TelegramRetryAfter as e:
+            await asyncio.sleep(e.retry_after)
+            if attempt < NOTIFY_MAX_RETRIES:
+                queue.put_nowait((bot, chat_id, text, kwargs, attempt + 1))
+            else:
+                logger.warning(f"Уведомление {chat_id}: лимит Telegram, попытки исчерпаны")
+        except Exception as e:
+            logger.warning(f"Уведомление {chat_id}: не удалось отправить: {e}")
+
+
+def _notify(bot, chat_id: int, text: str, **kwargs) -> None:
+    """Поставить сообщение в очередь отправки в цикле бота; не ждёт доставки."""
+    if bot is None:
+        raise RuntimeError("bot is not running")
+    _bot_loop().call_soon_threadsafe(_enqueue_notification, (bot, int(chat_id), text, kwargs, 0))
+
+
+async def _broadcast(bot, ids, text: str) -> int:
+    """Отправить одно сообщение нескольким получателям параллельно; вернуть число доставленных."""
+    ids = [int(i) for i in ids]
+    results = await asyncio.gather(*(bot.send_message(i, text) for i in ids), return_exceptions=True)
+    failed = [(i, r) for i, r in zip(ids, results) if isinstance(r, BaseException)]
+    if failed:
+        logger.warning(
+            "Рассылка: не доставлено %d из %d: %s",
+            len(failed), len(ids), "; ".join(f"{i}: {r}" for i, r in failed[:5]),
+        )
+    return len(ids) - len(failed)
+
+
+REMNAWAVE_DELETE_CONCURRENCY = 20
+
+
+async def _delete_clients(pairs: list[tuple[str, str]]) -> list:
+    """Удалить клиентов на хостах параллельно (не более REMNAWAVE_DELETE_CONCURRENCY разом).
+
+    Результаты идут в порядке pairs; ошибка конкретного вызова возвращается как исключение.
+    """
+    sem = asyncio.Semaphore(REMNAWAVE_DELETE_CONCURRENCY)
+
+    async def one(host_name: str, email: str):
+        async with sem:
+            return await remnawave_api.delete_client_on_host(host_name, email)
+
+    return await asyncio.gather(*(one(h, e) for h, e in pairs), return_exceptions=True)
+
+
+DAY_MS = 86_400_000
+
+
+def _now_ms() -> int:
+    return time.time_ns() // 1_000_000
+
+
+def _expiry_to_ms(value) -> int | None:
+    """Срок ключа из БД (UTC, строка ISO/'%Y-%m-%d %H:%M:%S' или datetime) в epoch-ms."""
+    if not value:
+        return None
+    if not isinstance(value, datetime):
+        try:
+            value = datetime.fromisoformat(str(value).strip().replace('Z', '+00:00'))
+        except ValueError:
+            return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return int(value.timestamp() * 1000)
+
+
+SPEEDTEST_CONCURRENCY = 3
+SPEEDTEST_ALL_TIMEOUT_SEC = 600
+
+
+def _speedtest_concurrency() -> int:
+    """Тот же лимит параллельных спидтестов, что и у планировщика (настройка speedtest_concurrency)."""
+    try:
+        return max(1, int((get_setting("speedtest_concurrency") or "").strip() or SPEEDTEST_CONCURRENCY))
+    except Exception:
+        return SPEEDTEST_CONCURRENCY
+
+
+async def _run_speedtests(run_one, names: list[str], concurrency: int) -> list:
+    """Запустить run_one(name) для всех имён параллельно; результаты в порядке names, ошибки — исключениями."""
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one(name: str):
+        async with sem:
+            return await run_one(name)
+
+    return await asyncio.gather(*(one(n) for n in names), return_exceptions=True)
+
+
+def _collect_speedtest_results(names: list[str], results: list) -> tuple[int, list[str]]:
+    ok_count = 0
+    errors: list[str] = []
+    for name, res in zip(names, results):
+        if isinstance(res, BaseException):
+            errors.append(f"{name}: {res}")
+        elif res and res.get('ok'):
+            ok_count += 1
+        else:
+            errors.append(f"{name}: {res.get('error') if res else 'unknown'}")
+    return ok_count, errors
+
 
 def create_webhook_app(bot_controller_instance):
     global _bot_controller
@@ -118,6 +512,7 @@ def create_webhook_app(bot_controller_instance):
     )
     
 
+    flask_app.json = OrjsonProvider(flask_app)
     flask_app.config['SECRET_KEY'] = os.getenv('SHOPBOT_SECRET_KEY') or secrets.token_hex(32)
     flask_app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(days=30)
 
@@ -126,6 +521,18 @@ def create_webhook_app(bot_controller_instance):
     csrf.init_app(flask_app)
 
 
+    # Шаблоны не меняются во время работы: без проверки mtime на каждый рендер
+    # и с предварительной компиляцией, чтобы первый запрос не платил за разбор.
+    flask_app.config['TEMPLATES_AUTO_RELOAD'] = False
+    flask_app.jinja_env.auto_reload = False
+    flask_app.jinja_env.cache_size = 400
+    for template_name in flask_app.jinja_env.list_templates(extensions=['html']):
+        try:
+            flask_app.jinja_env.get_template(template_name)
+        except Exception as e:
+            logger.warning(f"Не удалось предварительно скомпилировать шаблон {template_name}: {e}")
+
+
     def _handle_promo_after_payment(metadata: dict) -> None:
         try:
             promo_code = (metadata.get('promo_code') or '').strip()
@@ -208,11 +615,7 @@ def create_webhook_app(bot_controller_instance):
                     f"🎟 Промокод {promo_code} использован пользователем {user_id} на скидку {applied_amount:.2f} RUB. "
                     f"{status_msg}"
                 )
-                for aid in admin_ids:
-                    try:
-                        asyncio.run_coroutine_threadsafe(bot.send_message(int(aid), text), loop)
-                    except Exception:
-                        continue
+                _fire(loop, _broadcast(bot, admin_ids, text))
         except Exception:
             pass
 
@@ -220,10 +623,17 @@ def create_webhook_app(bot_controller_instance):
     def inject_current_year():
 
         return {
-            'current_year': datetime.utcnow().year,
-            'csrf_token': generate_csrf
+            'current_year': _current_year(),
+            'csrf_token': _csrf_token
         }
 
+    def _csrf_token() -> str:
+        """Токен CSRF для шаблонов: повторные вызовы в партиалах берут его из flask.g."""
+        tok = g.get("_csrf_tok")
+        if tok is None:
+            tok = g._csrf_tok = generate_csrf()
+        return tok
+
     def login_required(f):
         @wraps(f)
         def decorated_function(*args, **kwargs):
@@ -234,7 +644,7 @@ def create_webhook_app(bot_controller_instance):
 
     @flask_app.route('/login', methods=['GET', 'POST'])
     def login_page():
-        settings = get_all_settings()
+        settings = get_panel_settings_cached()
         if request.method == 'POST':
             if request.form.get('username') == settings.get("panel_login") and \
                request.form.get('password') == settings.get("panel_password"):
@@ -253,23 +663,49 @@ def create_webhook_app(bot_controller_instance):
         flash('Вы успешно вышли.', 'success')
         return redirect(url_for('login_page'))
 
+    def _ticket_counts() -> dict:
+        """Счётчики тикетов, один запрос на HTTP-запрос (кэш в flask.g)."""
+        counts = g.get("_ticket_counts")
+        if counts is None:
+            try:
+                counts = rw_repo.get_ticket_counts_grouped()
+            except Exception:
+                counts = {"open": 0, "closed": 0, "all": 0}
+            g._ticket_counts = counts
+        return counts
+
+    def _dashboard_stats() -> dict:
+        """Счётчики дашборда, не более одного запроса на HTTP-запрос (кэш в flask.g)."""
+        stats = g.get("_dashboard_stats")
+        if stats is None:
+            stats = g._dashboard_stats = rw_repo.get_dashboard_stats()
+        return stats
+
+    def _wants_json() -> bool:
+        """Клиент ждёт JSON (fetch/XHR); заголовки разбираются один раз на запрос."""
+        v = g.get("_wants_json")
+        if v is None:
+            v = g._wants_json = (
+                'application/json' in (request.headers.get('Accept') or '')
+                or request.headers.get('X-Requested-With') == 'XMLHttpRequest'
+            )
+        return v
+
     def get_common_template_data():
+        cached = g.get("_common_tpl")
+        if cached is not None:
+            return cached
         bot_status = _bot_controller.get_status()
         support_bot_status = _support_bot_controller.get_status()
-        settings = get_all_settings()
-        required_for_start = ['telegram_bot_token', 'telegram_bot_username', 'admin_telegram_id']
-        required_support_for_start = ['support_bot_token', 'support_bot_username', 'admin_telegram_id']
-        all_settings_ok = all(settings.get(key) for key in required_for_start)
-        support_settings_ok = all(settings.get(key) for key in required_support_for_start)
-        try:
-            open_tickets_count = get_open_tickets_count()
-            closed_tickets_count = get_closed_tickets_count()
-            all_tickets_count = get_all_tickets_count()
-        except Exception:
-            open_tickets_count = 0
-            closed_tickets_count = 0
-            all_tickets_count = 0
-        return {
+        settings = get_panel_settings_cached()
+        derived = get_settings_derived_cached()
+        all_settings_ok = derived["all_settings_ok"]
+        support_settings_ok = derived["support_settings_ok"]
+        counts = _ticket_counts()
+        open_tickets_count = counts["open"]
+        closed_tickets_count = counts["closed"]
+        all_tickets_count = counts["all"]
+        g._common_tpl = {
             "bot_status": bot_status,
             "all_settings_ok": all_settings_ok,
             "support_bot_status": support_bot_status,
@@ -279,6 +715,7 @@ def create_webhook_app(bot_controller_instance):
             "all_tickets_count": all_tickets_count,
             "brand_title": settings.get('panel_brand_title') or 'Remnawave Control',
         }
+        return g._common_tpl
 
     @flask_app.route('/brand-title', methods=['POST'])
     @login_required
@@ -288,6 +725,7 @@ def create_webhook_app(bot_controller_instance):
             return jsonify({"ok": False, "error": "empty"}), 400
         try:
             update_setting('panel_brand_title', title)
+            _invalidate_settings_cache()
             return jsonify({"ok": True, "title": title})
         except Exception as e:
             return jsonify({"ok": False, "error": str(e)}), 500
@@ -308,17 +746,13 @@ def create_webhook_app(bot_controller_instance):
         except Exception:
             hosts = []
             ssh_targets = []
+        try:
+            latest = get_latest_speedtests_for_hosts([h['host_name'] for h in hosts])
+        except Exception:
+            latest = {}
         for h in hosts:
-            try:
-                h['latest_speedtest'] = get_latest_speedtest(h['host_name'])
-            except Exception:
-                h['latest_speedtest'] = None
-        stats = {
-            "user_count": get_user_count(),
-            "total_keys": get_total_keys_count(),
-            "total_spent": get_total_spent_sum(),
-            "host_count": len(hosts)
-        }
+            h['latest_speedtest'] = latest.get(h['host_name'])
+        stats = dict(_dashboard_stats(), host_count=len(hosts))
         
         page = request.args.get('page', 1, type=int)
         per_page = 8
@@ -354,12 +788,7 @@ def create_webhook_app(bot_controller_instance):
     @flask_app.route('/dashboard/stats.partial')
     @login_required
     def dashboard_stats_partial():
-        stats = {
-            "user_count": get_user_count(),
-            "total_keys": get_total_keys_count(),
-            "total_spent": get_total_spent_sum(),
-            "host_count": len(get_all_hosts())
-        }
+        stats = _dashboard_stats()
         common_data = get_common_template_data()
         return render_template('partials/dashboard_stats.html', stats=stats, **common_data)
 
@@ -375,7 +804,8 @@ def create_webhook_app(bot_controller_instance):
     @login_required
     def dashboard_charts_json():
         data = get_daily_stats_for_charts(days=30)
-        return jsonify(data)
+        etag = hashlib.md5(repr(data).encode()).hexdigest()
+        return _json_with_etag(etag, lambda: data)
 
 
     @flask_app.route('/monitor')
@@ -422,6 +852,7 @@ def create_webhook_app(bot_controller_instance):
 
     @flask_app.route('/monitor/series/<scope>/<name>.json')
     @login_required
+    @ttl_cached(15.0)
     def monitor_series_json(scope: str, name: str):
         try:
             hours = int(request.args.get('hours', '24') or '24')
@@ -430,7 +861,10 @@ def create_webhook_app(bot_controller_instance):
         
         try:
             series = rw_repo.get_metrics_series(scope, name, since_hours=hours, limit=1000)
-            return jsonify({"ok": True, "items": series})
+            first_ts = series[0].get('created_at') if series else ''
+            last_ts = series[-1].get('created_at') if series else ''
+            etag = hashlib.md5(f"{scope}:{name}:{hours}:{len(series)}:{first_ts}:{last_ts}".encode()).hexdigest()
+            return _json_with_etag(etag, lambda: {"ok": True, "items": series})
         except Exception as e:
             return jsonify({"ok": False, "error": str(e)}), 500
 
@@ -447,10 +881,7 @@ def create_webhook_app(bot_controller_instance):
     @flask_app.route('/support/open-count.partial')
     @login_required
     def support_open_count_partial():
-        try:
-            count = get_open_tickets_count() or 0
-        except Exception:
-            count = 0
+        count = _ticket_counts()["open"]
 
         if count and count > 0:
             html = (
@@ -471,24 +902,15 @@ def create_webhook_app(bot_controller_instance):
         q = (request.args.get('q') or '').strip()
 
 
-        users, total = get_users_paginated(page=page, per_page=per_page, q=q or None)
-        user_ids = [u['telegram_id'] for u in users]
-
-
-        try:
-            keys_counts = get_keys_counts_for_users(user_ids)
-        except Exception:
-            keys_counts = {}
+        users, total = get_users_paginated_with_key_counts(page=page, per_page=per_page, q=q or None)
 
         for user in users:
-            uid = user['telegram_id']
-
             try:
 
                 user['balance'] = float(user.get('balance') or 0.0)
             except Exception:
                 user['balance'] = 0.0
-            user['keys_count'] = int(keys_counts.get(uid, 0) or 0)
+            user['keys_count'] = int(user.get('keys_count') or 0)
 
 
         from math import ceil
@@ -504,19 +926,13 @@ def create_webhook_app(bot_controller_instance):
         page = request.args.get('page', 1, type=int)
         per_page = request.args.get('per_page', 25, type=int)
         q = (request.args.get('q') or '').strip()
-        users, total = get_users_paginated(page=page, per_page=per_page, q=q or None)
-        user_ids = [u['telegram_id'] for u in users]
-        try:
-            keys_counts = get_keys_counts_for_users(user_ids)
-        except Exception:
-            keys_counts = {}
+        users, total = get_users_paginated_with_key_counts(page=page, per_page=per_page, q=q or None)
         for user in users:
-            uid = user['telegram_id']
             try:
                 user['balance'] = float(user.get('balance') or 0.0)
             except Exception:
                 user['balance'] = 0.0
-            user['keys_count'] = int(keys_counts.get(uid, 0) or 0)
+            user['keys_count'] = int(user.get('keys_count') or 0)
         return render_template('partials/users_table.html', users=users)
 
 
@@ -546,7 +962,7 @@ def create_webhook_app(bot_controller_instance):
         page = request.args.get('page', 1, type=int)
         per_page = request.args.get('per_page', 25, type=int)
         q = (request.args.get('q') or '').strip()
-        _, total = get_users_paginated(page=page, per_page=per_page, q=q or None)
+        total = _users_count_cached(q)
         from math import ceil
         total_pages = ceil(total / per_page) if per_page else 1
         return render_template('partials/users_pagination.html', current_page=page, total_pages=total_pages, q=q)
@@ -558,7 +974,7 @@ def create_webhook_app(bot_controller_instance):
             delta = float(request.form.get('delta', '0') or '0')
         except ValueError:
 
-            wants_json = 'application/json' in (request.headers.get('Accept') or '') or request.headers.get('X-Requested-With') == 'XMLHttpRequest'
+            wants_json = _wants_json()
             if wants_json:
                 return jsonify({"ok": False, "error": "invalid_amount"}), 400
             flash('Некорректная сумма изменения баланса.', 'danger')
@@ -567,7 +983,7 @@ def create_webhook_app(bot_controller_instance):
         ok = adjust_user_balance(user_id, delta)
         message = 'Баланс изменён.' if ok else 'Не удалось изменить баланс.'
         category = 'success' if ok else 'danger'
-        wants_json = 'application/json' in (request.headers.get('Accept') or '') or request.headers.get('X-Requested-With') == 'XMLHttpRequest'
+        wants_json = _wants_json()
         if wants_json:
             return jsonify({"ok": ok, "message": message})
         flash(message, category)
@@ -578,14 +994,8 @@ def create_webhook_app(bot_controller_instance):
                 if bot:
                     sign = '+' if delta >= 0 else ''
                     text = f"💳 Ваш баланс был изменён администратором: {sign}{delta:.2f} RUB\nТекущий баланс: {get_balance(user_id):.2f} RUB"
-                    loop = current_app.config.get('EVENT_LOOP')
-                    if loop and loop.is_running():
-                        asyncio.run_coroutine_threadsafe(bot.send_message(chat_id=user_id, text=text), loop)
-                        logger.info(f"Запланирована отправка уведомления о балансе пользователю {user_id}")
-                    else:
-
-                        logger.warning("Цикл событий (EVENT_LOOP) не запущен; использую резервный asyncio.run для уведомления о балансе")
-                        asyncio.run(bot.send_message(chat_id=user_id, text=text))
+                    _notify(bot, user_id, text)
+                    logger.info(f"Запланирована отправка уведомления о балансе пользователю {user_id}")
                 else:
                     logger.warning("Экземпляр бота отсутствует; не могу отправить уведомление о балансе")
         except Exception as e:
@@ -661,7 +1071,7 @@ def create_webhook_app(bot_controller_instance):
 
         result = None
         try:
-            result = asyncio.run(remnawave_api.create_or_update_key_on_host(host_name, key_email, expiry_timestamp_ms=expiry_ms or None))
+            result = _run_remnawave(remnawave_api.create_or_update_key_on_host(host_name, key_email, expiry_timestamp_ms=expiry_ms or None))
         except Exception as e:
             logger.error(f"Не удалось создать/обновить ключ на хосте: {e}")
             result = None
@@ -696,20 +1106,14 @@ def create_webhook_app(bot_controller_instance):
                 if result and result.get('connection_string'):
                     cs = html_escape.escape(result['connection_string'])
                     text += f"\nПодключение:\n<pre><code>{cs}</code></pre>"
-                loop = current_app.config.get('EVENT_LOOP')
-                if loop and loop.is_running():
-                    asyncio.run_coroutine_threadsafe(
-                        bot.send_message(chat_id=user_id, text=text, parse_mode='HTML', disable_web_page_preview=True),
-                        loop
-                    )
-                else:
-                    asyncio.run(bot.send_message(chat_id=user_id, text=text, parse_mode='HTML', disable_web_page_preview=True))
+                _notify(bot, user_id, text, parse_mode='HTML', disable_web_page_preview=True)
         except Exception as e:
             logger.warning(f"Не удалось уведомить пользователя о новом ключе: {e}")
         return redirect(request.referrer or url_for('admin_keys_page'))
 
     @flask_app.route('/admin/keys/create-ajax', methods=['POST'])
     @login_required
+    @background_capable
     def create_key_ajax_route():
         """Создание ключа через панель: персонального либо универсального подарочного токена."""
         mode = (request.form.get('mode') or 'personal').strip()
@@ -758,10 +1162,10 @@ def create_webhook_app(bot_controller_instance):
                 return jsonify({"ok": False, "error": "user_not_found"}), 404
 
             if expiry_ms is None and days_total > 0:
-                expiry_ms = int((datetime.utcnow() + timedelta(days=days_total)).replace(tzinfo=timezone.utc).timestamp() * 1000)
+                expiry_ms = _now_ms() + days_total * DAY_MS
 
             try:
-                result = asyncio.run(remnawave_api.create_or_update_key_on_host(
+                result = _run_remnawave(remnawave_api.create_or_update_key_on_host(
                     host_name,
                     key_email,
                     expiry_timestamp_ms=expiry_ms or None,
@@ -793,14 +1197,7 @@ def create_webhook_app(bot_controller_instance):
                     if result and result.get('connection_string'):
                         cs = html_escape.escape(result['connection_string'])
                         text += f"\nПодключение:\n<pre><code>{cs}</code></pre>"
-                    loop = current_app.config.get('EVENT_LOOP')
-                    if loop and loop.is_running():
-                        asyncio.run_coroutine_threadsafe(
-                            bot.send_message(chat_id=user_id, text=text, parse_mode='HTML', disable_web_page_preview=True),
-                            loop
-                        )
-                    else:
-                        asyncio.run(bot.send_message(chat_id=user_id, text=text, parse_mode='HTML', disable_web_page_preview=True))
+                    _notify(bot, user_id, text, parse_mode='HTML', disable_web_page_preview=True)
             except Exception as e:
                 logger.warning(f"Не удалось уведомить пользователя (ajax): {e}")
 
@@ -823,21 +1220,15 @@ def create_webhook_app(bot_controller_instance):
                 except Exception:
                     return jsonify({"ok": False, "error": "invalid_expiry"}), 400
             if expiry_ms is None and days_total > 0:
-                expiry_ms = int((datetime.utcnow() + timedelta(days=days_total)).replace(tzinfo=timezone.utc).timestamp() * 1000)
+                expiry_ms = _now_ms() + days_total * DAY_MS
 
 
             base_local = f"gift-{uuid.uuid4().hex[:8]}"
-            domain = "bot.local"
-            attempt = 0
-            while True:
-                candidate_email = f"{base_local if attempt == 0 else base_local + '-' + str(attempt)}@{domain}"
-                if not rw_repo.get_key_by_email(candidate_email):
-                    break
-                attempt += 1
+            candidate_email = rw_repo.next_free_key_email(base_local, "bot.local", first_suffix=1)
 
 
             try:
-                result = asyncio.run(remnawave_api.create_or_update_key_on_host(
+                result = _run_remnawave(remnawave_api.create_or_update_key_on_host(
                     host_name,
                     candidate_email,
                     expiry_timestamp_ms=expiry_ms or None,
@@ -882,18 +1273,7 @@ def create_webhook_app(bot_controller_instance):
             return jsonify({"ok": False, "error": "invalid user_id"}), 400
         try:
             user = get_user(user_id) or {}
-            raw_username = (user.get('username') or f'user{user_id}').lower()
-            import re
-            username_slug = re.sub(r"[^a-z0-9._-]", "_", raw_username).strip("_")[:16] or f"user{user_id}"
-            base_local = f"{username_slug}"
-            candidate_local = base_local
-            attempt = 1
-            while True:
-                candidate_email = f"{candidate_local}@bot.local"
-                if not rw_repo.get_key_by_email(candidate_email):
-                    break
-                attempt += 1
-                candidate_local = f"{base_local}-{attempt}"
+            candidate_email = rw_repo.next_free_key_email(rw_repo.key_email_slug(user.get('username'), user_id))
             return jsonify({"ok": True, "email": candidate_email})
         except Exception as e:
             return jsonify({"ok": False, "error": str(e)}), 500
@@ -906,7 +1286,7 @@ def create_webhook_app(bot_controller_instance):
             key = rw_repo.get_key_by_id(key_id)
             if key:
                 try:
-                    asyncio.run(remnawave_api.delete_client_on_host(key['host_name'], key['key_email']))
+                    _run_remnawave(remnawave_api.delete_client_on_host(key['host_name'], key['key_email']))
                 except Exception:
                     pass
         except Exception:
@@ -917,6 +1297,7 @@ def create_webhook_app(bot_controller_instance):
 
     @flask_app.route('/admin/keys/<int:key_id>/adjust-expiry', methods=['POST'])
     @login_required
+    @background_capable
     def adjust_key_expiry_route(key_id: int):
         try:
             delta_days = int(request.form.get('delta_days', '0'))
@@ -925,26 +1306,17 @@ def create_webhook_app(bot_controller_instance):
         key = rw_repo.get_key_by_id(key_id)
         if not key:
             return jsonify({"ok": False, "error": "not_found"}), 404
+        if delta_days == 0:
+            # Нечего менять: без обращения к панели и записи в БД.
+            return jsonify({"ok": True, "new_expiry_ms": _expiry_to_ms(key.get('expiry_date')) or 0})
         try:
 
-            cur_expiry = key.get('expiry_date')
-            if isinstance(cur_expiry, str):
-                try:
-                    exp_dt = datetime.fromisoformat(cur_expiry)
-                except Exception:
-
-                    try:
-                        exp_dt = datetime.strptime(cur_expiry, '%Y-%m-%d %H:%M:%S')
-                    except Exception:
-                        exp_dt = datetime.utcnow()
-            else:
-                exp_dt = cur_expiry or datetime.utcnow()
-            new_dt = exp_dt + timedelta(days=delta_days)
-            new_ms = int(new_dt.timestamp() * 1000)
+            exp_ms = _expiry_to_ms(key.get('expiry_date')) or _now_ms()
+            new_ms = exp_ms + delta_days * DAY_MS
 
 
             try:
-                result = asyncio.run(remnawave_api.create_or_update_key_on_host(
+                result = _run_remnawave(remnawave_api.create_or_update_key_on_host(
                     host_name=key.get('host_name'),
                     email=key.get('key_email'),
                     expiry_timestamp_ms=new_ms
@@ -977,11 +1349,8 @@ def create_webhook_app(bot_controller_instance):
                 )
                 if user_id:
                     bot = _bot_controller.get_bot_instance()
-                    loop = current_app.config.get('EVENT_LOOP')
-                    if bot and loop and loop.is_running():
-                        asyncio.run_coroutine_threadsafe(bot.send_message(chat_id=user_id, text=text), loop)
-                    elif bot:
-                        asyncio.run(bot.send_message(chat_id=user_id, text=text))
+                    if bot:
+                        _notify(bot, user_id, text)
             except Exception:
                 pass
 
@@ -989,77 +1358,61 @@ def create_webhook_app(bot_controller_instance):
         except Exception as e:
             return jsonify({"ok": False, "error": str(e)}), 500
 
+    @flask_app.route('/admin/tasks/<task_id>')
+    @login_required
+    def admin_task_status(task_id: str):
+        task = _get_admin_task(task_id)
+        if task is None:
+            return jsonify({"ok": False, "error": "not_found"}), 404
+        if not task.get("done"):
+            return jsonify({"ok": True, "done": False}), 202
+        return jsonify({"done": True, **(task.get("result") or {})}), task.get("status", 200)
+
     @flask_app.route('/admin/keys/sweep-expired', methods=['POST'])
     @login_required
     def sweep_expired_keys_route():
         removed = 0
         failed = 0
-        now = datetime.utcnow()
-        keys = get_all_keys()
-        for k in keys:
-            exp = k.get('expiry_date')
-            exp_dt = None
-            try:
-                if isinstance(exp, str):
-                    s = exp.strip()
-                    if s:
-                        try:
-
-                            exp_dt = datetime.fromisoformat(s)
-                        except Exception:
-                            try:
-                                exp_dt = datetime.fromisoformat(s.replace('Z', '+00:00'))
-                            except Exception:
-
-                                try:
-                                    exp_dt = datetime.strptime(s, '%Y-%m-%d %H:%M:%S')
-                                except Exception:
-                                    exp_dt = None
-                else:
-                    exp_dt = exp
-            except Exception:
-                exp_dt = None
+        expired: list[tuple[dict, str]] = []
+        squad_hosts: dict[str, str] = {}
+        for k in rw_repo.get_expired_keys():
+            host_for_delete = (k.get('host_name') or '').strip()
+            if not host_for_delete:
+                try:
+                    sq = (k.get('squad_uuid') or k.get('squadUuid') or '').strip()
+                    if sq:
+                        if sq not in squad_hosts:
+                            squad = rw_repo.get_squad(sq)
+                            squad_hosts[sq] = (squad or {}).get('host_name') or ''
+                        host_for_delete = squad_hosts[sq]
+                except Exception:
+                    pass
+            expired.append((k, host_for_delete))
 
+        # Удаление на хостах одним пакетом: ошибки панели не мешают удалить ключ локально.
+        remote = [(h, k.get('key_email')) for k, h in expired if h]
+        if remote:
             try:
-                if exp_dt is not None and getattr(exp_dt, 'tzinfo', None) is not None:
-                    exp_dt = exp_dt.astimezone(timezone.utc).replace(tzinfo=None)
-            except Exception:
-                pass
-            if not exp_dt or exp_dt > now:
-                continue
+                results = _run_on_bot_loop(_delete_clients(remote))
+                for (h, email), res in zip(remote, results):
+                    if isinstance(res, BaseException):
+                        logger.warning(f"Очистка истёкших: не удалось удалить {email} на {h}: {res}")
+            except Exception as e:
+                logger.error(f"Очистка истёкших: ошибка пакетного удаления на хостах: {e}")
 
+        for k, _host in expired:
             try:
-                try:
-
-                    host_for_delete = (k.get('host_name') or '').strip()
-                    if not host_for_delete:
-                        try:
-                            sq = (k.get('squad_uuid') or k.get('squadUuid') or '').strip()
-                            if sq:
-                                squad = rw_repo.get_squad(sq)
-                                if squad and squad.get('host_name'):
-                                    host_for_delete = squad.get('host_name')
-                        except Exception:
-                            pass
-                    if host_for_delete:
-                        asyncio.run(remnawave_api.delete_client_on_host(host_for_delete, k.get('key_email')))
-                except Exception:
-                    pass
                 delete_key_by_id(k.get('key_id'))
                 removed += 1
 
                 try:
                     bot = _bot_controller.get_bot_instance()
-                    loop = current_app.config.get('EVENT_LOOP')
                     text = (
                         "Ваш ключ был автоматически удалён по истечении срока.\n"
                         f"Хост: {k.get('host_name')}\nEmail: {k.get('key_email')}\n"
                         "При необходимости вы можете оформить новый ключ."
                     )
-                    if bot and loop and loop.is_running():
-                        asyncio.run_coroutine_threadsafe(bot.send_message(chat_id=k.get('user_id'), text=text), loop)
-                    else:
-                        asyncio.run(bot.send_message(chat_id=k.get('user_id'), text=text))
+                    _notify(bot, k.get('user_id'), text)
                 except Exception:
                     pass
             except Exception:
@@ -1101,14 +1454,14 @@ def create_webhook_app(bot_controller_instance):
     def run_ssh_target_speedtest_route(target_name: str):
         logger.info(f"Панель: запущен спидтест для SSH-цели '{target_name}'")
         try:
-            res = asyncio.run(speedtest_runner.run_and_store_ssh_speedtest_for_target(target_name))
+            res = _run_on_bot_loop(speedtest_runner.run_and_store_ssh_speedtest_for_target(target_name))
         except Exception as e:
             res = {"ok": False, "error": str(e)}
         if res and res.get('ok'):
             logger.info(f"Панель: спидтест для SSH-цели '{target_name}' завершён успешно")
         else:
             logger.warning(f"Панель: спидтест для SSH-цели '{target_name}' завершился с ошибкой: {res.get('error') if res else 'unknown'}")
-        wants_json = 'application/json' in (request.headers.get('Accept') or '') or request.headers.get('X-Requested-With') == 'XMLHttpRequest'
+        wants_json = _wants_json()
         if wants_json:
             return jsonify(res)
         flash(('Тест выполнен.' if res and res.get('ok') else f"Ошибка теста: {res.get('error') if res else 'unknown'}"), 'success' if res and res.get('ok') else 'danger')
@@ -1123,24 +1476,18 @@ def create_webhook_app(bot_controller_instance):
             targets = get_all_ssh_targets()
         except Exception:
             targets = []
-        errors = []
-        ok_count = 0
-        total = 0
-        for t in targets or []:
-            name = (t.get('target_name') or '').strip()
-            if not name:
-                continue
-            total += 1
-            try:
-                res = asyncio.run(speedtest_runner.run_and_store_ssh_speedtest_for_target(name))
-                if res and res.get('ok'):
-                    ok_count += 1
-                else:
-                    errors.append(f"{name}: {res.get('error') if res else 'unknown'}")
-            except Exception as e:
-                errors.append(f"{name}: {e}")
+        names = [n for n in ((t.get('target_name') or '').strip() for t in targets or []) if n]
+        total = len(names)
+        try:
+            results = _run_on_bot_loop(
+                _run_speedtests(speedtest_runner.run_and_store_ssh_speedtest_for_target, names, _speedtest_concurrency()),
+                timeout=SPEEDTEST_ALL_TIMEOUT_SEC,
+            )
+            ok_count, errors = _collect_speedtest_results(names, results)
+        except Exception as e:
+            ok_count, errors = 0, [f"все: {e}"]
         logger.info(f"Панель: завершён спидтест ДЛЯ ВСЕХ SSH-целей: ок={ok_count}, всего={total}")
-        wants_json = 'application/json' in (request.headers.get('Accept') or '') or request.headers.get('X-Requested-With') == 'XMLHttpRequest'
+        wants_json = _wants_json()
         if wants_json:
             return jsonify({"ok": len(errors) == 0, "done": ok_count, "total": total, "errors": errors})
         if errors:
@@ -1157,19 +1504,19 @@ def create_webhook_app(bot_controller_instance):
         logger.info(f"Панель: запущен спидтест для хоста '{host_name}', метод='{method or 'both'}'")
         try:
             if method == 'ssh':
-                res = asyncio.run(speedtest_runner.run_and_store_ssh_speedtest(host_name))
+                res = _run_on_bot_loop(speedtest_runner.run_and_store_ssh_speedtest(host_name))
             elif method == 'net':
-                res = asyncio.run(speedtest_runner.run_and_store_net_probe(host_name))
+                res = _run_on_bot_loop(speedtest_runner.run_and_store_net_probe(host_name))
             else:
 
-                res = asyncio.run(speedtest_runner.run_both_for_host(host_name))
+                res = _run_on_bot_loop(speedtest_runner.run_both_for_host(host_name))
         except Exception as e:
             res = {'ok': False, 'error': str(e)}
         if res and res.get('ok'):
             logger.info(f"Панель: спидтест для хоста '{host_name}' завершён успешно")
         else:
             logger.warning(f"Панель: спидтест для хоста '{host_name}' завершился с ошибкой: {res.get('error') if res else 'unknown'}")
-        wants_json = 'application/json' in (request.headers.get('Accept') or '') or request.headers.get('X-Requested-With') == 'XMLHttpRequest'
+        wants_json = _wants_json()
         if wants_json:
             return jsonify(res)
         flash(('Тест выполнен.' if res and res.get('ok') else f"Ошибка теста: {res.get('error') if res else 'unknown'}"), 'success' if res and res.get('ok') else 'danger')
@@ -1200,23 +1547,18 @@ def create_webhook_app(bot_controller_instance):
             hosts = get_all_hosts()
         except Exception:
             hosts = []
-        errors = []
-        ok_count = 0
-        for h in hosts:
-            name = h.get('host_name')
-            if not name:
-                continue
-            try:
-                res = asyncio.run(speedtest_runner.run_both_for_host(name))
-                if res and res.get('ok'):
-                    ok_count += 1
-                else:
-                    errors.append(f"{name}: {res.get('error') if res else 'unknown'}")
-            except Exception as e:
-                errors.append(f"{name}: {e}")
+        names = [h.get('host_name') for h in hosts if h.get('host_name')]
+        try:
+            results = _run_on_bot_loop(
+                _run_speedtests(speedtest_runner.run_both_for_host, names, _speedtest_concurrency()),
+                timeout=SPEEDTEST_ALL_TIMEOUT_SEC,
+            )
+            ok_count, errors = _collect_speedtest_results(names, results)
+        except Exception as e:
+            ok_count, errors = 0, [f"все: {e}"]
         logger.info(f"Панель: завершён спидтест ДЛЯ ВСЕХ хостов: ок={ok_count}, всего={len(hosts)}")
 
-        wants_json = 'application/json' in (request.headers.get('Accept') or '') or request.headers.get('X-Requested-With') == 'XMLHttpRequest'
+        wants_json = _wants_json()
         if wants_json:
             return jsonify({"ok": len(errors) == 0, "done": ok_count, "total": len(hosts), "errors": errors})
         if errors:
@@ -1231,10 +1573,10 @@ def create_webhook_app(bot_controller_instance):
     def auto_install_speedtest_route(host_name: str):
 
         try:
-            res = asyncio.run(speedtest_runner.auto_install_speedtest_on_host(host_name))
+            res = _run_on_bot_loop(speedtest_runner.auto_install_speedtest_on_host(host_name))
         except Exception as e:
             res = {'ok': False, 'log': str(e)}
-        wants_json = 'application/json' in (request.headers.get('Accept') or '') or request.headers.get('X-Requested-With') == 'XMLHttpRequest'
+        wants_json = _wants_json()
         if wants_json:
             return jsonify({"ok": bool(res.get('ok')), "log": res.get('log')})
         flash(('Установка завершена успешно.' if res.get('ok') else 'Не удалось установить speedtest на хост.') , 'success' if res.get('ok') else 'danger')
@@ -1276,9 +1618,10 @@ def create_webhook_app(bot_controller_instance):
         per_page = 12
         tickets, total = get_tickets_paginated(page=page, per_page=per_page, status=status if status in ['open', 'closed'] else None)
         total_pages = ceil(total / per_page) if per_page else 1
-        open_count = get_open_tickets_count()
-        closed_count = get_closed_tickets_count()
-        all_count = get_all_tickets_count()
+        counts = _ticket_counts()
+        open_count = counts["open"]
+        closed_count = counts["closed"]
+        all_count = counts["all"]
         common_data = get_common_template_data()
         return render_template(
             'support.html',
@@ -1303,33 +1646,30 @@ def create_webhook_app(bot_controller_instance):
         if request.method == 'POST':
             message = (request.form.get('message') or '').strip()
             action = request.form.get('action')
+            # Один раз на запрос: бот поддержки, цикл событий и адресаты тикета.
+            bot = _support_bot_controller.get_bot_instance()
+            loop = current_app.config.get('EVENT_LOOP')
+            loop_running = bool(loop and loop.is_running())
+            user_chat_id = ticket.get('user_id')
+            forum_chat_id = ticket.get('forum_chat_id')
+            thread_id = ticket.get('message_thread_id')
             if action == 'reply':
                 if not message:
                     flash('Сообщение не может быть пустым.', 'warning')
                 else:
                     add_support_message(ticket_id, sender='admin', content=message)
                     try:
-                        bot = _support_bot_controller.get_bot_instance()
-                        loop = current_app.config.get('EVENT_LOOP')
-                        user_chat_id = ticket.get('user_id')
-                        if bot and loop and loop.is_running() and user_chat_id:
+                        if bot and loop_running and user_chat_id:
                             text = f"Ответ по тикету #{ticket_id}:\n\n{message}"
-                            asyncio.run_coroutine_threadsafe(bot.send_message(user_chat_id, text), loop)
+                            _notify(bot, user_chat_id, text)
                         else:
                             logger.error("Ответ поддержки: support-бот или цикл событий недоступны; сообщение пользователю не отправлено.")
                     except Exception as e:
                         logger.error(f"Ответ поддержки: не удалось отправить сообщение пользователю {ticket.get('user_id')} через support-бота: {e}", exc_info=True)
                     try:
-                        bot = _support_bot_controller.get_bot_instance()
-                        loop = current_app.config.get('EVENT_LOOP')
-                        forum_chat_id = ticket.get('forum_chat_id')
-                        thread_id = ticket.get('message_thread_id')
-                        if bot and loop and loop.is_running() and forum_chat_id and thread_id:
+                        if bot and loop_running and forum_chat_id and thread_id:
                             text = f"💬 Ответ админа из панели по тикету #{ticket_id}:\n\n{message}"
-                            asyncio.run_coroutine_threadsafe(
-                                bot.send_message(chat_id=int(forum_chat_id), text=text, message_thread_id=int(thread_id)),
-                                loop
-                            )
+                            _notify(bot, int(forum_chat_id), text, message_thread_id=int(thread_id))
                     except Exception as e:
                         logger.warning(f"Ответ поддержки: не удалось отзеркалить сообщение в тему форума для тикета {ticket_id}: {e}")
                     flash('Ответ отправлен.', 'success')
@@ -1337,24 +1677,14 @@ def create_webhook_app(bot_controller_instance):
             elif action == 'close':
                 if ticket.get('status') != 'closed' and set_ticket_status(ticket_id, 'closed'):
                     try:
-                        bot = _support_bot_controller.get_bot_instance()
-                        loop = current_app.config.get('EVENT_LOOP')
-                        forum_chat_id = ticket.get('forum_chat_id')
-                        thread_id = ticket.get('message_thread_id')
-                        if bot and loop and loop.is_running() and forum_chat_id and thread_id:
-                            asyncio.run_coroutine_threadsafe(
-                                bot.close_forum_topic(chat_id=int(forum_chat_id), message_thread_id=int(thread_id)),
-                                loop
-                            )
+                        if bot and loop_running and forum_chat_id and thread_id:
+                            _fire(loop, bot.close_forum_topic(chat_id=int(forum_chat_id), message_thread_id=int(thread_id)))
                     except Exception as e:
                         logger.warning(f"Закрытие тикета: не удалось закрыть тему форума для тикета {ticket_id}: {e}")
                     try:
-                        bot = _support_bot_controller.get_bot_instance()
-                        loop = current_app.config.get('EVENT_LOOP')
-                        user_chat_id = ticket.get('user_id')
-                        if bot and loop and loop.is_running() and user_chat_id:
+                        if bot and loop_running and user_chat_id:
                             text = f"✅ Ваш тикет #{ticket_id} был закрыт администратором. Вы можете создать новое обращение при необходимости."
-                            asyncio.run_coroutine_threadsafe(bot.send_message(int(user_chat_id), text), loop)
+                            _notify(bot, user_chat_id, text)
                     except Exception as e:
                         logger.warning(f"Закрытие тикета: не удалось уведомить пользователя {ticket.get('user_id')} о закрытии тикета #{ticket_id}: {e}")
                     flash('Тикет закрыт.', 'success')
@@ -1364,25 +1694,15 @@ def create_webhook_app(bot_controller_instance):
             elif action == 'open':
                 if ticket.get('status') != 'open' and set_ticket_status(ticket_id, 'open'):
                     try:
-                        bot = _support_bot_controller.get_bot_instance()
-                        loop = current_app.config.get('EVENT_LOOP')
-                        forum_chat_id = ticket.get('forum_chat_id')
-                        thread_id = ticket.get('message_thread_id')
-                        if bot and loop and loop.is_running() and forum_chat_id and thread_id:
-                            asyncio.run_coroutine_threadsafe(
-                                bot.reopen_forum_topic(chat_id=int(forum_chat_id), message_thread_id=int(thread_id)),
-                                loop
-                            )
+                        if bot and loop_running and forum_chat_id and thread_id:
+                            _fire(loop, bot.reopen_forum_topic(chat_id=int(forum_chat_id), message_thread_id=int(thread_id)))
                     except Exception as e:
                         logger.warning(f"Открытие тикета: не удалось переоткрыть тему форума для тикета {ticket_id}: {e}")
 
                     try:
-                        bot = _support_bot_controller.get_bot_instance()
-                        loop = current_app.config.get('EVENT_LOOP')
-                        user_chat_id = ticket.get('user_id')
-                        if bot and loop and loop.is_running() and user_chat_id:
+                        if bot and loop_running and user_chat_id:
                             text = f"🔓 Ваш тикет #{ticket_id} снова открыт. Вы можете продолжить переписку."
-                            asyncio.run_coroutine_threadsafe(bot.send_message(int(user_chat_id), text), loop)
+                            _notify(bot, user_chat_id, text)
                     except Exception as e:
                         logger.warning(f"Открытие тикета: не удалось уведомить пользователя {ticket.get('user_id')} об открытии тикета #{ticket_id}: {e}")
                     flash('Тикет открыт.', 'success')
@@ -1476,6 +1796,7 @@ def create_webhook_app(bot_controller_instance):
                     continue
                 if key in request.form:
                     update_setting(key, request.form.get(key))
+            _invalidate_settings_cache()
 
             flash('Настройки сохранены.', 'success')
             next_hash = (request.form.get('next_hash') or '').strip() or '#panel'
@@ -1484,13 +1805,13 @@ def create_webhook_app(bot_controller_instance):
 
         current_settings = get_all_settings()
         hosts = get_all_hosts()
+        try:
+            latest = get_latest_speedtests_for_hosts([host['host_name'] for host in hosts])
+        except Exception:
+            latest = {}
         for host in hosts:
             host['plans'] = get_plans_for_host(host['host_name'])
-
-            try:
-                host['latest_speedtest'] = get_latest_speedtest(host['host_name'])
-            except Exception:
-                host['latest_speedtest'] = None
+            host['latest_speedtest'] = latest.get(host['host_name'])
 
         try:
             ssh_targets = get_all_ssh_targets()
@@ -1586,10 +1907,10 @@ def create_webhook_app(bot_controller_instance):
     @login_required
     def auto_install_speedtest_on_target_route(target_name: str):
         try:
-            res = asyncio.run(speedtest_runner.auto_install_speedtest_on_target(target_name))
+            res = _run_on_bot_loop(speedtest_runner.auto_install_speedtest_on_target(target_name))
         except Exception as e:
             res = {'ok': False, 'log': str(e)}
-        wants_json = 'application/json' in (request.headers.get('Accept') or '') or request.headers.get('X-Requested-With') == 'XMLHttpRequest'
+        wants_json = _wants_json()
         if wants_json:
             return jsonify({"ok": bool(res.get('ok')), "log": res.get('log')})
         flash(('Установка завершена успешно.' if res.get('ok') else 'Не удалось установить speedtest на цель.') , 'success' if res.get('ok') else 'danger')
@@ -1841,14 +2162,7 @@ def create_webhook_app(bot_controller_instance):
                     kb.button(text="🆘 Написать в поддержку", url=url)
                 else:
                     kb.button(text="🆘 Поддержка", callback_data="show_help")
-                loop = current_app.config.get('EVENT_LOOP')
-                if loop and loop.is_running():
-                    asyncio.run_coroutine_threadsafe(
-                        bot.send_message(chat_id=user_id, text=text, reply_markup=kb.as_markup()),
-                        loop
-                    )
-                else:
-                    asyncio.run(bot.send_message(chat_id=user_id, text=text, reply_markup=kb.as_markup()))
+                _notify(bot, user_id, text, reply_markup=kb.as_markup())
         except Exception as e:
             logger.warning(f"Не удалось отправить уведомление о бане пользователю {user_id}: {e}")
         return redirect(url_for('users_page'))
@@ -1865,14 +2179,7 @@ def create_webhook_app(bot_controller_instance):
                 kb = InlineKeyboardBuilder()
                 kb.row(keyboards.get_main_menu_button())
                 text = "✅ Доступ к аккаунту восстановлен администратором."
-                loop = current_app.config.get('EVENT_LOOP')
-                if loop and loop.is_running():
-                    asyncio.run_coroutine_threadsafe(
-                        bot.send_message(chat_id=user_id, text=text, reply_markup=kb.as_markup()),
-                        loop
-                    )
-                else:
-                    asyncio.run(bot.send_message(chat_id=user_id, text=text, reply_markup=kb.as_markup()))
+                _notify(bot, user_id, text, reply_markup=kb.as_markup())
         except Exception as e:
             logger.warning(f"Не удалось отправить уведомление о разбане пользователю {user_id}: {e}")
         return redirect(url_for('users_page'))
@@ -1885,7 +2192,7 @@ def create_webhook_app(bot_controller_instance):
         total = len(keys_to_revoke)
 
         for key in keys_to_revoke:
-            result = asyncio.run(remnawave_api.delete_client_on_host(key['host_name'], key['key_email']))
+            result = _run_remnawave(remnawave_api.delete_client_on_host(key['host_name'], key['key_email']))
             if result:
                 success_count += 1
 
@@ -1901,11 +2208,7 @@ def create_webhook_app(bot_controller_instance):
                     f"Всего ключей: {total}\n"
                     f"Отозвано: {success_count}"
                 )
-                loop = current_app.config.get('EVENT_LOOP')
-                if loop and loop.is_running():
-                    asyncio.run_coroutine_threadsafe(bot.send_message(chat_id=user_id, text=text), loop)
-                else:
-                    asyncio.run(bot.send_message(chat_id=user_id, text=text))
+                _notify(bot, user_id, text)
         except Exception:
             pass
 
@@ -1916,7 +2219,7 @@ def create_webhook_app(bot_controller_instance):
         category = 'success' if success_count == total else 'warning'
 
 
-        wants_json = 'application/json' in (request.headers.get('Accept') or '') or request.headers.get('X-Requested-With') == 'XMLHttpRequest'
+        wants_json = _wants_json()
         if wants_json:
             return jsonify({"ok": success_count == total, "message": message, "revoked": success_count, "total": total}), 200
 
@@ -2335,6 +2638,7 @@ def create_webhook_app(bot_controller_instance):
                 flash(f"Не удалось получить access_token от YooMoney: {payload}", 'danger')
                 return redirect(url_for('settings_page', tab='payments'))
             update_setting('yoomoney_api_token', token)
+            _invalidate_settings_cache()
             flash('YooMoney: токен успешно сохранён.', 'success')
         except Exception as e:
             logger.error(f"YooMoney OAuth callback error: {e}", exc_info=True)
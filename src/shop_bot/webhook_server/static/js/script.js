@@ -19,6 +19,24 @@ document.addEventListener('DOMContentLoaded', function () {
         }catch(_){ }
     }
 
+    // POST в фоновом режиме: сервер отвечает 202 + task_id, результат забираем опросом.
+    // Возвращает обычный Response с итоговым статусом и JSON задачи.
+    window.fetchBackgroundTask = async function(url, options, pollMs){
+        const opts = Object.assign({}, options || {});
+        opts.headers = Object.assign({}, opts.headers || {}, { 'X-Background-Task': '1', 'Accept': 'application/json' });
+        const resp = await fetch(url, opts);
+        if (resp.status !== 202) return resp;
+        const started = await resp.json().catch(()=>null);
+        if (!started || !started.status_url) return resp;
+        while (true) {
+            await new Promise(r => setTimeout(r, pollMs || 700));
+            const st = await fetch(started.status_url, { cache: 'no-store', credentials: 'same-origin', headers: { 'Accept': 'application/json' } });
+            if (st.status === 202) continue;
+            const body = await st.text();
+            return new Response(body, { status: st.status, headers: { 'Content-Type': 'application/json' } });
+        }
+    }
+
     function isFullDocument(html){
         if (!html) return false;
         const s = String(html).trim().slice(0, 512).toLowerCase();